@@ -0,0 +1,60 @@
+'''
+Benchmark the MeloTTS CPU inference paths.
+
+For every path (fp32 torch, dynamic int8, ONNX Runtime) this reports the
+real-time factor (synthesis time / audio duration, lower is faster) on a fixed
+sentence set and the log-spectral distance to the fp32 output.
+
+Run from the `src` folder:
+    python -m benchmarks.bench_melo_cpu --num_threads 4
+'''
+import argparse
+import time
+
+from melo.api import TTS
+
+from tts.melo_cpu import MeloOnnxRunner, configure_cpu_threads, quality_check, quantize_int8, synthesize
+
+SENTENCES = [
+    "The quick brown fox jumps over the lazy dog.",
+    "It was the best of times, it was the worst of times, it was the age of wisdom.",
+    "Audiobooks are produced one chapter at a time on our CPU nodes.",
+    "Please remember to bring an umbrella, because the forecast calls for rain this afternoon.",
+    "Numbers such as 1984 and 3.14 are read out by the text normalizer.",
+]
+
+
+def real_time_factor(model, speaker_id, runner=None):
+    sampling_rate = model.hps.data.sampling_rate
+    synthesize(model, SENTENCES[0], speaker_id, runner)  # warm-up
+    audio_seconds = 0.0
+    start = time.perf_counter()
+    for sentence in SENTENCES:
+        audio_seconds += len(synthesize(model, sentence, speaker_id, runner)) / sampling_rate
+    return (time.perf_counter() - start) / audio_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark MeloTTS CPU inference paths')
+    parser.add_argument('--lang', type=str, default='EN', help='Melo language')
+    parser.add_argument('--speaker_id', type=str, default='EN-BR', help='Melo speaker ID')
+    parser.add_argument('--num_threads', type=int, default=None, help='Intra-op threads')
+    parser.add_argument('--interop_threads', type=int, default=None, help='Inter-op threads')
+    args = parser.parse_args()
+
+    configure_cpu_threads(args.num_threads, args.interop_threads)
+    fp32 = TTS(language=args.lang, device='cpu')
+    int8 = quantize_int8(TTS(language=args.lang, device='cpu'))
+    runner = MeloOnnxRunner(fp32, num_threads=args.num_threads, interop_threads=args.interop_threads)
+    speaker_id = fp32.hps.data.spk2id[args.speaker_id]
+
+    print(f"{'path':8s} {'RTF':>8s} {'spectral distance (dB)':>24s}")
+    print(f"{'torch':8s} {real_time_factor(fp32, speaker_id):8.3f} {0.0:24.3f}")
+    print(f"{'int8':8s} {real_time_factor(int8, speaker_id):8.3f} "
+          f"{quality_check(fp32, int8, SENTENCES, speaker_id):24.3f}")
+    print(f"{'onnx':8s} {real_time_factor(fp32, speaker_id, runner):8.3f} "
+          f"{quality_check(fp32, fp32, SENTENCES, speaker_id, runner):24.3f}")
+
+
+if __name__ == '__main__':
+    main()
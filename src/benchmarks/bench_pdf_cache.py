@@ -0,0 +1,86 @@
+'''
+Benchmark PDF extraction with a cold and a warm page cache.
+
+A synthetic text PDF is generated unless one is given. Run from the `src` folder:
+    python -m benchmarks.bench_pdf_cache --pages 400
+    python -m benchmarks.bench_pdf_cache --pdf path/to/book.pdf
+'''
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from utils.pdf_cache import PdfPageCache
+from utils.pdf_extractor import pdf_to_markdown
+
+WORDS = ('the', 'reader', 'chapter', 'voice', 'quiet', 'river', 'morning', 'letter', 'garden', 'window',
+         'distance', 'remembered', 'afterwards', 'slowly', 'between', 'almost', 'story', 'silence')
+
+
+def synthetic_pdf(path, pages, lines_per_page=45, seed=0):
+    """Write a plain text PDF (Helvetica, one column) with `pages` pages of sentence-like lines."""
+    rng = np.random.default_rng(seed)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for _ in range(pages):
+        lines = [' '.join(rng.choice(WORDS, size=12)).capitalize() + '.' for _ in range(lines_per_page)]
+        text = ' T* '.join(f"({line}) Tj" for line in lines)
+        stream = f"BT /F1 11 Tf 14 TL 60 760 Td {text} ET".encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                       b"/Contents %d 0 R >>" % len(objects))
+        page_refs.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b' '.join(page_refs), pages)
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        f.write(b''.join(b"%010d 00000 n \n" % offset for offset in offsets))
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+def timed(name, function, pages):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    print(f"{name:40s} {elapsed:8.3f} s  {pages / elapsed:10.1f} pages/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cold and warm PDF extraction')
+    parser.add_argument('--pdf', type=str, default=None, help='PDF to extract (default: a generated one)')
+    parser.add_argument('--pages', type=int, default=400, help='Pages of the generated PDF')
+    parser.add_argument('--detect_headings', action='store_true', help='Benchmark the heading-detecting extraction')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pdf_path = args.pdf
+        if pdf_path is None:
+            pdf_path = os.path.join(temp_dir, 'book.pdf')
+            synthetic_pdf(pdf_path, args.pages)
+        import pdfplumber
+        with pdfplumber.open(pdf_path) as pdf:
+            pages = len(pdf.pages)
+        print(f"{pdf_path}: {pages} pages, {os.path.getsize(pdf_path) / 1e6:.1f} MB")
+
+        cache_dir = os.path.join(temp_dir, 'cache')
+        uncached = timed('no cache', lambda: pdf_to_markdown(pdf_path, detect_headings=args.detect_headings), pages)
+        cold = timed('cold cache (extract and store)',
+                     lambda: pdf_to_markdown(pdf_path, detect_headings=args.detect_headings, cache=PdfPageCache(cache_dir)), pages)
+        # A new cache object, as in a new run: the content hash is computed again
+        warm = timed('warm cache (new run)',
+                     lambda: pdf_to_markdown(pdf_path, detect_headings=args.detect_headings, cache=PdfPageCache(cache_dir)), pages)
+        if not uncached == cold == warm:
+            raise AssertionError("Cached extraction differs from uncached extraction")
+
+
+if __name__ == '__main__':
+    main()
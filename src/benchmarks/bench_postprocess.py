@@ -0,0 +1,76 @@
+'''
+Benchmark the NumPy chunk post-processing against the pydub equivalents.
+
+pydub has no loudness measurement, so its `normalize` is peak normalization;
+the NumPy stage does gated BS.1770 loudness, which costs one IIR filter pass.
+
+Run from the `src` folder:
+    python -m benchmarks.bench_postprocess --chunks 200
+'''
+import argparse
+import time
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.effects import normalize, strip_silence
+from pydub.silence import detect_leading_silence
+
+from utils.audio_postprocess import AudioPostProcessor
+
+
+def synthetic_chunk(rng, sample_rate, seconds=8.0):
+    """Speech-like noise bursts with uneven silence at both ends and a random level."""
+    lead, tail = rng.uniform(0.1, 0.8, size=2)
+    speech = rng.standard_normal(int(sample_rate * seconds)) * rng.uniform(0.02, 0.3)
+    # Syllable-rate amplitude modulation
+    speech *= 0.5 + 0.5 * np.sin(2 * np.pi * 4 * np.arange(len(speech)) / sample_rate) ** 2
+    signal = np.concatenate([np.zeros(int(sample_rate * lead)), speech, np.zeros(int(sample_rate * tail))])
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16).tobytes()
+
+
+def run_numpy(chunks, sample_rate):
+    processor = AudioPostProcessor(target_lufs=-18.0)
+    for pcm in chunks:
+        processor.process(pcm, sample_rate, 1, 2)
+
+
+def run_pydub_trim(chunks, sample_rate):
+    # Closest pydub equivalent: trim both ends, normalize, append the pause
+    for pcm in chunks:
+        segment = AudioSegment(pcm, frame_rate=sample_rate, sample_width=2, channels=1)
+        start = detect_leading_silence(segment, silence_threshold=-45.0)
+        end = len(segment) - detect_leading_silence(segment.reverse(), silence_threshold=-45.0)
+        segment = normalize(segment[start:end], headroom=1.0)
+        segment += AudioSegment.silent(duration=350, frame_rate=sample_rate)
+
+
+def run_pydub_strip_silence(chunks, sample_rate):
+    for pcm in chunks:
+        segment = AudioSegment(pcm, frame_rate=sample_rate, sample_width=2, channels=1)
+        segment = normalize(strip_silence(segment, silence_len=300, silence_thresh=-45, padding=20), headroom=1.0)
+        segment += AudioSegment.silent(duration=350, frame_rate=sample_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chunk post-processing')
+    parser.add_argument('--chunks', type=int, default=200, help='Number of synthetic chunks')
+    parser.add_argument('--sample_rate', type=int, default=24000, help='Sample rate of the chunks')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    chunks = [synthetic_chunk(rng, args.sample_rate) for _ in range(args.chunks)]
+    audio_seconds = sum(len(pcm) for pcm in chunks) / 2 / args.sample_rate
+
+    for name, function in [('numpy (trim + R128 + pause)', run_numpy),
+                           ('pydub (leading/trailing trim + normalize)', run_pydub_trim),
+                           ('pydub (strip_silence + normalize)', run_pydub_strip_silence)]:
+        # Warm up imports and buffers before timing
+        function(chunks[:2], args.sample_rate)
+        start = time.perf_counter()
+        function(chunks, args.sample_rate)
+        elapsed = time.perf_counter() - start
+        print(f"{name:45s} {elapsed:8.3f} s  {audio_seconds / elapsed:10.1f}x real time")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+'''
+Benchmark the streaming subtitle writers and converters against the previous
+string-concatenation SRT/LRC generation.
+
+Run from the `src` folder:
+    python -m benchmarks.bench_subtitles --cues 500000
+'''
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from utils.subtitles import Cue, convert, write_lrc, write_srt
+
+
+def synthetic_cues(count, seed=0):
+    """Sentence-like cues with 1-6 s durations and short gaps, like a long audiobook."""
+    rng = np.random.default_rng(seed)
+    durations = rng.uniform(1.0, 6.0, size=count)
+    gaps = rng.uniform(0.0, 0.4, size=count)
+    starts = np.cumsum(durations + gaps) - durations - gaps + 0.5
+    lengths = rng.integers(3, 20, size=count)
+    return [Cue(float(start), float(start + duration), f"Sentence {i} has about {length} words in it.")
+            for i, (start, duration, length) in enumerate(zip(starts, durations, lengths))]
+
+
+def legacy_srt_lrc(cues, srt_path, lrc_path):
+    # The previous implementation: time.strftime per timestamp and += on one string
+    srt_content = ""
+    for i, (start, end, sentence) in enumerate(cues):
+        start_time = time.strftime('%H:%M:%S', time.gmtime(start)) + f',{int((start % 1) * 1000):03d}'
+        end_time = time.strftime('%H:%M:%S', time.gmtime(end)) + f',{int((end % 1) * 1000):03d}'
+        srt_content += f"{i+1}\n{start_time} --> {end_time}\n{sentence.strip()}\n\n"
+    with open(srt_path, 'w') as f:
+        f.write(srt_content)
+    lrc_content = ""
+    for start, _, sentence in cues:
+        start_time = time.strftime('[%M:%S', time.gmtime(start)) + f'.{int((start % 1) * 100):02d}]'
+        lrc_content += f"{start_time} {sentence.strip()}\n"
+    with open(lrc_path, 'w') as f:
+        f.write(lrc_content)
+
+
+def streaming_srt_lrc(cues, srt_path, lrc_path):
+    write_srt(cues, srt_path)
+    write_lrc(cues, lrc_path)
+
+
+def timed(name, function, cue_count):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print(f"{name:40s} {elapsed:8.3f} s  {cue_count / elapsed:12.0f} cues/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark subtitle generation and conversion')
+    parser.add_argument('--cues', type=int, default=500000, help='Number of synthetic cues')
+    args = parser.parse_args()
+
+    cues = synthetic_cues(args.cues)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        srt_path, lrc_path = os.path.join(temp_dir, 'book.srt'), os.path.join(temp_dir, 'book.lrc')
+        timed('legacy generate_srt + generate_lrc', lambda: legacy_srt_lrc(cues, srt_path, lrc_path), args.cues)
+        timed('streaming write_srt + write_lrc', lambda: streaming_srt_lrc(cues, srt_path, lrc_path), args.cues)
+        timed('convert srt -> lrc', lambda: convert(srt_path, os.path.join(temp_dir, 'out.lrc')), args.cues)
+        timed('convert srt -> vtt', lambda: convert(srt_path, os.path.join(temp_dir, 'out.vtt')), args.cues)
+        timed('convert lrc -> srt', lambda: convert(lrc_path, os.path.join(temp_dir, 'out.srt')), args.cues)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''
+Benchmark the per-chunk latency saved by caching XTTS speaker latents.
+
+Synthesizes the same chunks twice with the XTTS model: once passing the
+reference clip on every call (the previous behaviour), once with the cached
+conditioning latents.
+
+Run from the `src` folder:
+    python -m benchmarks.bench_xtts_speaker --chunks 5
+'''
+import argparse
+import os
+import tempfile
+import time
+
+from tts.coqui_xtts import coqui_tts
+from tts.speaker_cache import conditioning_settings
+
+SENTENCES = [
+    "The quick brown fox jumps over the lazy dog.",
+    "It was the best of times, it was the worst of times.",
+    "A journey of a thousand miles begins with a single step.",
+    "All that glitters is not gold.",
+    "To be, or not to be, that is the question.",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cached XTTS speaker latents')
+    parser.add_argument('--chunks', type=int, default=5, help='Number of chunks synthesized per mode')
+    parser.add_argument('--voice', type=str, default=None, help='Named voice to use instead of the example clip')
+    args = parser.parse_args()
+
+    tts = coqui_tts()
+    tts.voice = args.voice
+    tts.initialize_model()
+    xtts_model = tts.model.synthesizer.tts_model
+    clips = tts.speaker_clips()
+    chunks = [SENTENCES[i % len(SENTENCES)] for i in range(args.chunks)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_path = os.path.join(tmpdir, 'chunk.wav')
+
+        start = time.perf_counter()
+        xtts_model.get_conditioning_latents(audio_path=clips, **conditioning_settings(xtts_model.config))
+        conditioning = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for chunk in chunks:
+            tts.model.tts_to_file(chunk, file_path=output_path, speaker_wav=clips, speed=tts.speed, language=tts.lang)
+        uncached = (time.perf_counter() - start) / len(chunks)
+
+        # Warm the cache (disk and memory) before timing
+        latents = tts.speaker_latents()
+        start = time.perf_counter()
+        for chunk in chunks:
+            tts.synthesize_with_latents(chunk, output_path, *latents)
+        cached = (time.perf_counter() - start) / len(chunks)
+
+    print(f"Conditioning latents from {len(clips)} clip(s): {conditioning:.3f} s")
+    print(f"Per chunk, speaker_wav on every call:      {uncached:.3f} s")
+    print(f"Per chunk, cached speaker latents:         {cached:.3f} s")
+    print(f"Saved per chunk:                           {uncached - cached:.3f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,10 @@
 import argparse
 import os
 import logging
-from typing import List, Callable, Dict
+from typing import List, Callable, Dict, NamedTuple, Optional, Tuple
 import chardet
+import json
+import threading
 import subprocess
 
 # Third-party imports
@@ -11,7 +13,12 @@ from IPython.display import Audio, display
 
 # Local imports
 from utils.pdf_extractor import pdf_to_markdown, markdown_to_plain_text, split_text_to_chunks, add_spaces_to_text
+from utils.audio_postprocess import AudioPostProcessor
+from utils.chunk_store import ChunkStore
+from utils.pdf_cache import DEFAULT_CACHE_DIR as DEFAULT_PDF_CACHE_DIR, PdfPageCache
+from utils.chapters import ChapterEncoder, ChapterSpan, chunk_chapters, split_markdown_into_chapters
 from utils.generate_captions import get_audio_duration, split_text, calculate_sentence_durations, generate_timestamps, generate_srt, generate_lrc
+from tts.resilience import VOICE_FALLBACKS, BackendError, ResilientSynthesizer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -28,8 +35,25 @@ def google_tts_wrapper(text: str, output_file: str) -> None:
     from tts.google_tts import google_tts
     google_tts(text, output_file)
 
+# Model instances kept warm across chunks, by model name
+_MODEL_INSTANCES: Dict[str, object] = {}
+# Models are configured through attributes and are not thread-safe, so only one chunk uses them at a time
+_MODEL_LOCK = threading.RLock()
+
+def google_tts_segment_wrapper(text: str) -> Optional[AudioSegment]:
+    try:
+        from tts.google_tts import google_tts_segment
+        logging.info(f"Using google TTS tool to generate audio for text: {text[:30]}...")
+        return google_tts_segment(text)
+    except ImportError as e:
+        logging.error(f"Failed to import necessary module for google: {e}")
+        logging.error("Make sure you have installed the correct dependencies for google")
+    except Exception as e:
+        logging.error(f"General error occurred: {e}")
+    return None
+
 def create_model_wrapper(model_name: str) -> Callable:
-    def wrapper(text: str, output_file: str, use_default_params: bool) -> None:
+    def wrapper(text: str, output_file: str, use_default_params: bool, model_options: Optional[Dict] = None) -> None:
         if model_name == 'melo':
             from tts.mello_tts import melo_tts as model_class
         elif model_name == 'coqui':
@@ -37,12 +61,64 @@ def create_model_wrapper(model_name: str) -> Callable:
         else:
             raise ValueError(f"Unknown model: {model_name}")
         
-        model = model_class()
-        if not use_default_params:
-            model.prompt_user_for_parameters()
-        model.convert_to_audio(text, output_file)
+        # The model (and anything it caches, such as speaker latents) is created once and reused for every chunk
+        with _MODEL_LOCK:
+            model = _MODEL_INSTANCES.get(model_name)
+            if model is None:
+                model = model_class()
+                # Options are set before prompting, which may already load the model
+                for name, value in (model_options or {}).items():
+                    setattr(model, name, value)
+                if not use_default_params:
+                    model.prompt_user_for_parameters()
+                _MODEL_INSTANCES[model_name] = model
+            for name, value in (model_options or {}).items():
+                setattr(model, name, value)
+            model.convert_to_audio(text, output_file)
     return wrapper
 
+def create_failover_backend(tts_tool: str, use_default_params: bool = True, model_options: Optional[Dict] = None, timeout: Optional[float] = None):
+    """
+    Create a backend for the resilient synthesizer. Unlike the TTS_TOOLS functions, backends raise on failure.
+    
+    Args:
+        tts_tool: The name of the TTS tool.
+        use_default_params: Whether to use default parameters for local models.
+        model_options: Attributes to set on local model instances.
+        timeout: Seconds after which an edge request is killed, and an HTTP request of google times out.
+    """
+    from tts.resilience import Backend
+
+    if tts_tool == 'edge':
+        def synthesize(text: str, output_file: str, voice: Optional[str]) -> None:
+            from tts.edge_tts import edge_tts_synthesize
+            edge_tts_synthesize(text, output_file, voice or 'pt-BR-ThalitaNeural', timeout=timeout)
+        return Backend('edge', synthesize)
+
+    if tts_tool == 'google':
+        from tts.google_tts import GoogleTTSBackend
+        # Its own client, so its HTTP requests give up within the failover timeout
+        client = GoogleTTSBackend(timeout=timeout) if timeout else GoogleTTSBackend()
+
+        def synthesize(text: str, output_file: str, voice: Optional[str]) -> None:
+            lang, tld = (voice or 'en:us').split(':')
+            client.synthesize(text, lang=lang, tld=tld).export(output_file, format="wav")
+        return Backend('google', synthesize, close=client.close)
+
+    model_wrapper = create_model_wrapper(tts_tool)
+
+    def synthesize(text: str, output_file: str, voice: Optional[str]) -> None:
+        options = dict(model_options or {})
+        with _MODEL_LOCK:
+            if voice and tts_tool == 'melo':
+                options['lang'], options['speaker_id'] = voice.split(':')
+                model = _MODEL_INSTANCES.get('melo')
+                if model is not None and model.lang != options['lang']:
+                    model.model = None  # reload for the fallback language
+            model_wrapper(text, output_file, use_default_params, options)
+    # Local models are not hedged: a duplicate request would only compete for the same CPU
+    return Backend(tts_tool, synthesize, hedge=False)
+
 # Dictionary mapping TTS tool names to their respective functions
 TTS_TOOLS: Dict[str, Callable] = {
     'edge': edge_tts_wrapper,
@@ -51,7 +127,10 @@ TTS_TOOLS: Dict[str, Callable] = {
     'coqui': create_model_wrapper('coqui')
 }
 
-def text_to_speech(text: str, output_file: str, tts_tool: str, use_default_params: bool = True) -> None:
+# Engines tried, in this order, after --tts_tool when --failover is set
+FAILOVER_ORDER = ['edge', 'google', 'melo']
+
+def text_to_speech(text: str, output_file: str, tts_tool: str, use_default_params: bool = True, model_options: Optional[Dict] = None) -> None:
     """
     Convert text to speech using the specified TTS tool.
     
@@ -60,6 +139,7 @@ def text_to_speech(text: str, output_file: str, tts_tool: str, use_default_param
         output_file: The path to save the output audio file.
         tts_tool: The name of the TTS tool to use.
         use_default_params: Whether to use default parameters for the TTS tool.
+        model_options: Attributes to set on the model instance (melo and coqui only).
     """
     try:
         logging.info(f"Using {tts_tool} TTS tool to generate audio for text: {text[:30]}...")
@@ -70,7 +150,7 @@ def text_to_speech(text: str, output_file: str, tts_tool: str, use_default_param
         tts_function = TTS_TOOLS[tts_tool]
         
         if tts_tool in ['melo', 'coqui']:
-            tts_function(text, output_file, use_default_params)
+            tts_function(text, output_file, use_default_params, model_options)
         else:
             tts_function(text, output_file)
             
@@ -85,9 +165,29 @@ def text_to_speech(text: str, output_file: str, tts_tool: str, use_default_param
         logging.error(f"General error occurred: {e}")
 
 
-def convert_chunks_to_audio(chunks: List[str], output_folder: str, tts_tool: str, combined_output_file: str, use_default_params: bool = True) -> str:
+def convert_chunks_to_audio(chunks: List[str], output_folder: str, tts_tool: str, combined_output_file: str, use_default_params: bool = True,
+                            chapters: Optional[List[ChapterSpan]] = None, output_format: str = 'mp3', encode_workers: Optional[int] = None,
+                            postprocessor: Optional[AudioPostProcessor] = None, model_options: Optional[Dict] = None,
+                            synthesizer: Optional[ResilientSynthesizer] = None) -> Optional[str]:
     """
     Convert text chunks to audio and combine them into a single file.
+
+    Chunk audio is kept in a chunk store next to the combined file. Chunks whose
+    text has not changed since a previous run are reused, and edited chunks are
+    re-rendered in place.
+
+    When chapters are given (or the output is M4B), every chapter is encoded in
+    the background as soon as its last chunk is rendered, and the chapters are
+    joined with seekable chapter markers.
+
+    With a post-processor, chunk audio is trimmed, loudness-normalized and its
+    sentences are separated by exact pauses (paragraph pauses at blank lines and
+    at the end of each chapter) before it is stored.
+
+    With a resilient synthesizer, chunks go through its backend chain instead of
+    `tts_tool`; the backend that produced each chunk is recorded in
+    `<combined name>.backends.json`. A chunk that every backend fails on stops
+    the run instead of leaving a gap in the book.
     
     Args:
         chunks: List of text chunks to convert.
@@ -95,32 +195,248 @@ def convert_chunks_to_audio(chunks: List[str], output_folder: str, tts_tool: str
         tts_tool: The TTS tool to use for conversion.
         combined_output_file: Path for the final combined audio file.
         use_default_params: Whether to use default parameters for the TTS tool.
+        chapters: Chunk span of every chapter, in order.
+        output_format: 'mp3', or 'm4b' for AAC in an M4B container.
+        encode_workers: Number of chapters encoded in parallel. Defaults to the CPU count.
+        postprocessor: Optional post-processing applied to every chunk.
+        model_options: Attributes to set on the model instance (melo and coqui only).
+        synthesizer: Optional resilient synthesizer used instead of `tts_tool`.
     
     Returns:
-        Path to the combined audio file.
+        Path to the combined audio file, or None when no chunk has audio to export.
     """
-    combined_audio = AudioSegment.empty()
+    store_path = os.path.splitext(combined_output_file)[0] + '.chunks'
+    # A single scratch file is reused for every chunk the TTS tool writes
+    temp_output_file = os.path.join(output_folder, "chunk.tmp.mp3")
+
+    if chapters is None and output_format != 'mp3':
+        chapters = [ChapterSpan(os.path.splitext(os.path.basename(combined_output_file))[0], 0, len(chunks))]
+
+    backends_file = os.path.splitext(combined_output_file)[0] + '.backends.json'
+    chunk_backends = {}
+    if synthesizer is not None and os.path.exists(backends_file):
+        with open(backends_file, 'r', encoding='utf-8') as f:
+            chunk_backends = json.load(f)
+
+    # Stored audio is only reused (and exported) when it was rendered the same way from the same text
+    settings = render_settings(tts_tool, model_options, postprocessor, synthesizer)
+    texts = {i: render_key(chunk, settings) for i, chunk in enumerate(chunks)}
+
+    with ChunkStore(store_path) as store:
+        encoder = None
+        chapter_ends = {}
+        if chapters is not None:
+            encoder = ChapterEncoder(store, chapters, combined_output_file, output_format, encode_workers, texts=texts)
+            chapter_ends = {span.end - 1: index for index, span in enumerate(chapters) if span.end > span.start}
+
+        for i, chunk in enumerate(chunks):
+            if store.has(i, texts[i]):
+                logging.info(f"Chunk {i+1} already rendered, reusing stored audio")
+            else:
+                try:
+                    backend = render_chunk(store, i, chunk, temp_output_file, tts_tool, use_default_params,
+                                           postprocessor, paragraph_end=i in chapter_ends or i == len(chunks) - 1,
+                                           model_options=model_options, settings=settings, synthesizer=synthesizer)
+                except BackendError:
+                    # Chapters already being encoded are finished, but not joined
+                    if encoder is not None:
+                        encoder.close()
+                    raise
+                if synthesizer is not None:
+                    chunk_backends[str(i)] = backend
+                    with open(backends_file, 'w', encoding='utf-8') as f:
+                        json.dump(chunk_backends, f)
+
+            if i in chapter_ends:
+                encoder.submit(chapter_ends[i])
+
+        if store.audio_format(range(len(chunks)), texts) is None:
+            logging.error(f"No chunk could be rendered, {combined_output_file} was not written")
+            if encoder is not None:
+                encoder.close()
+            return None
+        if encoder is not None:
+            return encoder.finish()
+        store.export(combined_output_file, format="mp3", chunk_ids=range(len(chunks)), texts=texts)
+    return combined_output_file
+
+def render_settings(tts_tool: str, model_options: Optional[Dict] = None, postprocessor: Optional[AudioPostProcessor] = None,
+                    synthesizer: Optional[ResilientSynthesizer] = None) -> str:
+    """Return the description of how chunks are rendered, which stored audio is tied to."""
+    engine = tts_tool if synthesizer is None else '>'.join(backend.name for backend in synthesizer.backends)
+    return f"{engine}|{model_options!r}|{postprocessor!r}"
+
+def render_key(chunk: str, settings: str = '') -> str:
+    """Return the text a chunk is stored under: the chunk itself tied to the settings it was rendered with."""
+    return f"{settings}\n{chunk}"
+
+class ChunkAudio(NamedTuple):
+    pcm: bytes
+    sample_rate: int
+    channels: int
+    sample_width: int
+
+def synthesize_chunk(i: int, chunk: str, temp_output_file: str, tts_tool: str, use_default_params: bool = True,
+                     postprocessor: Optional[AudioPostProcessor] = None, paragraph_end: bool = False,
+                     model_options: Optional[Dict] = None, synthesizer: Optional[ResilientSynthesizer] = None) -> Tuple[Optional[ChunkAudio], Optional[str]]:
+    """
+    Synthesize a single chunk to PCM.
+    
+    Args:
+        i: Index of the chunk in the book.
+        chunk: Text of the chunk.
+        temp_output_file: Scratch file the TTS tool writes to.
+        tts_tool: The TTS tool to use for conversion.
+        use_default_params: Whether to use default parameters for the TTS tool.
+        postprocessor: Optional post-processing applied to the chunk audio. It also puts exact pauses between the
+            sentences of the chunk, and a paragraph pause at its blank lines.
+        paragraph_end: Whether the chunk ends a chapter or the book, which selects the longer pause after it.
+        model_options: Attributes to set on the model instance (melo and coqui only).
+        synthesizer: Optional resilient synthesizer used instead of `tts_tool`.
 
-    for i, chunk in enumerate(chunks):
-        temp_output_file = os.path.join(output_folder, f"chunk_{i+1}.mp3")
-        logging.info(f"Processing chunk {i+1}: {temp_output_file}")
+    Returns:
+        The chunk audio, or None if no audio was produced, and the backend that produced it when a
+        resilient synthesizer is used.
 
-        text_to_speech(chunk, temp_output_file, tts_tool, use_default_params)
+    Raises:
+        BackendError: If every backend of the resilient synthesizer failed.
+    """
+    logging.info(f"Processing chunk {i+1}")
+    backend = None
+    chunk_audio = None
+    if synthesizer is not None:
+        try:
+            backend = synthesizer.synthesize(chunk, temp_output_file)
+        except BackendError as e:
+            raise BackendError(f"Chunk {i+1} could not be synthesized. {e}") from e
+        logging.info(f"Chunk {i+1} synthesized by {backend}")
+    elif tts_tool == 'google':
+        # The Google backend returns audio in memory, so no scratch file is written
+        chunk_audio = google_tts_segment_wrapper(chunk)
+    else:
+        text_to_speech(chunk, temp_output_file, tts_tool, use_default_params, model_options)
 
+    if chunk_audio is None:
         if not os.path.exists(temp_output_file):
-            logging.warning(f"Failed to create audio file: {temp_output_file}")
-            continue
-
+            logging.warning(f"Failed to create audio for chunk {i+1}")
+            return None, backend
         try:
             chunk_audio = AudioSegment.from_file(temp_output_file)
-            combined_audio += chunk_audio
         except Exception as e:
-            logging.error(f"Error loading audio file {temp_output_file}: {e}")
-
+            logging.error(f"Error loading audio for chunk {i+1}: {e}")
         os.remove(temp_output_file)
+        if chunk_audio is None:
+            return None, backend
 
-    combined_audio.export(combined_output_file, format="mp3")
-    return combined_output_file
+    pcm, sample_width = chunk_audio.raw_data, chunk_audio.sample_width
+    if postprocessor is not None:
+        pcm, sample_width = postprocessor.process(pcm, chunk_audio.frame_rate, chunk_audio.channels, sample_width, paragraph_end, chunk)
+    return ChunkAudio(pcm, chunk_audio.frame_rate, chunk_audio.channels, sample_width), backend
+
+def render_chunk(store: ChunkStore, i: int, chunk: str, temp_output_file: str, tts_tool: str, use_default_params: bool = True,
+                 postprocessor: Optional[AudioPostProcessor] = None, paragraph_end: bool = False,
+                 model_options: Optional[Dict] = None, settings: str = '', synthesizer: Optional[ResilientSynthesizer] = None) -> Optional[str]:
+    """
+    Synthesize a single chunk and put its audio into the chunk store.
+    
+    Args:
+        store: Chunk store to write the audio to.
+        settings: Rendering settings the stored audio is tied to.
+        The other arguments are those of `synthesize_chunk`.
+
+    Returns:
+        The backend that produced the chunk when a resilient synthesizer is used.
+
+    Raises:
+        BackendError: If every backend of the resilient synthesizer failed.
+    """
+    chunk_audio, backend = synthesize_chunk(i, chunk, temp_output_file, tts_tool, use_default_params, postprocessor,
+                                            paragraph_end, model_options, synthesizer)
+    if chunk_audio is not None:
+        store.put(i, chunk_audio.pcm, chunk_audio.sample_rate, chunk_audio.channels, chunk_audio.sample_width,
+                  render_key(chunk, settings))
+    return backend
+
+def chunk_job(i: int, chunk: str, tts_tool: str, postprocessor: Optional[AudioPostProcessor] = None,
+              paragraph_end: bool = False, model_options: Optional[Dict] = None,
+              synthesizer: Optional[ResilientSynthesizer] = None) -> Dict:
+    """
+    Return the work queue payload that lets a worker render a chunk exactly as `render_chunk` would.
+
+    Workers run headless, so local models always use their default parameters; everything else
+    they need is in `model_options`.
+    """
+    job = {'index': i, 'text': chunk, 'tts_tool': tts_tool,
+           'paragraph_end': paragraph_end, 'model_options': model_options or {}, 'postprocess': None, 'failover': None}
+    if postprocessor is not None:
+        job['postprocess'] = {'sentence_pause_ms': postprocessor.sentence_pause_ms, 'paragraph_pause_ms': postprocessor.paragraph_pause_ms,
+                              'silence_threshold_db': postprocessor.silence_threshold_db, 'target_lufs': postprocessor.target_lufs,
+                              'min_pause_ms': postprocessor.min_pause_ms}
+    if synthesizer is not None:
+        job['failover'] = {'chain': [backend.name for backend in synthesizer.backends], 'timeout': synthesizer.timeout,
+                           'language': synthesizer.language}
+    return job
+
+def distribute_chunks(work_queue, chunks: List[str], combined_output_file: str, tts_tool: str,
+                      chapters: Optional[List[ChapterSpan]] = None, postprocessor: Optional[AudioPostProcessor] = None,
+                      model_options: Optional[Dict] = None, synthesizer: Optional[ResilientSynthesizer] = None,
+                      poll_interval: float = 1.0, stall_timeout: Optional[float] = None) -> Dict[int, str]:
+    """
+    Render chunks on worker processes (see worker.py) through a shared work queue.
+
+    Chunks that are not in the chunk store yet are published as jobs; their audio
+    is put into the store as the workers finish them, so a following
+    `convert_chunks_to_audio` call with the same arguments only has to encode.
+    Jobs whose worker stops renewing its lease are handed to another worker.
+
+    Args:
+        work_queue: The shared work queue (see `utils.work_queue.open_work_queue`).
+        chunks: List of text chunks to render.
+        combined_output_file: Path of the combined audio file, which the chunk store is named after.
+        poll_interval: Seconds between polls of the queue.
+        stall_timeout: Give up when no chunk has finished for this many seconds. None waits forever.
+        The other arguments are those of `convert_chunks_to_audio`.
+
+    Returns:
+        The chunks that failed on every attempt, with their last error. `convert_chunks_to_audio`
+        renders them locally.
+
+    Raises:
+        TimeoutError: If no chunk finished within `stall_timeout`, e.g. because no worker is running.
+    """
+    from utils.work_queue import collect_batch
+
+    store_path = os.path.splitext(combined_output_file)[0] + '.chunks'
+    batch = os.path.abspath(combined_output_file)
+    if chapters is None:
+        paragraph_ends = {len(chunks) - 1}
+    else:
+        paragraph_ends = {span.end - 1 for span in chapters if span.end > span.start}
+    settings = render_settings(tts_tool, model_options, postprocessor, synthesizer)
+
+    backends_file = os.path.splitext(combined_output_file)[0] + '.backends.json'
+    chunk_backends = {}
+    if synthesizer is not None and os.path.exists(backends_file):
+        with open(backends_file, 'r', encoding='utf-8') as f:
+            chunk_backends = json.load(f)
+
+    with ChunkStore(store_path) as store:
+        pending = [i for i, chunk in enumerate(chunks) if not store.has(i, render_key(chunk, settings))]
+        logging.info(f"{len(chunks) - len(pending)} chunks already rendered, distributing {len(pending)}")
+        work_queue.publish(batch, ((i, chunk_job(i, chunks[i], tts_tool, postprocessor, i in paragraph_ends,
+                                                 model_options, synthesizer)) for i in pending))
+
+        def store_result(result) -> None:
+            meta = result.meta
+            store.put(result.index, result.data, meta['sample_rate'], meta['channels'], meta['sample_width'],
+                      render_key(chunks[result.index], settings))
+            logging.info(f"Chunk {result.index+1} rendered by worker {meta['worker']}")
+            if synthesizer is not None:
+                chunk_backends[str(result.index)] = meta['backend']
+                with open(backends_file, 'w', encoding='utf-8') as f:
+                    json.dump(chunk_backends, f)
+
+        return collect_batch(work_queue, batch, pending, store_result, poll_interval, stall_timeout)
 
 def split_audio_to_chunks(audio_file: str, chunk_length_ms: int) -> List[AudioSegment]:
     """
@@ -170,19 +486,21 @@ def read_file(file_path: str, encoding: str) -> str:
         with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
             return file.read()
 
-def process_pdf(file_path: str, split_into_chunks: bool = True, max_chunk_size: int = 4096) -> List[str]:
+def process_pdf(file_path: str, split_into_chunks: bool = True, max_chunk_size: int = 4096,
+                pdf_cache: Optional[PdfPageCache] = None) -> List[str]:
     """
     Process a PDF file, converting it to text and optionally splitting into chunks.
     
     Args:
         file_path: Path to the PDF file.
         split_into_chunks: Whether to split the text into chunks.
+        pdf_cache: Optional cache of extracted pages, reused across runs.
     
     Returns:
         List of text chunks or a single text string.
     """
     logging.info("Converting PDF to markdown...")
-    markdown_text = pdf_to_markdown(file_path, page_numbers=[1])
+    markdown_text = pdf_to_markdown(file_path, cache=pdf_cache)
 
     logging.info("Converting markdown to plain text...")
     text = markdown_to_plain_text(markdown_text)
@@ -212,6 +530,186 @@ def process_text(file_path: str, encoding: str, split_into_chunks: bool = True,
     else: 
         return [text]  # Return as a single-item list for consistency
 
+def process_chapters(file_path: str, encoding: str, max_chunk_size: int = 4096,
+                     pdf_cache: Optional[PdfPageCache] = None) -> Tuple[List[str], List[ChapterSpan]]:
+    """
+    Process a PDF or Markdown/text file into chunks grouped by chapter.
+
+    Chapters start at Markdown `#` headers; in PDFs, lines set in a larger font
+    than the body text are treated as headers.
+    
+    Args:
+        file_path: Path to the PDF or text file.
+        encoding: Encoding of the text file.
+        max_chunk_size: Maximum number of characters per chunk.
+        pdf_cache: Optional cache of extracted pages, reused across runs.
+    
+    Returns:
+        List of text chunks and the chunk span of every chapter.
+    """
+    if file_path.lower().endswith('.pdf'):
+        logging.info("Converting PDF to markdown with heading detection...")
+        markdown_text = pdf_to_markdown(file_path, detect_headings=True, cache=pdf_cache)
+    else:
+        markdown_text = read_file(file_path, encoding)
+
+    chapters = split_markdown_into_chapters(markdown_text)
+    logging.info(f"Detected {len(chapters)} chapters")
+    return chunk_chapters(chapters, max_chunk_size)
+
+def convert_file_pipelined(file_path: str, encoding: str, output_folder: str, tts_tool: str, combined_output_file: str,
+                           use_default_params: bool = True, max_chunk_size: int = 4096, postprocessor: Optional[AudioPostProcessor] = None,
+                           model_options: Optional[Dict] = None, synthesizer: Optional[ResilientSynthesizer] = None,
+                           caption_name: Optional[str] = None, text_workers: int = 2, synthesis_workers: int = 1,
+                           queue_size: int = 8, pdf_cache: Optional[PdfPageCache] = None) -> str:
+    """
+    Convert a PDF or text file to a single audio file with all stages running concurrently.
+
+    Pages are extracted, re-spaced, converted to plain text and split into chunks
+    while earlier chunks are being synthesized, encoded and captioned. The stages
+    are connected by bounded queues, so the run takes about as long as its
+    slowest stage; the utilization of every stage is logged at the end. Chunks
+    are the same as in the sequential path and stored audio is reused the same way.
+
+    Args:
+        file_path: Path to the PDF or text file.
+        encoding: Encoding of the text file.
+        output_folder: Folder for temporary audio files and captions.
+        tts_tool: The TTS tool to use for conversion.
+        combined_output_file: Path for the final combined MP3 file.
+        use_default_params: Whether to use default parameters for the TTS tool.
+        max_chunk_size: Maximum number of characters per chunk.
+        postprocessor: Optional post-processing applied to every chunk.
+        model_options: Attributes to set on the model instance (melo and coqui only).
+        synthesizer: Optional resilient synthesizer used instead of `tts_tool`.
+        caption_name: When given, SRT and LRC captions are written under this name.
+        text_workers: Threads for each text stage (page extraction, re-spacing).
+        synthesis_workers: Chunks synthesized concurrently; keep 1 for local models.
+        queue_size: Capacity of the queue in front of every stage.
+        pdf_cache: Optional cache of extracted pages; cached pages skip extraction and re-spacing.
+
+    Returns:
+        Path to the combined audio file.
+    """
+    import copy
+    from utils.pdf_cache import extraction_params
+    from utils.pdf_extractor import ChunkSplitter, extract_page_text, page_text_to_markdown, pdf_page_count, respace_model_version
+    from utils.chunk_store import ChunkExporter
+    from utils.pipeline import Pipeline, Stage
+
+    stages = []
+    opened_pdfs = []
+    cached = None
+    if file_path.lower().endswith('.pdf'):
+        # pdfplumber documents are not shared between threads
+        local = threading.local()
+        params = extraction_params(1, 3, False)
+        model_version = respace_model_version()
+        if pdf_cache is not None:
+            cached = pdf_cache.open(file_path)
+
+        def extract(page_num: int) -> Tuple[int, Optional[str]]:
+            if cached is not None:
+                if cached.markdown(page_num, params, model_version) is not None:
+                    return page_num, None  # nothing to extract, the re-spaced page is cached
+                text = cached.raw(page_num, params)
+                if text is not None:
+                    return page_num, text
+            if not hasattr(local, 'pdf'):
+                import pdfplumber
+                local.pdf = pdfplumber.open(file_path)
+                opened_pdfs.append(local.pdf)
+            return page_num, extract_page_text(local.pdf.pages[page_num], cache=cached)
+
+        def respace(item: Tuple[int, Optional[str]]) -> str:
+            page_num, text = item
+            if cached is None:
+                return page_text_to_markdown(text)
+            markdown_page = cached.markdown(page_num, params, model_version)
+            if markdown_page is None:
+                markdown_page = page_text_to_markdown(text)
+                cached.put_markdown(page_num, params, model_version, markdown_page)
+            return markdown_page
+
+        if cached is not None and cached.page_count is None:
+            cached.page_count = pdf_page_count(file_path)
+        source = range(cached.page_count if cached is not None else pdf_page_count(file_path))
+        stages += [Stage('extract', extract, text_workers, queue_size),
+                   Stage('respace', respace, text_workers, queue_size),
+                   Stage('plain_text', markdown_to_plain_text, 1, queue_size)]
+    else:
+        source = [read_file(file_path, encoding)]
+
+    splitter = ChunkSplitter(max_chunk_size)
+    chunk_count = 0
+
+    def numbered(chunks: List[str], last: bool = False) -> List[Tuple[int, str, bool]]:
+        nonlocal chunk_count
+        items = [(chunk_count + offset, chunk, last and offset == len(chunks) - 1) for offset, chunk in enumerate(chunks)]
+        chunk_count += len(chunks)
+        return items
+
+    stages.append(Stage('split', lambda text: numbered(splitter.feed(text)), 1, queue_size, fan_out=True,
+                        flush=lambda: numbered(splitter.flush(), last=True)))
+    if tts_tool not in ['coqui']:
+        stages.append(Stage('chunk_spaces', lambda item: (item[0], add_spaces_to_text(item[1]), item[2]), text_workers, queue_size))
+
+    store_path = os.path.splitext(combined_output_file)[0] + '.chunks'
+    settings = render_settings(tts_tool, model_options, postprocessor, synthesizer)
+    with ChunkStore(store_path) as store, ChunkExporter(store, combined_output_file, format='mp3') as exporter:
+        worker_state = threading.local()
+
+        def synthesize(item: Tuple[int, str, bool]) -> Tuple[int, str]:
+            i, chunk, last = item
+            if store.has(i, render_key(chunk, settings)):
+                logging.info(f"Chunk {i+1} already rendered, reusing stored audio")
+            else:
+                # Every worker thread has its own scratch file and post-processor (its buffers are reused between chunks)
+                temp_output_file = os.path.join(output_folder, f"chunk.{threading.get_ident()}.tmp.mp3")
+                if not hasattr(worker_state, 'postprocessor'):
+                    worker_state.postprocessor = copy.deepcopy(postprocessor)
+                render_chunk(store, i, chunk, temp_output_file, tts_tool, use_default_params, worker_state.postprocessor,
+                             paragraph_end=last, model_options=model_options, settings=settings, synthesizer=synthesizer)
+            return i, chunk
+
+        offset = 0.0
+
+        def encode(item: Tuple[int, str]) -> Tuple[str, float, float]:
+            nonlocal offset
+            i, chunk = item
+            entry = exporter.write(i, render_key(chunk, settings))
+            start, offset = offset, offset + (entry.duration if entry is not None else 0.0)
+            return chunk, start, offset - start
+
+        def caption(item: Tuple[str, float, float]) -> list:
+            # Sentences share the duration of their own chunk, so timing errors do not add up over the book
+            chunk, start, duration = item
+            sentences = split_text(chunk)
+            if not sentences or duration <= 0:
+                return []
+            return generate_timestamps(sentences, calculate_sentence_durations(sentences, duration), initial_delay=start)
+
+        stages += [Stage('synthesize', synthesize, synthesis_workers, queue_size),
+                   Stage('encode', encode, 1, queue_size)]
+        if caption_name:
+            stages.append(Stage('caption', caption, 1, queue_size))
+
+        pipeline = Pipeline(stages)
+        try:
+            results = list(pipeline.run(source))
+        finally:
+            for pdf in opened_pdfs:
+                pdf.close()
+            if cached is not None:
+                cached.save()
+        pipeline.log_stats()
+
+    if caption_name:
+        timestamps = [timestamp for result in results for timestamp in result]
+        generate_srt(timestamps, output_folder, caption_name)
+        generate_lrc(timestamps, output_folder, caption_name)
+    return combined_output_file
+
 def main() -> None:
     """Main function to run the text-to-speech conversion process."""
     parser = argparse.ArgumentParser(description='Text to Speech Converter')
@@ -223,8 +721,45 @@ def main() -> None:
     parser.add_argument('--log_level', type=str, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], default='INFO', help='Logging level')
     parser.add_argument('--generate_captions', action='store_true', help='Generate captions for the audio')
     parser.add_argument('--use_default_params', action='store_true', help='Use default parameters for TTS')
+    parser.add_argument('--chapters', action='store_true', help='Detect chapters from headings and add chapter markers')
+    parser.add_argument('--output_format', type=str, choices=['mp3', 'm4b'], default='mp3', help='Format of the combined audio file')
+    parser.add_argument('--melo_backend', type=str, choices=['torch', 'int8', 'onnx'], default='torch', help='CPU inference path for melo')
+    parser.add_argument('--num_threads', type=int, default=None, help='Intra-op threads for melo inference')
+    parser.add_argument('--interop_threads', type=int, default=None, help='Inter-op threads for melo inference')
+    parser.add_argument('--voice', type=str, default=None, help='Named voice for coqui (a folder of reference clips in --voices_dir)')
+    parser.add_argument('--voices_dir', type=str, default=None, help='Folder of registered voices for coqui')
+    parser.add_argument('--postprocess', action='store_true', help='Trim silence, normalize loudness and insert exact pauses between chunks')
+    parser.add_argument('--sentence_pause_ms', type=float, default=350.0, help='Pause after each sentence when post-processing')
+    parser.add_argument('--paragraph_pause_ms', type=float, default=900.0, help='Pause after each paragraph (blank line) and chapter when post-processing')
+    parser.add_argument('--target_lufs', type=float, default=-18.0, help='Loudness every chunk is normalized to when post-processing')
+    parser.add_argument('--failover', action='store_true', help='Fail over from --tts_tool to the other engines (edge -> google -> melo) with timeouts and hedged requests')
+    parser.add_argument('--language', type=str, default=None, help='Language of the voices used on failover (e.g. en-US, pt-BR), required with --failover')
+    parser.add_argument('--request_timeout', type=float, default=60.0, help='Seconds a TTS engine gets per chunk on failover')
+    parser.add_argument('--encode_workers', type=int, default=None, help='Number of chapters encoded in parallel (default: CPU count)')
+    parser.add_argument('--pipeline', action='store_true', help='Run extraction, text processing, synthesis, encoding and captioning concurrently')
+    parser.add_argument('--text_workers', type=int, default=2, help='Threads per text stage with --pipeline')
+    parser.add_argument('--synthesis_workers', type=int, default=1, help='Chunks synthesized concurrently with --pipeline (network engines only)')
+    parser.add_argument('--queue_size', type=int, default=8, help='Capacity of the queue in front of every stage with --pipeline')
+    parser.add_argument('--pdf_cache_dir', type=str, default=DEFAULT_PDF_CACHE_DIR, help='Folder of the cache of extracted PDF pages')
+    parser.add_argument('--no_pdf_cache', action='store_true', help='Extract every PDF page again instead of using the page cache')
+    parser.add_argument('--queue', type=str, default=None, help='Work queue (SQLite file on shared storage, sqlite://path?wal=1 on a single host, or redis:// URL) to render chunks on worker.py processes')
+    parser.add_argument('--queue_timeout', type=float, default=600.0, help='Seconds without any chunk finished after which --queue gives up')
+    parser.add_argument('--max_attempts', type=int, default=3, help='Attempts a chunk gets on the workers before it is rendered locally with --queue')
     
     args = parser.parse_args()
+    if args.pipeline and (args.chapters or args.output_format != 'mp3'):
+        parser.error("--pipeline produces a single MP3 without chapters")
+    if args.pipeline and args.queue:
+        parser.error("--pipeline and --queue cannot be combined")
+    if args.synthesis_workers > 1 and args.tts_tool in ['melo', 'coqui']:
+        # There is one instance of each model, so extra workers would only wait for it
+        parser.error("--synthesis_workers > 1 requires a network engine (edge or google); melo and coqui synthesize one chunk at a time")
+    if args.queue and not args.use_default_params:
+        # Workers cannot prompt for model parameters, and answers given here would not reach them
+        parser.error("--queue requires --use_default_params")
+    if args.failover and args.language not in VOICE_FALLBACKS:
+        # Every engine of the chain must read the book in the same language
+        parser.error(f"--failover requires --language, one of: {', '.join(sorted(VOICE_FALLBACKS))}")
 
     setup_logging(args.log_level)
 
@@ -235,38 +770,119 @@ def main() -> None:
 
     # Determine whether to split into chunks based on the TTS tool
     split_into_chunks = True#args.tts_tool != 'coqui'
+
+    # Extracted and re-spaced PDF pages are reused across runs
+    pdf_cache = None if args.no_pdf_cache else PdfPageCache(args.pdf_cache_dir)
     
-    if args.text_path.lower().endswith('.pdf'):
-        chunks = process_pdf(args.text_path, split_into_chunks, max_chunk_size = args.chunk_length)
-    elif args.text_path.lower().endswith('.txt'):
-        chunks = process_text(args.text_path, encoding, split_into_chunks, max_chunk_size = args.chunk_length)
-    else:
-        logging.error("Unsupported file type. Please provide a PDF or TXT file.")
+    chapters = None
+    chunks = []
+    if not args.text_path.lower().endswith(('.pdf', '.txt', '.md')):
+        logging.error("Unsupported file type. Please provide a PDF, TXT or MD file.")
         return
+    elif args.pipeline:
+        # Text is extracted and chunked inside the pipeline
+        pass
+    elif args.chapters:
+        chunks, chapters = process_chapters(args.text_path, encoding, max_chunk_size = args.chunk_length, pdf_cache=pdf_cache)
+    elif args.text_path.lower().endswith('.pdf'):
+        chunks = process_pdf(args.text_path, split_into_chunks, max_chunk_size = args.chunk_length, pdf_cache=pdf_cache)
+    else:
+        chunks = process_text(args.text_path, encoding, split_into_chunks, max_chunk_size = args.chunk_length)
 
 
     if args.tts_tool not in ['coqui']:
         logging.info("Adding spaces to each chunk...")
         chunks = [add_spaces_to_text(chunk) for chunk in chunks]
 
-    combined_output_file = os.path.join(args.output_folder, f"{args.output_audio_name.split('.')[0]}.mp3")
-    
-    logging.info("Converting text chunks to a single audio file...")
-    combined_audio_file = convert_chunks_to_audio(chunks, args.output_folder, args.tts_tool, combined_output_file, args.use_default_params)
-
-    if args.generate_captions:
-        logging.info("Generating captions...")
-        text = markdown_to_plain_text(' '.join(chunks))
-        audio_duration = get_audio_duration(combined_audio_file)
-        sentences = split_text(text)
-        sentence_durations = calculate_sentence_durations(sentences, audio_duration)
-        timestamps = generate_timestamps(sentences, sentence_durations)
-        generate_srt(timestamps, args.output_folder, args.output_audio_name.split('.')[0])
-        generate_lrc(timestamps, args.output_folder, args.output_audio_name.split('.')[0])
-        logging.info(f"Captions generated and saved")
-
-    logging.info(f"Playing combined audio file {combined_audio_file}")
-    display(Audio(combined_audio_file, autoplay=True))
+    postprocessor = None
+    model_options = {}
+    if args.postprocess:
+        postprocessor = AudioPostProcessor(args.sentence_pause_ms, args.paragraph_pause_ms, target_lufs=args.target_lufs)
+        if args.tts_tool == 'melo':
+            # Pauses are inserted exactly by the post-processor instead of padding the text
+            model_options['add_pauses'] = False
+
+    if args.tts_tool == 'melo':
+        model_options.update(backend=args.melo_backend, num_threads=args.num_threads, interop_threads=args.interop_threads)
+    if args.tts_tool == 'coqui' and args.voice:
+        model_options['voice'] = args.voice
+        if args.voices_dir:
+            model_options['voices_dir'] = args.voices_dir
+
+    synthesizer = None
+    if args.failover:
+        chain = [args.tts_tool] + [tool for tool in FAILOVER_ORDER if tool != args.tts_tool]
+        logging.info(f"Failover chain: {' -> '.join(chain)}")
+        synthesizer = ResilientSynthesizer(
+            [create_failover_backend(tool, args.use_default_params, model_options, args.request_timeout) for tool in chain],
+            timeout=args.request_timeout, language=args.language)
+
+    try:
+        combined_output_file = os.path.join(args.output_folder, f"{args.output_audio_name.split('.')[0]}.{args.output_format}")
+
+        # Chunks rendered before a failure stay in the chunk store, so a rerun only renders the rest
+        kept_message = f"Rendered chunks are kept in {os.path.splitext(combined_output_file)[0]}.chunks and reused on the next run"
+
+        if args.pipeline:
+            from utils.pipeline import PipelineError
+            logging.info("Converting the file to a single audio file with pipelined stages...")
+            try:
+                combined_audio_file = convert_file_pipelined(args.text_path, encoding, args.output_folder, args.tts_tool, combined_output_file,
+                                                             args.use_default_params, args.chunk_length, postprocessor, model_options, synthesizer,
+                                                             caption_name=args.output_audio_name.split('.')[0] if args.generate_captions else None,
+                                                             text_workers=args.text_workers, synthesis_workers=args.synthesis_workers,
+                                                             queue_size=args.queue_size, pdf_cache=pdf_cache)
+            except PipelineError as e:
+                if not isinstance(e.__cause__, BackendError):
+                    raise
+                logging.error(f"{e.__cause__} {kept_message}")
+                return
+            logging.info(f"Playing combined audio file {combined_audio_file}")
+            display(Audio(combined_audio_file, autoplay=True))
+            return
+
+        if args.queue:
+            from utils.work_queue import open_work_queue
+            logging.info(f"Distributing text chunks through the work queue {args.queue}...")
+            work_queue = open_work_queue(args.queue, max_attempts=args.max_attempts)
+            try:
+                failures = distribute_chunks(work_queue, chunks, combined_output_file, args.tts_tool, chapters, postprocessor, model_options,
+                                             synthesizer, stall_timeout=args.queue_timeout)
+            except TimeoutError as e:
+                logging.error(str(e))
+                return
+            finally:
+                work_queue.close()
+            if failures:
+                logging.warning(f"{len(failures)} chunks failed on the workers and are rendered locally")
+
+        logging.info("Converting text chunks to a single audio file...")
+        try:
+            combined_audio_file = convert_chunks_to_audio(chunks, args.output_folder, args.tts_tool, combined_output_file, args.use_default_params,
+                                                          chapters=chapters, output_format=args.output_format, encode_workers=args.encode_workers,
+                                                          postprocessor=postprocessor, model_options=model_options, synthesizer=synthesizer)
+        except BackendError as e:
+            logging.error(f"{e} {kept_message}")
+            return
+        if combined_audio_file is None:
+            return
+
+        if args.generate_captions:
+            logging.info("Generating captions...")
+            text = markdown_to_plain_text(' '.join(chunks))
+            audio_duration = get_audio_duration(combined_audio_file)
+            sentences = split_text(text)
+            sentence_durations = calculate_sentence_durations(sentences, audio_duration)
+            timestamps = generate_timestamps(sentences, sentence_durations)
+            generate_srt(timestamps, args.output_folder, args.output_audio_name.split('.')[0])
+            generate_lrc(timestamps, args.output_folder, args.output_audio_name.split('.')[0])
+            logging.info(f"Captions generated and saved")
+
+        logging.info(f"Playing combined audio file {combined_audio_file}")
+        display(Audio(combined_audio_file, autoplay=True))
+    finally:
+        if synthesizer is not None:
+            synthesizer.close()
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,19 @@
 from TTS.api import TTS
+from TTS import __version__ as tts_version
+import numpy as np
 import torch
+import wave
 import os
+
+from tts.speaker_cache import DEFAULT_VOICES_DIR, SpeakerLatentCache, voice_clips
 # By using XTTS you agree to CPML license https://coqui.ai/cpml
 os.environ["COQUI_TOS_AGREED"] = "1"
+
+# Sampling settings of the model config that Xtts.synthesize passes to every inference
+INFERENCE_SETTINGS = ('temperature', 'length_penalty', 'repetition_penalty', 'top_k', 'top_p')
+# Silence TTS.api's Synthesizer.tts appends after every sentence, in samples
+SENTENCE_SILENCE_SAMPLES = 10000
+
 class coqui_tts:
     def __init__(self):
         self.speaker = 'tts_models/multilingual/multi-dataset/xtts_v2'
@@ -21,6 +32,11 @@ class coqui_tts:
         print(female_wav_path)
         self.speaker_wav = female_wav_path
 
+        # Named voice (a folder of reference clips in voices_dir); overrides speaker_wav when set
+        self.voice = None
+        self.voices_dir = DEFAULT_VOICES_DIR
+        self.speaker_cache = SpeakerLatentCache()
+
     def initialize_model(self):
         self.model = TTS(model_name=self.model_name, gpu=torch.cuda.is_available())
 
@@ -36,13 +52,47 @@ class coqui_tts:
         if self.model_name not in TTS.list_models():
             raise ValueError(f"Model name '{self.model_name}' not found in the model's list.")
 
+    def speaker_clips(self):
+        return voice_clips(self.voice, self.voices_dir) if self.voice else [self.speaker_wav]
+
+    def speaker_latents(self):
+        # Only XTTS exposes conditioning latents; other models are given the reference clip on every call
+        xtts_model = self.model.synthesizer.tts_model
+        if not hasattr(xtts_model, 'get_conditioning_latents'):
+            return None
+        return self.speaker_cache.get(xtts_model, self.speaker_clips(), self.model_name, tts_version)
+
+    def synthesize_with_latents(self, text, output_path, gpt_cond_latent, speaker_embedding):
+        synthesizer = self.model.synthesizer
+        xtts_model = synthesizer.tts_model
+        # The same generation settings and sentence gaps as tts_to_file, so only the conditioning step is skipped
+        settings = {name: getattr(synthesizer.tts_config, name) for name in INFERENCE_SETTINGS}
+        silence = np.zeros(SENTENCE_SILENCE_SAMPLES, dtype=np.float32)
+        wavs = []
+        # XTTS handles one sentence at a time, as in TTS.api's own sentence splitting
+        for sentence in synthesizer.split_into_sentences(text):
+            out = xtts_model.inference(sentence, self.lang, gpt_cond_latent, speaker_embedding, speed=self.speed, **settings)
+            wavs += [np.asarray(out['wav'], dtype=np.float32), silence]
+        wav = np.concatenate(wavs) if wavs else np.zeros(0, dtype=np.float32)
+
+        with wave.open(output_path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(synthesizer.output_sample_rate)
+            f.writeframes((np.clip(wav, -1, 1) * 32767).astype(np.int16).tobytes())
+
     def convert_to_audio(self, text, output_path):
         if self.model is None:
             self.initialize_model()
         
         try:
-            # Generate the audio file from the text
-            self.model.tts_to_file(text, file_path=output_path, speaker_wav=self.speaker_wav, speed=self.speed, language=self.lang)
+            latents = self.speaker_latents()
+            if latents is not None:
+                # Reuse the cached speaker conditioning instead of recomputing it from the clips
+                self.synthesize_with_latents(text, output_path, *latents)
+            else:
+                # Generate the audio file from the text
+                self.model.tts_to_file(text, file_path=output_path, speaker_wav=self.speaker_clips(), speed=self.speed, language=self.lang)
         except ValueError as ve:
             print(f"Error: {ve}")
         except Exception as e:
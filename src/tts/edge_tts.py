@@ -12,3 +12,8 @@ def edge_tts_CLI(text, output_file, voice_model='pt-BR-ThalitaNeural'):
   except subprocess.CalledProcessError as e:
       print(f"Command '{command}' failed with return code {e.returncode}")
       print(e.output)
+
+def edge_tts_synthesize(text, output_file, voice_model='pt-BR-ThalitaNeural', timeout=None):
+  # Same as edge_tts_CLI, but raises on failure and kills the request after `timeout` seconds
+  command = ['edge-tts', '--voice', voice_model, '--text', text, '--write-media', output_file]
+  subprocess.run(command, check=True, capture_output=True, text=True, timeout=timeout)
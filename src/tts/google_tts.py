@@ -1,13 +1,135 @@
 # Code for Google TTS
+import io
+import re
+import base64
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
 from gtts import gTTS
-import pdfplumber
+from gtts.tts import gTTSError
 from pydub import AudioSegment
 
-def google_tts(text, audio_path, lang='en', tld='us'):
-    # Convert text to audio using gTTS
-    tts = gTTS(text=text, lang=lang, tld=tld)
-    tts.save("temp.mp3")
+try:
+    from gtts.utils import _translate_url
+except ImportError:
+    _translate_url = None
+
+'''
+gTTS splits text into ~100 character pieces and fetches them one after another,
+each with a new HTTP session, and only writes to files. GoogleTTSBackend uses
+gTTS for tokenizing and request packaging but fetches the pieces of a chunk
+concurrently over one pooled session and assembles the MP3 bytes in memory.
+
+Those gTTS internals are private, so requirements.txt pins the gTTS releases they
+were checked against. With a gTTS that lacks them, the backend falls back to the
+public `gTTS.stream()`, which fetches the pieces one after another.
+'''
+
+# Private gTTS attributes the concurrent fetch is built on
+_GTTS_INTERNALS = ('_tokenize', '_package_rpc', 'GOOGLE_TTS_HEADERS')
+
+
+def has_gtts_internals():
+    """Whether the installed gTTS has the private request packaging the concurrent fetch uses."""
+    return _translate_url is not None and all(hasattr(gTTS, name) for name in _GTTS_INTERNALS)
+
+_AUDIO_PATTERN = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+
+class GoogleTTSBackend:
+    def __init__(self, max_workers=8, timeout=30, base_url=None):
+        """
+        Args:
+            max_workers: Pieces fetched concurrently (and pooled connections kept open).
+            timeout: Seconds per HTTP request.
+            base_url: Override of the translate endpoint, e.g. a local stand-in for tests.
+        """
+        self.timeout = timeout
+        self.base_url = base_url
+        self.concurrent = has_gtts_internals()
+        if not self.concurrent:
+            logging.warning("The installed gTTS lacks the internals used to fetch pieces concurrently; "
+                            "falling back to gTTS.stream(), one piece at a time")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # gTTS objects are only used to tokenize and package requests; one per voice is enough
+        self._packagers = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    def _packager(self, lang, tld, slow):
+        with self._lock:
+            key = (lang, tld, slow)
+            if key not in self._packagers:
+                self._packagers[key] = gTTS(text='.', lang=lang, tld=tld, slow=slow, lang_check=False)
+            return self._packagers[key]
 
-    # Optionally convert to WAV format
-    audio = AudioSegment.from_mp3("temp.mp3")
-    audio.export(audio_path, format="wav")
\ No newline at end of file
+    def _fetch_piece(self, url, body, packager):
+        try:
+            response = self.session.post(url, data=body, headers=gTTS.GOOGLE_TTS_HEADERS, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            raise gTTSError(tts=packager, response=response)
+        except requests.exceptions.RequestException:
+            raise gTTSError(tts=packager)
+
+        audio = []
+        for line in response.text.splitlines():
+            if 'jQ1olc' in line:
+                match = _AUDIO_PATTERN.search(line)
+                if not match:
+                    # Good response, but no audio stream in it
+                    raise gTTSError(tts=packager, response=response)
+                audio.append(base64.b64decode(match.group(1)))
+        if not audio:
+            raise gTTSError(tts=packager, response=response)
+        return b''.join(audio)
+
+    def fetch(self, text, lang='en', tld='us', slow=False):
+        """Return the MP3 bytes of `text`, with its pieces fetched concurrently and joined in order."""
+        if not self.concurrent:
+            return b''.join(gTTS(text=text, lang=lang, tld=tld, slow=slow, lang_check=False).stream())
+        packager = self._packager(lang, tld, slow)
+        url = self.base_url or _translate_url(tld=tld, path="_/TranslateWebserverUi/data/batchexecute")
+        bodies = [packager._package_rpc(part) for part in packager._tokenize(text)]
+        if not bodies:
+            raise ValueError("No text to send to the Google TTS API")
+        # MP3 frames are self-contained, so the pieces concatenate into one stream
+        return b''.join(self.executor.map(lambda body: self._fetch_piece(url, body, packager), bodies))
+
+    def synthesize(self, text, lang='en', tld='us', slow=False):
+        """Return `text` as an AudioSegment, decoded in memory."""
+        return AudioSegment.from_file(io.BytesIO(self.fetch(text, lang, tld, slow)), format='mp3')
+
+
+_default_backend = None
+_default_backend_lock = threading.Lock()
+
+
+def default_backend():
+    """Return the process-wide backend, so every chunk shares the same connection pool."""
+    global _default_backend
+    with _default_backend_lock:
+        if _default_backend is None:
+            _default_backend = GoogleTTSBackend()
+        return _default_backend
+
+
+def google_tts_segment(text, lang='en', tld='us'):
+    # Convert text to an AudioSegment without touching the disk
+    return default_backend().synthesize(text, lang=lang, tld=tld)
+
+
+def google_tts(text, audio_path, lang='en', tld='us'):
+    # Convert text to audio using gTTS and save it in WAV format
+    audio = google_tts_segment(text, lang=lang, tld=tld)
+    audio.export(audio_path, format="wav")
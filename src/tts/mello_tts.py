@@ -1,5 +1,6 @@
 # Code for Mello TTS
 from melo.api import TTS
+import soundfile
 import re
 
 class melo_tts:
@@ -10,12 +11,32 @@ class melo_tts:
         self.speaker_id = 'EN-BR'
         self.model = None
         self.speaker_ids = None
+        # Pad sentences with ellipses to lengthen pauses; not needed when pauses are inserted in post-processing
+        self.add_pauses = True
+        # CPU inference path: 'torch' (fp32), 'int8' (dynamic quantization) or 'onnx' (ONNX Runtime)
+        self.backend = 'torch'
+        self.num_threads = None
+        self.interop_threads = None
+        self.onnx_runner = None
 
     def initialize_model(self):
+        from tts.melo_cpu import CPU_BACKENDS, MeloOnnxRunner, configure_cpu_threads, quantize_int8
+
+        if self.backend not in CPU_BACKENDS:
+            raise ValueError(f"Unknown backend '{self.backend}', expected one of {CPU_BACKENDS}")
+        configure_cpu_threads(self.num_threads, self.interop_threads)
+        # The optimized paths are CPU-only
+        device = self.device if self.backend == 'torch' else 'cpu'
+
         # Initialize the TTS model
-        self.model = TTS(language=self.lang, device=self.device)
+        self.model = TTS(language=self.lang, device=device)
         self.speaker_ids = self.model.hps.data.spk2id
 
+        if self.backend == 'int8':
+            quantize_int8(self.model)
+        elif self.backend == 'onnx':
+            self.onnx_runner = MeloOnnxRunner(self.model, num_threads=self.num_threads, interop_threads=self.interop_threads)
+
     def prompt_user_for_parameters(self):
         # Prompt the user for optional input with default values
         speed_input = input("Enter the speed (default: 1.0): ") or "1.0"
@@ -42,10 +63,15 @@ class melo_tts:
         
         try:
             # Preprocess the text to handle pauses better
-            text = self.preprocess_text(text)
+            if self.add_pauses:
+                text = self.preprocess_text(text)
 
             # Generate the audio file from the text
-            self.model.tts_to_file(text, self.speaker_ids[self.speaker_id], output_path=output_path, speed=self.speed)
+            if self.onnx_runner is not None:
+                audio = self.onnx_runner.tts_to_array(text, self.speaker_ids[self.speaker_id], speed=self.speed)
+                soundfile.write(output_path, audio, self.model.hps.data.sampling_rate, format='WAV')
+            else:
+                self.model.tts_to_file(text, self.speaker_ids[self.speaker_id], output_path=output_path, speed=self.speed)
         except ValueError as ve:
             print(f"Error: {ve}")
         except Exception as e:
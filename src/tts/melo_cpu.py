@@ -0,0 +1,187 @@
+# CPU inference paths for Mello TTS
+import os
+import re
+import logging
+from importlib import metadata
+
+import numpy as np
+import torch
+
+'''
+MeloTTS runs on CPU-only nodes, so besides the default fp32 torch path there are
+two optimized ones:
+
+* int8: dynamic int8 quantization of the Linear layers of the synthesizer.
+* onnx: the synthesizer exported once to ONNX and run through ONNX Runtime.
+
+Text processing and BERT features are computed by Melo in torch for every path;
+only the synthesizer itself is swapped.
+'''
+
+CPU_BACKENDS = ('torch', 'int8', 'onnx')
+DEFAULT_ONNX_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'text-to-speech-toolbox', 'melo')
+
+_ONNX_INPUTS = ['x', 'x_lengths', 'sid', 'tone', 'language', 'bert', 'ja_bert',
+                'noise_scale', 'length_scale', 'noise_scale_w', 'sdp_ratio']
+
+
+def configure_cpu_threads(num_threads=None, interop_threads=None):
+    """Set torch intra-op and inter-op thread counts. Inter-op threads can only be set before torch starts any parallel work."""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            logging.warning(f"Could not set inter-op threads: {e}")
+
+
+def quantize_int8(melo_model):
+    """Replace the synthesizer of a Melo TTS model with a dynamically int8-quantized copy of its Linear layers."""
+    melo_model.model = torch.ao.quantization.quantize_dynamic(melo_model.model, {torch.nn.Linear}, dtype=torch.qint8)
+    return melo_model
+
+
+class _InferWrapper(torch.nn.Module):
+    """Exposes SynthesizerTrn.infer as forward() with tensor arguments for ONNX export."""
+
+    def __init__(self, synthesizer):
+        super().__init__()
+        self.synthesizer = synthesizer
+
+    def forward(self, x, x_lengths, sid, tone, language, bert, ja_bert, noise_scale, length_scale, noise_scale_w, sdp_ratio):
+        return self.synthesizer.infer(x, x_lengths, sid, tone, language, bert, ja_bert, noise_scale=noise_scale,
+                                      length_scale=length_scale, noise_scale_w=noise_scale_w, sdp_ratio=sdp_ratio)[0]
+
+
+def _text_inputs(melo_model, text):
+    """Yield Melo's per-piece synthesizer inputs (as numpy arrays) for `text`, like TTS.tts_to_file does."""
+    from melo import utils
+
+    language = melo_model.language
+    for piece in melo_model.split_sentences_into_pieces(text, language, quiet=True):
+        if language in ['EN', 'ZH_MIX_EN']:
+            piece = re.sub(r'([a-z])([A-Z])', r'\1 \2', piece)
+        bert, ja_bert, phones, tones, lang_ids = utils.get_text_for_tts_infer(
+            piece, language, melo_model.hps, 'cpu', melo_model.symbol_to_id)
+        yield {
+            'x': phones.unsqueeze(0).numpy(),
+            'x_lengths': np.array([phones.size(0)], dtype=np.int64),
+            'tone': tones.unsqueeze(0).numpy(),
+            'language': lang_ids.unsqueeze(0).numpy(),
+            'bert': bert.unsqueeze(0).numpy(),
+            'ja_bert': ja_bert.unsqueeze(0).numpy(),
+        }
+
+
+def export_onnx(melo_model, onnx_path):
+    """Export the synthesizer of a Melo TTS model to ONNX."""
+    inputs = next(_text_inputs(melo_model, "This sentence is used to trace the model."))
+    args = tuple(torch.from_numpy(inputs[name]) for name in ['x', 'x_lengths']) + (torch.LongTensor([0]),) + \
+        tuple(torch.from_numpy(inputs[name]) for name in ['tone', 'language', 'bert', 'ja_bert']) + \
+        tuple(torch.tensor(value) for value in [0.6, 1.0, 0.8, 0.2])
+
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    logging.info(f"Exporting Melo synthesizer to {onnx_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            _InferWrapper(melo_model.model.eval()), args, onnx_path, input_names=_ONNX_INPUTS, output_names=['audio'],
+            dynamic_axes={'x': {1: 'phonemes'}, 'tone': {1: 'phonemes'}, 'language': {1: 'phonemes'},
+                          'bert': {2: 'phonemes'}, 'ja_bert': {2: 'phonemes'}, 'audio': {2: 'samples'}},
+            opset_version=17)
+    return onnx_path
+
+
+class MeloOnnxRunner:
+    def __init__(self, melo_model, onnx_path=None, num_threads=None, interop_threads=None):
+        """
+        Run the synthesizer of a Melo TTS model through ONNX Runtime, exporting it on first use.
+
+        Args:
+            melo_model: The loaded `melo.api.TTS` model; used for text processing and export.
+            onnx_path: Where the exported model is stored. Defaults to a per-language file in the user cache.
+            num_threads: ONNX Runtime intra-op threads.
+            interop_threads: ONNX Runtime inter-op threads.
+        """
+        import onnxruntime
+
+        self.melo_model = melo_model
+        if onnx_path is None:
+            try:
+                version = metadata.version('melotts')
+            except metadata.PackageNotFoundError:
+                version = 'unknown'
+            onnx_path = os.path.join(DEFAULT_ONNX_DIR, f"melo_{melo_model.language}_{version}.onnx")
+        if not os.path.exists(onnx_path):
+            export_onnx(melo_model, onnx_path)
+
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        if interop_threads:
+            options.inter_op_num_threads = interop_threads
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+
+    def tts_to_array(self, text, speaker_id, sdp_ratio=0.2, noise_scale=0.6, noise_scale_w=0.8, speed=1.0):
+        """Synthesize `text` and return the audio as a float array at the model's sampling rate."""
+        audio_list = []
+        for inputs in _text_inputs(self.melo_model, text):
+            inputs.update({
+                'sid': np.array([speaker_id], dtype=np.int64),
+                'noise_scale': np.array(noise_scale, dtype=np.float32),
+                'length_scale': np.array(1.0 / speed, dtype=np.float32),
+                'noise_scale_w': np.array(noise_scale_w, dtype=np.float32),
+                'sdp_ratio': np.array(sdp_ratio, dtype=np.float32),
+            })
+            audio_list.append(self.session.run(None, inputs)[0][0, 0])
+        return self.melo_model.audio_numpy_concat(audio_list, sr=self.melo_model.hps.data.sampling_rate, speed=speed)
+
+
+def spectral_distance(reference, candidate, n_fft=1024, hop_length=256):
+    """
+    Log-spectral distance in dB between two signals, over their common length.
+
+    0 means identical magnitude spectra.
+    """
+    length = min(len(reference), len(candidate))
+    if length < n_fft:
+        raise ValueError("Signals are too short to compare")
+    window = np.hanning(n_fft)
+
+    def magnitude(signal):
+        signal = np.asarray(signal[:length], dtype=np.float64)
+        frames = np.lib.stride_tricks.sliding_window_view(signal, n_fft)[::hop_length] * window
+        return np.abs(np.fft.rfft(frames, axis=1))
+
+    reference, candidate = magnitude(reference), magnitude(candidate)
+    # Bins more than 80 dB below the reference peak are treated as silence
+    floor = max(reference.max(), 1e-8) * 1e-4
+    difference = 20 * np.log10(np.maximum(reference, floor) / np.maximum(candidate, floor))
+    return float(np.mean(np.sqrt(np.mean(difference ** 2, axis=1))))
+
+
+def synthesize(melo_model, text, speaker_id, onnx_runner=None, **kwargs):
+    """Synthesize `text` to an array with either the torch synthesizer of `melo_model` or an ONNX runner."""
+    if onnx_runner is not None:
+        return onnx_runner.tts_to_array(text, speaker_id, **kwargs)
+    return melo_model.tts_to_file(text, speaker_id, None, quiet=True, **kwargs)
+
+
+def quality_check(reference_model, candidate_model, sentences, speaker_id, candidate_runner=None):
+    """
+    Compare an optimized path against the fp32 model on `sentences`.
+
+    Sampling noise is disabled on both sides so the only difference left is the
+    one introduced by quantization or export.
+
+    Returns:
+        The mean log-spectral distance in dB.
+    """
+    deterministic = {'noise_scale': 0.0, 'noise_scale_w': 0.0}
+    distances = []
+    for sentence in sentences:
+        reference = synthesize(reference_model, sentence, speaker_id, **deterministic)
+        candidate = synthesize(candidate_model, sentence, speaker_id, candidate_runner, **deterministic)
+        distances.append(spectral_distance(reference, candidate))
+    return float(np.mean(distances))
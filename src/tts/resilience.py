@@ -0,0 +1,229 @@
+# Resilient synthesis across TTS backends
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+'''
+Network TTS engines have long latency tails and fail now and then. The
+ResilientSynthesizer wraps a chain of backends (e.g. edge -> google -> melo):
+
+* every request has a timeout;
+* once a request has been running longer than the backend's observed p95
+  latency, a duplicate (hedged) request is sent and whichever finishes first wins;
+* each backend has a circuit breaker, so a backend that keeps failing is skipped
+  for a while instead of being waited on for every chunk;
+* when a backend fails, the next one in the chain is tried with the voice the
+  voice policy assigns to it for the same language.
+'''
+
+# Voices per language for each backend, so a fallback keeps the language (and as far as possible the kind of voice).
+# google voices are 'lang:tld', melo voices are 'LANGUAGE:speaker_id'.
+VOICE_FALLBACKS: Dict[str, Dict[str, str]] = {
+    'en-US': {'edge': 'en-US-AriaNeural', 'google': 'en:us', 'melo': 'EN:EN-US'},
+    'en-GB': {'edge': 'en-GB-SoniaNeural', 'google': 'en:co.uk', 'melo': 'EN:EN-BR'},
+    'es-ES': {'edge': 'es-ES-ElviraNeural', 'google': 'es:es', 'melo': 'ES:ES'},
+    'fr-FR': {'edge': 'fr-FR-DeniseNeural', 'google': 'fr:fr', 'melo': 'FR:FR'},
+    'pt-BR': {'edge': 'pt-BR-ThalitaNeural', 'google': 'pt:com.br'},
+}
+
+
+def _remove_quietly(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class BackendError(Exception):
+    """Raised when a backend (or every backend in the chain) fails to synthesize a chunk."""
+
+
+class Backend(NamedTuple):
+    name: str
+    # synthesize(text, output_file, voice) writes the audio to output_file or raises
+    synthesize: Callable[[str, str, Optional[str]], None]
+    # Only backends that are safe to call concurrently (network engines) are hedged
+    hedge: bool = True
+    # Releases the backend's clients (connection pools, threads) when the synthesizer is closed
+    close: Optional[Callable[[], None]] = None
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        """
+        Stop calling a backend after `failure_threshold` consecutive failures.
+
+        After `reset_timeout` seconds a single trial request is let through (half-open);
+        its outcome closes the circuit again or re-opens it.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == 'half_open':
+                # Let one trial through and hold the rest until it reports back
+                self.opened_at = self.clock()
+                return True
+            return state == 'closed'
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200, min_samples: int = 5):
+        """Rolling window of successful request latencies of one backend."""
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Return the latency percentile, or None until enough requests have been observed."""
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class ResilientSynthesizer:
+    def __init__(self, backends: List[Backend], timeout: float = 60.0, hedge_percentile: float = 95.0,
+                 failure_threshold: int = 3, reset_timeout: float = 30.0, language: Optional[str] = None,
+                 voice_policy: Dict[str, Dict[str, str]] = VOICE_FALLBACKS, max_workers: int = 16):
+        """
+        Synthesize chunks with timeouts, hedged requests, circuit breakers and failover.
+
+        Args:
+            backends: Backends in failover order.
+            timeout: Seconds a backend gets for one chunk (including its hedged duplicate).
+            hedge_percentile: Latency percentile after which a duplicate request is sent.
+            failure_threshold: Consecutive failures that open a backend's circuit.
+            reset_timeout: Seconds an open circuit waits before letting a trial request through.
+            language: Language whose voices are taken from `voice_policy`. Without it backends use their own default voice.
+            voice_policy: Voice of every backend for each language.
+            max_workers: Threads available for in-flight requests.
+        """
+        self.backends = backends
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.language = language
+        self.voice_policy = voice_policy
+        self.breakers = {backend.name: CircuitBreaker(failure_threshold, reset_timeout) for backend in backends}
+        self.latencies = {backend.name: LatencyTracker() for backend in backends}
+        # Abandoned (timed out) requests keep their thread until they return, so the pool is generous
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def voice_for(self, backend: Backend) -> Optional[str]:
+        """Return the voice a backend uses under the voice policy ('' if it has no voice for the language)."""
+        if self.language is None:
+            return None
+        return self.voice_policy.get(self.language, {}).get(backend.name, '')
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        for backend in self.backends:
+            if backend.close is not None:
+                backend.close()
+
+    def _run(self, backend: Backend, text: str, output_file: str, voice: Optional[str]) -> float:
+        start = time.monotonic()
+        backend.synthesize(text, output_file, voice)
+        if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+            raise BackendError(f"{backend.name} did not produce any audio")
+        return time.monotonic() - start
+
+    def _attempt(self, backend: Backend, text: str, output_file: str, voice: Optional[str]) -> None:
+        """Run one backend with a timeout and an optional hedged duplicate. Raises on failure."""
+        base, extension = os.path.splitext(output_file)
+        # Unique names, so a late (abandoned) request never touches the files of a later chunk
+        temp_files = [f"{base}.{backend.name}.{uuid.uuid4().hex[:8]}{extension}" for _ in range(2)]
+        deadline = time.monotonic() + self.timeout
+
+        futures = {self._executor.submit(self._run, backend, text, temp_files[0], voice): temp_files[0]}
+        hedge_after = self.latencies[backend.name].percentile(self.hedge_percentile) if backend.hedge else None
+        errors = []
+        try:
+            if hedge_after is not None and hedge_after < self.timeout:
+                done, _ = wait(futures, timeout=hedge_after)
+                if not done:
+                    logging.info(f"{backend.name} exceeded its p{self.hedge_percentile:g} latency ({hedge_after:.2f} s), sending a hedged request")
+                    futures[self._executor.submit(self._run, backend, text, temp_files[1], voice)] = temp_files[1]
+
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                if not done:
+                    raise BackendError(f"{backend.name} timed out after {self.timeout:g} s")
+                for future in done:
+                    if future.exception() is not None:
+                        errors.append(future.exception())
+                        continue
+                    self.latencies[backend.name].record(future.result())
+                    os.replace(futures[future], output_file)
+                    return
+            raise BackendError(f"{backend.name} failed: {errors[-1]}") from errors[-1]
+        finally:
+            for future, temp_file in futures.items():
+                # Losing and abandoned requests clean up their file whenever they finish
+                future.add_done_callback(lambda _, path=temp_file: _remove_quietly(path))
+
+    def synthesize(self, text: str, output_file: str) -> str:
+        """
+        Synthesize `text` into `output_file`, failing over along the backend chain.
+
+        Returns:
+            The name of the backend that produced the audio.
+
+        Raises:
+            BackendError: If every backend failed or was skipped.
+        """
+        errors = []
+        for backend in self.backends:
+            voice = self.voice_for(backend)
+            if voice == '':
+                errors.append(f"{backend.name}: no voice for language {self.language}")
+                continue
+            breaker = self.breakers[backend.name]
+            if not breaker.allow():
+                errors.append(f"{backend.name}: circuit open")
+                continue
+            try:
+                self._attempt(backend, text, output_file, voice)
+            except Exception as e:
+                breaker.record_failure()
+                logging.warning(f"Backend {backend.name} failed, trying the next one: {e}")
+                errors.append(f"{backend.name}: {e}")
+                continue
+            breaker.record_success()
+            return backend.name
+        raise BackendError("All TTS backends failed: " + "; ".join(errors))
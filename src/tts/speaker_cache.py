@@ -0,0 +1,140 @@
+# Speaker conditioning cache for XTTS voice cloning
+import os
+import sys
+import glob
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+
+import torch
+
+'''
+XTTS conditions every generation on GPT latents and a speaker embedding computed
+from the reference clips. Computing them is a noticeable per-chunk cost on CPU,
+so they are computed once per voice and persisted, keyed by the content of the
+clips, the model they were computed with and the conditioning settings of its
+config (reference length and chunking), which `tts_to_file` would apply too.
+
+Named voices are directories of reference clips under the voices folder:
+
+    voices/
+        narrator_f/
+            clip_01.wav
+            clip_02.wav
+'''
+
+DEFAULT_VOICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../examples/voices')
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'text-to-speech-toolbox', 'speakers')
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg')
+
+
+def voice_clips(voice, voices_dir=DEFAULT_VOICES_DIR):
+    """Return the sorted reference clips of a named voice."""
+    voice_dir = os.path.join(voices_dir, voice)
+    clips = sorted(path for path in glob.glob(os.path.join(voice_dir, '*')) if path.lower().endswith(AUDIO_EXTENSIONS))
+    if not clips:
+        raise ValueError(f"Voice '{voice}' has no reference clips in {voice_dir}")
+    return clips
+
+
+def list_voices(voices_dir=DEFAULT_VOICES_DIR):
+    """Return the names of the registered voices."""
+    if not os.path.isdir(voices_dir):
+        return []
+    return sorted(name for name in os.listdir(voices_dir) if os.path.isdir(os.path.join(voices_dir, name)))
+
+
+def register_voice(voice, clips, voices_dir=DEFAULT_VOICES_DIR):
+    """
+    Register a named voice by copying its reference clips (files or a directory of clips) into the voices folder.
+    """
+    if len(clips) == 1 and os.path.isdir(clips[0]):
+        clips = sorted(path for path in glob.glob(os.path.join(clips[0], '*')) if path.lower().endswith(AUDIO_EXTENSIONS))
+    if not clips:
+        raise ValueError(f"No reference clips given for voice '{voice}'")
+    voice_dir = os.path.join(voices_dir, voice)
+    os.makedirs(voice_dir, exist_ok=True)
+    for clip in clips:
+        shutil.copy2(clip, voice_dir)
+    logging.info(f"Registered voice '{voice}' with {len(clips)} clips in {voice_dir}")
+    return voice_clips(voice, voices_dir)
+
+
+def conditioning_settings(config):
+    """Return the `get_conditioning_latents` arguments XTTS derives from its model config when it clones a voice."""
+    return {'gpt_cond_len': getattr(config, 'gpt_cond_len', 6), 'gpt_cond_chunk_len': getattr(config, 'gpt_cond_chunk_len', 6),
+            'max_ref_length': getattr(config, 'max_ref_len', 30), 'sound_norm_refs': getattr(config, 'sound_norm_refs', False)}
+
+
+def speaker_cache_key(clips, model_name, model_version, settings=None):
+    """Hash the content of the reference clips together with the model they condition and the conditioning settings."""
+    digest = hashlib.sha256(f"{model_name}\0{model_version}\0{json.dumps(settings or {}, sort_keys=True)}".encode('utf-8'))
+    for clip in sorted(clips, key=os.path.basename):
+        with open(clip, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+class SpeakerLatentCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        # Latents already loaded in this process, by cache key
+        self._loaded = {}
+        # Cache keys by clip paths and file stats, so clips are only hashed again when they change
+        self._keys = {}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def get(self, xtts_model, clips, model_name, model_version):
+        """
+        Return (gpt_cond_latent, speaker_embedding) for the clips, computing and persisting them on first use.
+
+        Args:
+            xtts_model: The loaded XTTS model (`TTS(...).synthesizer.tts_model`).
+            clips: Reference clips of the speaker.
+            model_name: Name of the TTS model.
+            model_version: Version of the TTS package the model runs with.
+        """
+        settings = conditioning_settings(xtts_model.config)
+        stats = tuple((clip, os.stat(clip).st_mtime_ns, os.stat(clip).st_size) for clip in clips)
+        memo = (stats, model_name, model_version, tuple(sorted(settings.items())))
+        if memo not in self._keys:
+            self._keys[memo] = speaker_cache_key(clips, model_name, model_version, settings)
+        key = self._keys[memo]
+        if key in self._loaded:
+            return self._loaded[key]
+
+        path = self._path(key)
+        if os.path.exists(path):
+            logging.info(f"Loading cached speaker latents from {path}")
+            latents = torch.load(path, map_location=next(xtts_model.parameters()).device)
+            result = (latents['gpt_cond_latent'], latents['speaker_embedding'])
+        else:
+            logging.info(f"Computing speaker latents from {len(clips)} reference clips")
+            result = xtts_model.get_conditioning_latents(audio_path=list(clips), **settings)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first so concurrent runs never read a partial cache entry
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            os.close(fd)
+            torch.save({'gpt_cond_latent': result[0].cpu(), 'speaker_embedding': result[1].cpu()}, temp_path)
+            os.replace(temp_path, path)
+
+        self._loaded[key] = result
+        return result
+
+
+# Example usage:
+#   python -m tts.speaker_cache register narrator_f path/to/clips/
+#   python -m tts.speaker_cache list
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) >= 4 and sys.argv[1] == 'register':
+        register_voice(sys.argv[2], sys.argv[3:])
+    elif len(sys.argv) == 2 and sys.argv[1] == 'list':
+        print("\n".join(list_voices()))
+    else:
+        print("Usage: python -m tts.speaker_cache register <voice> <clips or directory>... | list")
@@ -1,6 +1,7 @@
 import unittest
 from unittest.mock import patch, mock_open, call
 import os
+import tempfile
 from pydub import AudioSegment
 
 class TestTTSConverter(unittest.TestCase):
@@ -39,5 +40,825 @@ class TestTTSConverter(unittest.TestCase):
 
         self.assertEqual(len(chunks), 2)
 
+class TestChunkStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'book.chunks')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_and_read_back(self):
+        from utils.chunk_store import ChunkStore
+
+        with ChunkStore(self.path) as store:
+            store.put(0, b'\x01\x00' * 4, 16000, 1, 2, "first")
+            store.put(1, b'\x02\x00' * 8, 16000, 1, 2, "second")
+            self.assertEqual(bytes(store.read(0)), b'\x01\x00' * 4)
+            self.assertEqual(b''.join(store.iter_segments()), b'\x01\x00' * 4 + b'\x02\x00' * 8)
+            self.assertTrue(store.has(1, "second"))
+            self.assertFalse(store.has(1, "edited second"))
+
+        # The index is persisted and reloaded by a new store
+        with ChunkStore(self.path) as store:
+            self.assertEqual(store.get_entry(1).length, 16)
+            self.assertAlmostEqual(store.get_entry(1).duration, 0.0005)
+
+    def test_rerender_in_place(self):
+        from utils.chunk_store import ChunkStore
+
+        with ChunkStore(self.path) as store:
+            store.put(0, b'\x01' * 8, 8000, 1, 1, "a")
+            store.put(1, b'\x02' * 8, 8000, 1, 1, "b")
+            size = os.path.getsize(store.data_path)
+
+            # A shorter correction reuses the existing segment
+            store.put(0, b'\x03' * 4, 8000, 1, 1, "a2")
+            self.assertEqual(os.path.getsize(store.data_path), size)
+            self.assertEqual(bytes(store.read(0)), b'\x03' * 4)
+
+            # A longer one is appended and the index points at it
+            store.put(1, b'\x04' * 12, 8000, 1, 1, "b2")
+            self.assertEqual(bytes(store.read(1)), b'\x04' * 12)
+            self.assertEqual(store.get_entry(1).offset, size)
+
+    def test_mixed_formats_rejected(self):
+        from utils.chunk_store import ChunkStore
+
+        with ChunkStore(self.path) as store:
+            store.put(0, b'\x00' * 4, 16000, 1, 2, "a")
+            store.put(1, b'\x00' * 4, 24000, 1, 2, "b")
+            with self.assertRaises(ValueError):
+                store.audio_format()
+
+    def test_empty_store_has_no_format(self):
+        from utils.chunk_store import ChunkStore
+
+        with ChunkStore(self.path) as store:
+            self.assertIsNone(store.audio_format())
+            with self.assertRaises(ValueError):
+                store.export(os.path.join(self.tmpdir.name, 'book.mp3'), chunk_ids=range(2))
+
+    def test_stale_chunk_not_exported(self):
+        from utils.chunk_store import ChunkStore
+
+        with ChunkStore(self.path) as store:
+            store.put(0, b'\x01' * 4, 8000, 1, 1, "a")
+            store.put(1, b'\x02' * 4, 8000, 1, 1, "b")
+
+            # Chunk 1 was edited and its re-render failed: only its old audio is stored
+            with self.assertLogs(level='WARNING'):
+                segments = list(store.iter_segments(range(2), texts={0: "a", 1: "b edited"}))
+            self.assertEqual(b''.join(segments), b'\x01' * 4)
+            self.assertIsNone(store.audio_format([1], texts={1: "b edited"}))
+            with self.assertRaises(ValueError):
+                store.export(os.path.join(self.tmpdir.name, 'book.mp3'), chunk_ids=[1], texts={1: "b edited"})
+
+class TestChapters(unittest.TestCase):
+
+    def test_split_markdown_into_chapters(self):
+        from utils.chapters import split_markdown_into_chapters
+
+        markdown = "Preface text.\n\n# Chapter One\n\nFirst body.\n\n ## Part Two ##\n\nSecond body."
+        chapters = split_markdown_into_chapters(markdown)
+
+        self.assertEqual([c.title for c in chapters], ['', 'Chapter One', 'Part Two'])
+        self.assertIn("First body.", chapters[1].text)
+        self.assertNotIn("Second body.", chapters[1].text)
+
+    def test_write_chapter_metadata(self):
+        from utils.chapters import write_chapter_metadata
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            metadata_file = os.path.join(tmpdir, 'metadata.txt')
+            write_chapter_metadata([("One", 1.5), ("Two; the end", 2.0)], metadata_file)
+            with open(metadata_file) as f:
+                content = f.read()
+
+        self.assertTrue(content.startswith(';FFMETADATA1'))
+        self.assertIn("START=1500\nEND=3500", content)
+        self.assertIn("title=Two\\; the end", content)
+
+class TestAudioPostProcess(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+        self.sample_rate = 16000
+        t = np.arange(self.sample_rate) / self.sample_rate
+        tone = 0.05 * np.sin(2 * np.pi * 440 * t)
+        silence = np.zeros(self.sample_rate // 2)
+        self.signal = np.concatenate([silence, tone, silence, silence])
+        self.pcm = (self.signal * 32767).astype(np.int16).tobytes()
+
+    def test_trim_silence(self):
+        from utils.audio_postprocess import trim_silence
+
+        trimmed = trim_silence(self.signal.reshape(-1, 1), self.sample_rate, keep_ms=0)
+        self.assertAlmostEqual(len(trimmed) / self.sample_rate, 1.0, places=2)
+
+    def test_process_adds_exact_pause_and_normalizes(self):
+        import numpy as np
+        from utils.audio_postprocess import AudioPostProcessor, integrated_loudness
+
+        processor = AudioPostProcessor(sentence_pause_ms=250, paragraph_pause_ms=1000, target_lufs=-20.0)
+        pcm, sample_width = processor.process(self.pcm, self.sample_rate, 1, 2, paragraph_end=True)
+        samples = np.frombuffer(pcm, dtype=np.int16)
+
+        self.assertEqual(sample_width, 2)
+        pause = self.sample_rate  # 1000 ms
+        self.assertFalse(samples[-pause:].any())
+        speech = samples[:-pause].astype(np.float64).reshape(-1, 1) / 32768
+        self.assertAlmostEqual(integrated_loudness(speech, self.sample_rate), -20.0, delta=0.5)
+
+    def test_exact_pauses_between_sentences_and_paragraphs(self):
+        import numpy as np
+        from utils.audio_postprocess import AudioPostProcessor, find_pauses, sentence_breaks
+
+        self.assertEqual(sentence_breaks("One . Two . \n\n Three ! Four ."), ([False, True, False], False))
+        self.assertEqual(sentence_breaks("One. Two.\n\n"), ([False], True))
+
+        t = np.arange(self.sample_rate // 2) / self.sample_rate
+        word = 0.05 * np.sin(2 * np.pi * 440 * t)
+        gap = lambda ms: np.zeros(int(self.sample_rate * ms / 1000))
+        # Three sentences; the 40 ms gap inside the first one is too short to be a pause
+        signal = np.concatenate([word, gap(40), word, gap(200), word, gap(600), word])
+        pcm = (signal * 32767).astype(np.int16).tobytes()
+
+        processor = AudioPostProcessor(sentence_pause_ms=250, paragraph_pause_ms=1000, target_lufs=None)
+        output, _ = processor.process(pcm, self.sample_rate, 1, 2, text="One, one . Two .\n\nThree .")
+        samples = np.frombuffer(output, dtype=np.int16).astype(np.float64).reshape(-1, 1) / 32768
+        pauses = find_pauses(samples[:-self.sample_rate // 4], self.sample_rate, min_pause_ms=30)
+        self.assertEqual([round((end - start) / self.sample_rate, 2) for start, end in pauses], [0.04, 0.25, 1.0])
+
+    def test_k_weighting_boosts_treble(self):
+        import numpy as np
+        from utils.audio_postprocess import k_weight
+
+        t = np.arange(self.sample_rate) / self.sample_rate
+        treble = np.sin(2 * np.pi * 4000 * t).reshape(-1, 1)
+        gain_db = 10 * np.log10(np.mean(k_weight(treble, self.sample_rate)[self.sample_rate // 10:] ** 2) / np.mean(treble ** 2))
+        # The BS.1770 high shelf adds about 4 dB at 4 kHz
+        self.assertAlmostEqual(gain_db, 4.0, delta=0.5)
+
+    def test_k_weighting_without_scipy_warns_once(self):
+        import sys
+        import utils.audio_postprocess as audio_postprocess
+
+        samples = self.signal.reshape(-1, 1)
+        with patch.dict(sys.modules, {'scipy.signal': None}), patch.object(audio_postprocess, '_warned_without_scipy', False):
+            with self.assertLogs(level='WARNING') as logs:
+                self.assertIs(audio_postprocess.k_weight(samples, self.sample_rate), samples)
+                self.assertIs(audio_postprocess.k_weight(samples, self.sample_rate), samples)
+        self.assertEqual(len(logs.output), 1)
+
+
+class TestSpeakerCache(unittest.TestCase):
+
+    def test_latents_computed_once_and_persisted(self):
+        import torch
+        from types import SimpleNamespace
+        from unittest.mock import MagicMock
+        from tts.speaker_cache import SpeakerLatentCache, register_voice
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            clip = os.path.join(tmpdir, 'clip.wav')
+            with open(clip, 'wb') as f:
+                f.write(b'RIFF fake clip')
+            clips = register_voice('narrator_f', [clip], os.path.join(tmpdir, 'voices'))
+
+            xtts_model = MagicMock()
+            xtts_model.config = SimpleNamespace(gpt_cond_len=12, gpt_cond_chunk_len=4, max_ref_len=10, sound_norm_refs=False)
+            xtts_model.parameters.side_effect = lambda: iter([torch.zeros(1)])
+            xtts_model.get_conditioning_latents.return_value = (torch.ones(1, 32, 1024), torch.ones(1, 512, 1))
+
+            cache_dir = os.path.join(tmpdir, 'cache')
+            SpeakerLatentCache(cache_dir).get(xtts_model, clips, 'xtts_v2', '0.22.0')
+            gpt_cond_latent, _ = SpeakerLatentCache(cache_dir).get(xtts_model, clips, 'xtts_v2', '0.22.0')
+
+            self.assertEqual(xtts_model.get_conditioning_latents.call_count, 1)
+            self.assertEqual(tuple(gpt_cond_latent.shape), (1, 32, 1024))
+            # Conditioned like tts_to_file would, with the reference settings of the model config
+            self.assertEqual(xtts_model.get_conditioning_latents.call_args.kwargs,
+                             {'audio_path': clips, 'gpt_cond_len': 12, 'gpt_cond_chunk_len': 4, 'max_ref_length': 10, 'sound_norm_refs': False})
+
+            # A different model version does not reuse the latents
+            SpeakerLatentCache(cache_dir).get(xtts_model, clips, 'xtts_v2', '0.23.0')
+            self.assertEqual(xtts_model.get_conditioning_latents.call_count, 2)
+
+            # Neither do other conditioning settings
+            xtts_model.config.gpt_cond_len = 30
+            SpeakerLatentCache(cache_dir).get(xtts_model, clips, 'xtts_v2', '0.23.0')
+            self.assertEqual(xtts_model.get_conditioning_latents.call_count, 3)
+
+    def test_cached_latents_synthesize_like_tts_to_file(self):
+        import sys
+        import wave
+        import numpy as np
+        from types import SimpleNamespace
+        from unittest.mock import MagicMock
+
+        with patch.dict(sys.modules, {'TTS': MagicMock(__version__='0.22.0'), 'TTS.api': MagicMock()}):
+            from tts.coqui_xtts import SENTENCE_SILENCE_SAMPLES, coqui_tts
+
+        tts = coqui_tts()
+        tts.model = MagicMock()
+        synthesizer = tts.model.synthesizer
+        synthesizer.output_sample_rate = 24000
+        synthesizer.tts_config = SimpleNamespace(temperature=0.75, length_penalty=1.0, repetition_penalty=5.0, top_k=50, top_p=0.85)
+        synthesizer.split_into_sentences.return_value = ["One.", "Two."]
+        synthesizer.tts_model.inference.return_value = {'wav': [0.5] * 100}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_path = os.path.join(tmpdir, 'chunk.wav')
+            tts.synthesize_with_latents("One. Two.", output_path, 'gpt', 'speaker')
+            with wave.open(output_path) as f:
+                samples = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+
+        self.assertEqual(synthesizer.tts_model.inference.call_args.kwargs,
+                         {'speed': tts.speed, 'temperature': 0.75, 'length_penalty': 1.0, 'repetition_penalty': 5.0, 'top_k': 50, 'top_p': 0.85})
+        # Every sentence is followed by the silence Synthesizer.tts puts after it
+        self.assertEqual(len(samples), 2 * (100 + SENTENCE_SILENCE_SAMPLES))
+        self.assertTrue(samples[:100].all())
+        self.assertFalse(samples[100:100 + SENTENCE_SILENCE_SAMPLES].any())
+
+class TestMeloCPU(unittest.TestCase):
+
+    def test_spectral_distance(self):
+        import numpy as np
+        from tts.melo_cpu import spectral_distance
+
+        rng = np.random.default_rng(0)
+        reference = np.sin(2 * np.pi * 220 * np.arange(22050) / 22050)
+        self.assertAlmostEqual(spectral_distance(reference, reference.copy()), 0.0)
+        noisy = reference + 0.05 * rng.standard_normal(len(reference))
+        self.assertGreater(spectral_distance(reference, noisy), 1.0)
+
+class FakeBackend:
+    """Local stand-in for a TTS engine with injected latency and errors."""
+
+    def __init__(self, name, latencies=(0.0,), errors=(), hedge=True):
+        from tts.resilience import Backend
+        self.latencies = list(latencies)
+        self.errors = list(errors)
+        self.calls = []
+        self.backend = Backend(name, self.synthesize, hedge)
+
+    def synthesize(self, text, output_file, voice):
+        import time
+        call = len(self.calls)
+        self.calls.append(voice)
+        time.sleep(self.latencies[min(call, len(self.latencies) - 1)])
+        if call < len(self.errors) and self.errors[call]:
+            raise RuntimeError(f"injected error on call {call}")
+        with open(output_file, 'wb') as f:
+            f.write(text.encode('utf-8'))
+
+
+class TestResilientSynthesizer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output_file = os.path.join(self.tmpdir.name, 'chunk.mp3')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_failover_records_backend_and_voice(self):
+        from tts.resilience import ResilientSynthesizer
+
+        edge = FakeBackend('edge', errors=[True])
+        google = FakeBackend('google')
+        synthesizer = ResilientSynthesizer([edge.backend, google.backend], timeout=5, language='en-US')
+
+        self.assertEqual(synthesizer.synthesize("Hello.", self.output_file), 'google')
+        self.assertEqual(google.calls, ['en:us'])
+        with open(self.output_file, 'rb') as f:
+            self.assertEqual(f.read(), b"Hello.")
+
+    def test_timeout_fails_over(self):
+        from tts.resilience import ResilientSynthesizer
+
+        edge = FakeBackend('edge', latencies=[1.0])
+        google = FakeBackend('google')
+        synthesizer = ResilientSynthesizer([edge.backend, google.backend], timeout=0.2)
+
+        self.assertEqual(synthesizer.synthesize("Hello.", self.output_file), 'google')
+
+    def test_hedged_request_after_p95(self):
+        from tts.resilience import ResilientSynthesizer
+
+        # Five fast requests set the p95, then one stalls; its hedged duplicate is fast
+        edge = FakeBackend('edge', latencies=[0.01] * 5 + [2.0, 0.01])
+        synthesizer = ResilientSynthesizer([edge.backend], timeout=5)
+        for _ in range(5):
+            synthesizer.synthesize("warm up", self.output_file)
+
+        import time
+        start = time.monotonic()
+        self.assertEqual(synthesizer.synthesize("Hello.", self.output_file), 'edge')
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(len(edge.calls), 7)
+
+    def test_circuit_breaker_skips_failing_backend(self):
+        from tts.resilience import ResilientSynthesizer
+
+        edge = FakeBackend('edge', errors=[True] * 10)
+        google = FakeBackend('google')
+        synthesizer = ResilientSynthesizer([edge.backend, google.backend], timeout=5, failure_threshold=2)
+        for _ in range(4):
+            synthesizer.synthesize("Hello.", self.output_file)
+
+        self.assertEqual(len(edge.calls), 2)
+        self.assertEqual(synthesizer.breakers['edge'].state, 'open')
+
+    def test_all_backends_failing_raises(self):
+        from tts.resilience import BackendError, ResilientSynthesizer
+
+        synthesizer = ResilientSynthesizer([FakeBackend('edge', errors=[True]).backend], timeout=5)
+        with self.assertRaises(BackendError):
+            synthesizer.synthesize("Hello.", self.output_file)
+
+    @patch('pydub.AudioSegment.from_file', return_value=AudioSegment.silent(duration=100, frame_rate=8000))
+    def test_failed_chunk_stops_conversion_and_keeps_rendered_chunks(self, mock_from_file):
+        from main import convert_chunks_to_audio, render_key, render_settings
+        from tts.resilience import Backend, BackendError, ResilientSynthesizer
+        from utils.chunk_store import ChunkStore
+
+        def synthesize(text, output_file, voice):
+            if text == "Second.":
+                raise RuntimeError("engine down")
+            with open(output_file, 'wb') as f:
+                f.write(b"audio")
+
+        synthesizer = ResilientSynthesizer([Backend('edge', synthesize), Backend('google', synthesize)], timeout=5)
+        chunks = ["First.", "Second."]
+        with self.assertRaises(BackendError) as raised:
+            convert_chunks_to_audio(chunks, self.tmpdir.name, 'edge', os.path.join(self.tmpdir.name, 'book.mp3'), synthesizer=synthesizer)
+        synthesizer.close()
+        self.assertIn("Chunk 2", str(raised.exception))
+        self.assertIn("google: ", str(raised.exception))
+
+        with ChunkStore(os.path.join(self.tmpdir.name, 'book.chunks')) as store:
+            self.assertTrue(store.has(0, render_key(chunks[0], render_settings('edge', synthesizer=synthesizer))))
+
+    def test_close_releases_backends(self):
+        from tts.resilience import Backend, ResilientSynthesizer
+
+        closed = []
+        google = FakeBackend('google')
+        synthesizer = ResilientSynthesizer([google.backend, Backend('edge', google.synthesize, close=lambda: closed.append('edge'))])
+        synthesizer.close()
+        self.assertEqual(closed, ['edge'])
+
+class TestGoogleTTSBackend(unittest.TestCase):
+    """Runs the Google backend against a local stand-in for the translate endpoint."""
+
+    def setUp(self):
+        import base64
+        import json
+        import threading
+        import time
+        import urllib.parse
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.client_ports = set()
+        test = self
+
+        class TranslateStandIn(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+                rpc = json.loads(urllib.parse.unquote(body[len('f.req='):].rstrip('&')))
+                text = json.loads(rpc[0][0][1])[0]
+                with lock:
+                    test.in_flight += 1
+                    test.max_in_flight = max(test.max_in_flight, test.in_flight)
+                    test.client_ports.add(self.client_address[1])
+                time.sleep(0.05)
+                with lock:
+                    test.in_flight -= 1
+
+                # The piece text stands in for its MP3 bytes
+                audio = base64.b64encode(text.encode('utf-8')).decode('ascii')
+                payload = ")]}'\n\n100\n" + '[["wrb.fr","jQ1olc","[\\"' + audio + '\\"]",null,null,null,"generic"]]\n'
+                data = payload.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), TranslateStandIn)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/batchexecute"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_pieces_fetched_concurrently_and_joined_in_order(self):
+        from tts.google_tts import GoogleTTSBackend
+
+        backend = GoogleTTSBackend(max_workers=4, base_url=self.url)
+        sentences = [f"This is sentence number {i} of a fairly long chunk of text." for i in range(8)]
+        text = ' '.join(sentences)
+        audio = backend.fetch(text)
+        pieces = backend._packager('en', 'us', False)._tokenize(text)
+        backend.close()
+
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual(audio.decode('utf-8'), ''.join(pieces))
+        self.assertGreater(self.max_in_flight, 1)
+
+    def test_session_is_reused_across_chunks(self):
+        from tts.google_tts import GoogleTTSBackend
+
+        backend = GoogleTTSBackend(max_workers=2, base_url=self.url)
+        for i in range(5):
+            backend.fetch(f"Chunk {i}.")
+        backend.close()
+
+        # Sequential chunks go over the same pooled connection
+        self.assertEqual(len(self.client_ports), 1)
+
+    def test_falls_back_to_public_stream_without_gtts_internals(self):
+        from unittest.mock import MagicMock
+        import tts.google_tts as google_tts
+
+        gtts = MagicMock()
+        gtts.return_value.stream.return_value = iter([b'first ', b'second'])
+        with patch.object(google_tts, '_translate_url', None), patch.object(google_tts, 'gTTS', gtts):
+            with self.assertLogs(level='WARNING'):
+                backend = google_tts.GoogleTTSBackend(base_url=self.url)
+            audio = backend.fetch("First. Second.", lang='pt', tld='com.br')
+            backend.close()
+
+        self.assertEqual(audio, b'first second')
+        gtts.assert_called_once_with(text="First. Second.", lang='pt', tld='com.br', slow=False, lang_check=False)
+        self.assertEqual(self.client_ports, set())
+
+class TestSubtitles(unittest.TestCase):
+    def test_timestamp_formats(self):
+        from utils.subtitles import format_timestamps
+
+        self.assertEqual(format_timestamps([0, 61.5, 3723.0456], 'srt'), ['00:00:00,000', '00:01:01,500', '01:02:03,046'])
+        self.assertEqual(format_timestamps([3723.0456], 'vtt'), ['01:02:03.046'])
+        # LRC minutes keep counting past the hour
+        self.assertEqual(format_timestamps([5.25, 3723.0456], 'lrc'), ['[00:05.25]', '[62:03.05]'])
+        self.assertEqual(format_timestamps([360000.0], 'srt'), ['100:00:00,000'])
+
+    def test_srt_round_trip_with_numeric_text(self):
+        from utils.subtitles import Cue, parse_srt, write_srt
+
+        cues = [Cue(0.5, 2.0, "1984 was a novel."), Cue(2.0, 3.25, "42\nis the answer"), Cue(3.5, 4.0, "Plain text")]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'captions.srt')
+            self.assertEqual(write_srt(cues, path, batch_size=2), 3)
+            self.assertEqual(list(parse_srt(path)), cues)
+
+    def test_malformed_srt_cue_skipped(self):
+        from utils.subtitles import Cue, parse_srt
+
+        lines = ["1\n", "00:00:01,000 --> 00:00:02,000\n", "First\n", "\n",
+                 "2\n", "00:00:03,000 -->\n", "Broken\n", "\n",
+                 "3\n", "00:00:05,000 --> 00:00:06,500\n", "Third\n"]
+        with self.assertLogs(level='WARNING') as logs:
+            cues = list(parse_srt(lines))
+        self.assertEqual(cues, [Cue(1.0, 2.0, "First"), Cue(5.0, 6.5, "Third")])
+        self.assertIn("line 6", logs.output[0])
+
+    def test_srt_to_lrc_and_vtt(self):
+        from utils.subtitles import convert, parse_lrc, parse_vtt
+
+        srt = "1\r\n00:00:01,000 --> 00:00:02,500\r\n7 days later\r\n\r\n2\r\n00:01:02,345 --> 00:01:04,000\r\nSecond line\r\n"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, 'in.srt'), 'w', newline='') as f:
+                f.write(srt)
+            convert(os.path.join(temp_dir, 'in.srt'), os.path.join(temp_dir, 'out.lrc'))
+            convert(os.path.join(temp_dir, 'in.srt'), os.path.join(temp_dir, 'out.vtt'))
+            with open(os.path.join(temp_dir, 'out.lrc')) as f:
+                self.assertEqual(f.read(), "[00:01.00] 7 days later\n[01:02.35] Second line\n")
+            lrc_cues = list(parse_lrc(os.path.join(temp_dir, 'out.lrc')))
+            vtt_cues = list(parse_vtt(os.path.join(temp_dir, 'out.vtt')))
+
+        self.assertEqual([cue.text for cue in lrc_cues], ["7 days later", "Second line"])
+        self.assertAlmostEqual(lrc_cues[0].end, 62.35)
+        self.assertEqual([(cue.start, cue.end) for cue in vtt_cues], [(1.0, 2.5), (62.345, 64.0)])
+
+    def test_lrc_repeated_tags_sorted(self):
+        from utils.subtitles import Cue, parse_lrc
+
+        lines = ["[ti:Song]\n", "[00:10.00]verse\n", "[00:30.00][01:20.00]chorus\n", "[00:50.00]bridge\n"]
+        cues = list(parse_lrc(lines, last_duration=2.0, batch_size=2))
+        self.assertEqual(cues, [Cue(10.0, 30.0, "verse"), Cue(30.0, 50.0, "chorus"), Cue(50.0, 80.0, "bridge"),
+                                Cue(80.0, 82.0, "chorus")])
+        self.assertTrue(all(cue.end >= cue.start for cue in cues))
+
+    def test_shift_concat_merge_split(self):
+        from utils.subtitles import Cue, concat_tracks, merge_cues, shift_cues, split_cue
+
+        self.assertEqual(list(shift_cues([Cue(0.0, 1.0, "a"), Cue(1.5, 3.0, "b")], -2.0)), [Cue(0.0, 1.0, "b")])
+        joined = list(concat_tracks([([Cue(0.0, 1.0, "a")], 0.0), ([Cue(0.0, 1.0, "b")], 10.0)]))
+        self.assertEqual(joined, [Cue(0.0, 1.0, "a"), Cue(10.0, 11.0, "b")])
+        merged = list(merge_cues([Cue(0.0, 1.0, "a"), Cue(1.0, 2.0, "b"), Cue(5.0, 6.0, "c")], max_gap=0.5))
+        self.assertEqual(merged, [Cue(0.0, 2.0, "a b"), Cue(5.0, 6.0, "c")])
+
+        pieces = split_cue(Cue(10.0, 20.0, "one two three four five six seven eight"), max_chars=14)
+        self.assertTrue(all(len(piece.text) <= 14 for piece in pieces))
+        self.assertEqual(' '.join(piece.text for piece in pieces), "one two three four five six seven eight")
+        self.assertEqual((pieces[0].start, pieces[-1].end), (10.0, 20.0))
+        self.assertTrue(all(a.end == b.start for a, b in zip(pieces, pieces[1:])))
+
+class TestPipeline(unittest.TestCase):
+    def test_outputs_in_order_with_parallel_workers(self):
+        import random
+        import time
+        from utils.pipeline import Pipeline, Stage
+
+        def slow_square(x):
+            time.sleep(random.uniform(0, 0.01))
+            return x * x
+
+        pipeline = Pipeline([Stage('square', slow_square, workers=4, queue_size=2),
+                             Stage('add', lambda x: x + 1, workers=3, queue_size=2)])
+        self.assertEqual(list(pipeline.run(range(100))), [x * x + 1 for x in range(100)])
+        stats = {stat.name: stat for stat in pipeline.stats()}
+        self.assertEqual((stats['square'].items_in, stats['add'].items_out), (100, 100))
+        self.assertGreater(stats['square'].busy, 0)
+
+    def test_fan_out_with_flush(self):
+        from utils.pipeline import Pipeline, Stage
+
+        held = []
+
+        def pairs(x):
+            # Emits items two at a time and keeps an odd one for the next call or the flush
+            held.append(x)
+            if len(held) == 2:
+                out, held[:] = list(held), []
+                return out
+            return []
+
+        pipeline = Pipeline([Stage('pairs', pairs, fan_out=True, flush=lambda: list(held)),
+                             Stage('double', lambda x: 2 * x, workers=2)])
+        self.assertEqual(list(pipeline.run(range(7))), [2 * x for x in range(7)])
+
+    def test_backpressure_bounds_work_in_progress(self):
+        import threading
+        import time
+        from utils.pipeline import Pipeline, Stage
+
+        produced = []
+        lock = threading.Lock()
+
+        def produce(x):
+            with lock:
+                produced.append(x)
+            return x
+
+        pipeline = Pipeline([Stage('fast', produce, queue_size=2), Stage('slow', lambda x: x, queue_size=2)])
+        ahead = []
+        for consumed, _ in enumerate(pipeline.run(range(50))):
+            time.sleep(0.005)
+            with lock:
+                ahead.append(len(produced) - consumed)
+        # Bounded by the queues and the items held by the stages, not by the input size
+        self.assertLessEqual(max(ahead), 10)
+
+    def test_stage_error_stops_the_pipeline(self):
+        from utils.pipeline import Pipeline, PipelineError, Stage
+
+        def fail_on_five(x):
+            if x == 5:
+                raise RuntimeError("bad item")
+            return x
+
+        pipeline = Pipeline([Stage('check', fail_on_five, workers=2), Stage('copy', lambda x: x)])
+        with self.assertRaises(PipelineError) as context:
+            list(pipeline.run(range(1000)))
+        self.assertIsInstance(context.exception.__cause__, RuntimeError)
+
+    def test_chunk_splitter_matches_split_text_to_chunks(self):
+        from utils.pdf_extractor import ChunkSplitter, split_text_to_chunks
+
+        pages = ["First sentence. Second sen", "tence spans pages. A third one", ". Last words without a stop"]
+        splitter = ChunkSplitter(max_chunk_size=40)
+        chunks = [chunk for page in pages for chunk in splitter.feed(page)] + splitter.flush()
+        self.assertEqual(chunks, split_text_to_chunks(''.join(pages), max_chunk_size=40))
+
+    def test_chunks_keep_paragraph_breaks(self):
+        from utils.pdf_extractor import ChunkSplitter, split_text_to_chunks
+
+        text = "First one. Still first.\n\nSecond paragraph. More.\n\nThird."
+        self.assertEqual(split_text_to_chunks(text, max_chunk_size=40),
+                         ["First one.Still first.\n\n", "Second paragraph.More.\n\nThird."])
+        splitter = ChunkSplitter(max_chunk_size=40)
+        pages = [text[:25], text[25:]]
+        chunks = [chunk for page in pages for chunk in splitter.feed(page)] + splitter.flush()
+        self.assertEqual(chunks, split_text_to_chunks(text, max_chunk_size=40))
+
+    def test_model_used_by_one_chunk_at_a_time(self):
+        import sys
+        import time
+        import types
+        import threading
+        import main
+
+        running, overlaps = [], []
+
+        class FakeModel:
+            def convert_to_audio(self, text, output_file):
+                running.append(text)
+                if len(running) > 1:
+                    overlaps.append(text)
+                time.sleep(0.01)
+                running.remove(text)
+
+        with patch.dict(sys.modules, {'tts.mello_tts': types.SimpleNamespace(melo_tts=FakeModel)}), \
+                patch.dict(main._MODEL_INSTANCES, clear=True):
+            wrapper = main.create_model_wrapper('melo')
+            threads = [threading.Thread(target=wrapper, args=(str(i), 'chunk.wav', True, {'speed': 1.0})) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(set(map(id, main._MODEL_INSTANCES.values()))), 1)
+        self.assertEqual(overlaps, [])
+
+def _fake_job_audio(payload):
+    return payload['text'].encode('utf-8'), {'sample_rate': 8000}
+
+def _crash_on_job(payload):
+    # A worker dying mid-chunk: its lease is never renewed or released
+    os._exit(1)
+
+def _run_queue_worker(path, worker, synthesize):
+    from utils.work_queue import SQLiteWorkQueue, run_worker
+    run_worker(SQLiteWorkQueue(path), synthesize, worker, lease_seconds=0.5, poll_interval=0.02, idle_timeout=3.0)
+
+class TestWorkQueue(unittest.TestCase):
+    def check_lease_expiry(self, queue):
+        queue.publish('book', [(0, {'text': 'a'}), (1, {'text': 'b'})])
+        job = queue.claim('dead', lease_seconds=0.05)
+        self.assertEqual((job.index, job.attempts), (0, 1))
+        import time
+        time.sleep(0.1)
+        self.assertEqual(queue.requeue_expired(), 1)
+        # The re-queued job is claimed before younger jobs
+        retry = queue.claim('alive', lease_seconds=30)
+        self.assertEqual((retry.index, retry.attempts), (0, 2))
+        self.assertFalse(queue.heartbeat(job, 'dead'))
+        self.assertFalse(queue.complete(job, 'dead', b'late', {}))
+        self.assertTrue(queue.heartbeat(retry, 'alive'))
+        self.assertTrue(queue.complete(retry, 'alive', b'audio', {'sample_rate': 8000}))
+        self.assertEqual(queue.take_results('book'), [(0, b'audio', {'sample_rate': 8000})])
+        self.assertEqual(queue.take_results('book'), [])
+        # Publishing unchanged jobs again does not queue them twice
+        self.assertEqual(queue.publish('book', [(1, {'text': 'b'})]), 0)
+        self.assertEqual(queue.claim('alive').index, 1)
+        self.assertIsNone(queue.claim('alive'))
+
+    def test_sqlite_lease_expiry(self):
+        from utils.work_queue import SQLiteWorkQueue
+        with tempfile.TemporaryDirectory() as temp_dir:
+            queue = SQLiteWorkQueue(os.path.join(temp_dir, 'queue.db'))
+            try:
+                self.check_lease_expiry(queue)
+            finally:
+                queue.close()
+
+    def test_sqlite_journal_mode_from_url(self):
+        from utils.work_queue import open_work_queue
+
+        def journal_mode(queue):
+            mode = queue._db.execute("PRAGMA journal_mode").fetchone()[0]
+            queue.close()
+            return mode
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'queue.db')
+            # Shared network storage is the default setup, where WAL does not work
+            self.assertEqual(journal_mode(open_work_queue(path)), 'delete')
+            self.assertEqual(journal_mode(open_work_queue(f"sqlite://{path}?wal=1")), 'wal')
+            # A file left in WAL mode is switched back
+            self.assertEqual(journal_mode(open_work_queue(f"sqlite://{path}?wal=0")), 'delete')
+
+    def test_redis_lease_expiry(self):
+        try:
+            import fakeredis
+        except ImportError:
+            self.skipTest("fakeredis is not installed")
+        from utils.work_queue import RedisWorkQueue
+        self.check_lease_expiry(RedisWorkQueue(fakeredis.FakeRedis()))
+
+    def test_failed_jobs_are_reported_after_max_attempts(self):
+        from utils.work_queue import SQLiteWorkQueue, collect_batch, run_worker
+
+        attempts = []
+
+        def fail(payload):
+            attempts.append(payload)
+            raise RuntimeError("engine down")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            queue = SQLiteWorkQueue(os.path.join(temp_dir, 'queue.db'), max_attempts=2)
+            queue.publish('book', [(0, {'text': 'a'})])
+            # The worker's queue has its own default; the limit published with the job applies
+            worker_queue = SQLiteWorkQueue(os.path.join(temp_dir, 'queue.db'), max_attempts=5)
+            self.assertEqual(run_worker(worker_queue, fail, 'w', poll_interval=0.01, idle_timeout=0.05), 0)
+            self.assertEqual(len(attempts), 2)
+            self.assertEqual(collect_batch(queue, 'book', [0], lambda result: None, poll_interval=0.01), {0: 'engine down'})
+            worker_queue.close()
+            queue.close()
+
+    def test_collect_batch_gives_up_without_workers(self):
+        from utils.work_queue import SQLiteWorkQueue, collect_batch
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            queue = SQLiteWorkQueue(os.path.join(temp_dir, 'queue.db'))
+            queue.publish('book', [(0, {'text': 'a'})])
+            with self.assertRaises(TimeoutError):
+                collect_batch(queue, 'book', [0], lambda result: None, poll_interval=0.01, stall_timeout=0.1)
+            queue.close()
+
+    def test_worker_processes_share_a_sqlite_queue(self):
+        import multiprocessing
+        from utils.work_queue import SQLiteWorkQueue, collect_batch
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'queue.db')
+            queue = SQLiteWorkQueue(path)
+            texts = [f"chunk {i}" for i in range(60)]
+            queue.publish('book', [(i, {'text': text}) for i, text in enumerate(texts)])
+
+            workers = [multiprocessing.Process(target=_run_queue_worker, args=(path, 'crashing', _crash_on_job))]
+            workers[0].start()
+            workers[0].join()
+            workers += [multiprocessing.Process(target=_run_queue_worker, args=(path, f"worker-{n}", _fake_job_audio)) for n in range(3)]
+            for worker in workers[1:]:
+                worker.start()
+
+            results = {}
+            failures = collect_batch(queue, 'book', range(len(texts)), lambda result: results.setdefault(result.index, result),
+                                     poll_interval=0.05)
+            for worker in workers[1:]:
+                worker.join()
+            queue.close()
+
+        self.assertEqual(failures, {})
+        self.assertEqual([results[i].data.decode('utf-8') for i in range(len(texts))], texts)
+        # The chunk the crashed worker held was finished by another worker
+        self.assertTrue(all(result.meta['worker'].startswith('worker-') for result in results.values()))
+
+class TestPdfCache(unittest.TestCase):
+    def test_pages_persist_across_runs(self):
+        from utils.pdf_cache import PdfPageCache, extraction_params
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pdf_path = os.path.join(temp_dir, 'book.pdf')
+            with open(pdf_path, 'wb') as f:
+                f.write(b'%PDF-1.4 fake')
+            params = extraction_params(1, 3, False)
+            cached = PdfPageCache(os.path.join(temp_dir, 'cache')).open(pdf_path)
+            self.assertIsNone(cached.raw(0, params))
+            cached.page_count = 2
+            cached.put_raw(0, params, 'raw text')
+            cached.put_markdown(0, params, 'en_core_web_sm-3.7.1', 'raw text\n\n---\n\n')
+            cached.save()
+
+            # A copy of the PDF under another name shares the cache
+            copy_path = os.path.join(temp_dir, 'copy.pdf')
+            with open(copy_path, 'wb') as f:
+                f.write(b'%PDF-1.4 fake')
+            reopened = PdfPageCache(os.path.join(temp_dir, 'cache')).open(copy_path)
+            self.assertEqual(reopened.page_count, 2)
+            self.assertEqual(reopened.raw(0, params), 'raw text')
+            self.assertEqual(reopened.markdown(0, params, 'en_core_web_sm-3.7.1'), 'raw text\n\n---\n\n')
+            # Another re-spacing model or other extraction parameters miss
+            self.assertIsNone(reopened.markdown(0, params, 'en_core_web_sm-3.8.0'))
+            self.assertIsNone(reopened.raw(0, extraction_params(1, 3, True)))
+
+    def test_concurrent_saves_keep_each_others_pages(self):
+        from utils.pdf_cache import PdfPageCache, extraction_params
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pdf_path = os.path.join(temp_dir, 'book.pdf')
+            with open(pdf_path, 'wb') as f:
+                f.write(b'%PDF-1.4 fake')
+            cache = PdfPageCache(os.path.join(temp_dir, 'cache'))
+            params = extraction_params(1, 3, False)
+            first, second = cache.open(pdf_path), cache.open(pdf_path)
+            first.put_raw(0, params, 'page one')
+            second.put_raw(1, params, 'page two')
+            first.save()
+            second.save()
+            reopened = cache.open(pdf_path)
+            self.assertEqual((reopened.raw(0, params), reopened.raw(1, params)), ('page one', 'page two'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,299 @@
+import re
+import math
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+'''
+Vectorized post-processing of chunk PCM.
+
+Every chunk coming out of a TTS engine is trimmed to its speech (RMS framing),
+normalized to a common loudness (EBU R128 / ITU-R BS.1770 gated loudness) and
+followed by an exact pause, so pacing and level no longer depend on the engine.
+Inside a chunk, the silences the engine left between sentences are replaced by
+exact pauses too: a chunk of n sentences has n - 1 breaks, which are matched to
+its n - 1 longest silences. Breaks at a blank line in the text get the
+paragraph pause. All the work happens on NumPy arrays that are reused from
+chunk to chunk.
+'''
+
+# Scale factors from integer PCM to float samples in [-1, 1)
+_PCM_DTYPES = {1: (np.uint8, 128.0, 128.0), 2: (np.int16, 0.0, 32768.0), 4: (np.int32, 0.0, 2147483648.0)}
+
+# Whether the missing SciPy fallback was already reported
+_warned_without_scipy = False
+
+
+def _k_weighting_coefficients(sample_rate: int):
+    """Return (b, a) of the two BS.1770 K-weighting biquads for `sample_rate`."""
+    # Stage 1: high shelf modelling the acoustic effect of the head
+    f0, gain_db, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / sample_rate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]
+    shelf_a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    # Stage 2: RLB high pass
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    highpass_b = [1.0, -2.0, 1.0]
+    highpass_a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return (shelf_b, shelf_a), (highpass_b, highpass_a)
+
+
+def k_weight(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    Apply the BS.1770 K-weighting filter to (frames, channels) samples.
+
+    Falls back to the unweighted signal, with a warning on the first call, when SciPy is not installed.
+    """
+    global _warned_without_scipy
+    try:
+        from scipy.signal import lfilter
+    except ImportError:
+        if not _warned_without_scipy:
+            logging.warning("SciPy is not installed, measuring loudness without K-weighting; "
+                            "chunks with strong bass or treble will be normalized less accurately")
+            _warned_without_scipy = True
+        return samples
+    (shelf_b, shelf_a), (highpass_b, highpass_a) = _k_weighting_coefficients(sample_rate)
+    # Both biquads cascaded into a single fourth-order filter, so the signal is traversed once
+    return lfilter(np.convolve(shelf_b, highpass_b), np.convolve(shelf_a, highpass_a), samples, axis=0)
+
+
+def integrated_loudness(samples: np.ndarray, sample_rate: int) -> float:
+    """
+    Measure the gated integrated loudness of (frames, channels) samples in LUFS.
+
+    Block energies of the 400 ms / 75 % overlap gating blocks are computed from a
+    cumulative sum of squares, so no per-block Python loop is needed.
+    """
+    weighted = k_weight(samples, sample_rate)
+    power = np.square(weighted, dtype=np.float64).sum(axis=1)
+    block = int(0.4 * sample_rate)
+    if len(power) < block:
+        # Chunks shorter than one gating block are measured as a whole
+        mean_square = power.mean() if len(power) else 0.0
+        return -0.691 + 10 * math.log10(mean_square) if mean_square > 0 else -math.inf
+
+    step = block // 4
+    cumulative = np.concatenate(([0.0], np.cumsum(power)))
+    starts = np.arange(0, len(power) - block + 1, step)
+    energies = (cumulative[starts + block] - cumulative[starts]) / block
+
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10 * np.log10(energies)
+    gated = energies[loudness > -70.0]
+    if not len(gated):
+        return -math.inf
+    relative_gate = -0.691 + 10 * math.log10(gated.mean()) - 10.0
+    gated = energies[(loudness > -70.0) & (loudness > relative_gate)]
+    return -0.691 + 10 * math.log10(gated.mean())
+
+
+def frame_rms_db(samples: np.ndarray, sample_rate: int, frame_ms: float = 10.0) -> np.ndarray:
+    """Return the RMS level in dBFS of consecutive `frame_ms` frames of (frames, channels) samples."""
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    count = len(samples) // frame
+    framed = samples[:count * frame].reshape(count, frame * samples.shape[1])
+    rms = np.sqrt(np.mean(np.square(framed), axis=1))
+    with np.errstate(divide='ignore'):
+        return 20 * np.log10(rms)
+
+
+def trim_silence(samples: np.ndarray, sample_rate: int, threshold_db: float = -45.0, frame_ms: float = 10.0,
+                 keep_ms: float = 20.0) -> np.ndarray:
+    """
+    Trim leading and trailing silence.
+
+    Args:
+        samples: (frames, channels) float samples.
+        sample_rate: Sample rate in Hz.
+        threshold_db: Frames below this RMS level (dBFS) count as silence.
+        frame_ms: Length of the RMS analysis frames.
+        keep_ms: Silence kept around the speech so onsets and decays are not clipped.
+
+    Returns:
+        A view of `samples` without the surrounding silence (empty if everything is silent).
+    """
+    levels = frame_rms_db(samples, sample_rate, frame_ms)
+    voiced = np.flatnonzero(levels > threshold_db)
+    if not len(voiced):
+        return samples[:0]
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    keep = int(sample_rate * keep_ms / 1000)
+    start = max(0, voiced[0] * frame - keep)
+    end = min(len(samples), (voiced[-1] + 1) * frame + keep)
+    return samples[start:end]
+
+
+# End of a sentence followed by more text; the whitespace tells whether a paragraph ends there
+_SENTENCE_BREAK = re.compile(r'[.!?]+(\s+)(?=\S)')
+
+
+def sentence_breaks(text: str) -> Tuple[List[bool], bool]:
+    """
+    Find the sentence breaks of a chunk of text.
+
+    Returns:
+        One flag per break between two sentences, True where a paragraph ends (a blank
+        line follows), and whether the text itself ends a paragraph.
+    """
+    breaks = [match.group(1).count('\n') >= 2 for match in _SENTENCE_BREAK.finditer(text)]
+    trailing = text[len(text.rstrip()):]
+    return breaks, trailing.count('\n') >= 2
+
+
+def find_pauses(samples: np.ndarray, sample_rate: int, threshold_db: float = -45.0, frame_ms: float = 10.0,
+                min_pause_ms: float = 100.0) -> np.ndarray:
+    """
+    Find the silences between speech.
+
+    Args:
+        samples: (frames, channels) float samples, trimmed to their speech.
+        sample_rate: Sample rate in Hz.
+        threshold_db: Frames below this RMS level (dBFS) count as silence.
+        frame_ms: Length of the RMS analysis frames.
+        min_pause_ms: Shorter silences (e.g. stop consonants) are not pauses.
+
+    Returns:
+        An (n, 2) array of the start and end sample of every silence with speech on both sides.
+    """
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    silent = frame_rms_db(samples, sample_rate, frame_ms) <= threshold_db
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    inside = (starts > 0) & (ends < len(silent))
+    pauses = np.stack([starts[inside], ends[inside]], axis=1) * frame
+    return pauses[pauses[:, 1] - pauses[:, 0] >= int(sample_rate * min_pause_ms / 1000)]
+
+
+def normalize_loudness(samples: np.ndarray, sample_rate: int, target_lufs: float = -18.0,
+                       peak_dbfs: float = -1.0) -> float:
+    """
+    Scale samples in place to the target integrated loudness.
+
+    The gain is reduced when needed so the peak stays below `peak_dbfs`.
+
+    Returns:
+        The gain that was applied, in dB.
+    """
+    loudness = integrated_loudness(samples, sample_rate)
+    if not math.isfinite(loudness):
+        return 0.0
+    gain = 10 ** ((target_lufs - loudness) / 20)
+    peak = float(np.abs(samples).max())
+    if peak * gain > 10 ** (peak_dbfs / 20):
+        gain = 10 ** (peak_dbfs / 20) / peak
+    np.multiply(samples, gain, out=samples)
+    return 20 * math.log10(gain)
+
+
+class AudioPostProcessor:
+    def __init__(self, sentence_pause_ms: float = 350.0, paragraph_pause_ms: float = 900.0,
+                 silence_threshold_db: float = -45.0, target_lufs: Optional[float] = -18.0, min_pause_ms: float = 100.0):
+        """
+        Trim, normalize and pad chunk PCM with exact pauses.
+
+        Args:
+            sentence_pause_ms: Pause after every sentence.
+            paragraph_pause_ms: Pause after every paragraph, and after a chunk that ends a chapter.
+            silence_threshold_db: RMS level (dBFS) under which audio counts as silence.
+            target_lufs: Integrated loudness every chunk is normalized to. None disables normalization.
+            min_pause_ms: Shortest silence inside a chunk that can be a sentence break.
+        """
+        self.sentence_pause_ms = sentence_pause_ms
+        self.paragraph_pause_ms = paragraph_pause_ms
+        self.silence_threshold_db = silence_threshold_db
+        self.target_lufs = target_lufs
+        self.min_pause_ms = min_pause_ms
+        # Buffers reused from chunk to chunk; they only grow
+        self._float_buffer = np.empty(0, dtype=np.float32)
+        self._output_buffer = np.empty(0, dtype=np.int16)
+
+    def __repr__(self) -> str:
+        return (f"AudioPostProcessor(sentence_pause_ms={self.sentence_pause_ms}, paragraph_pause_ms={self.paragraph_pause_ms}, "
+                f"silence_threshold_db={self.silence_threshold_db}, target_lufs={self.target_lufs}, min_pause_ms={self.min_pause_ms})")
+
+    def _buffer(self, name: str, size: int) -> np.ndarray:
+        buffer = getattr(self, name)
+        if len(buffer) < size:
+            buffer = np.empty(max(size, 2 * len(buffer)), dtype=buffer.dtype)
+            setattr(self, name, buffer)
+        return buffer[:size]
+
+    def pause_ms(self, paragraph_end: bool) -> float:
+        return self.paragraph_pause_ms if paragraph_end else self.sentence_pause_ms
+
+    def sentence_pauses(self, speech: np.ndarray, sample_rate: int, text: str) -> Tuple[np.ndarray, List[int]]:
+        """
+        Match the sentence breaks of `text` to the silences of its speech.
+
+        Returns:
+            The (start, end) samples of the silences to replace, and the length of the pause replacing each.
+        """
+        breaks, _ = sentence_breaks(text)
+        if not breaks or not len(speech):
+            return np.empty((0, 2), dtype=np.int64), []
+        pauses = find_pauses(speech, sample_rate, self.silence_threshold_db, min_pause_ms=self.min_pause_ms)
+        if len(pauses) > len(breaks):
+            # Sentence ends are the longest silences; shorter ones (commas, breaths) are left as they are
+            longest = np.argsort(pauses[:, 1] - pauses[:, 0], kind='stable')[::-1][:len(breaks)]
+            pauses = pauses[np.sort(longest)]
+        if len(pauses) < len(breaks):
+            # Some breaks were spoken without a silence, so it is unknown which break each silence is
+            breaks = [False] * len(pauses)
+        return pauses, [int(sample_rate * self.pause_ms(paragraph) / 1000) for paragraph in breaks]
+
+    def process(self, pcm, sample_rate: int, channels: int, sample_width: int,
+                paragraph_end: bool = False, text: Optional[str] = None) -> Tuple[memoryview, int]:
+        """
+        Post-process the raw PCM of one chunk.
+
+        Args:
+            pcm: Raw interleaved PCM (any bytes-like object).
+            sample_rate: Sample rate in Hz.
+            channels: Number of interleaved channels.
+            sample_width: Bytes per sample of `pcm`.
+            paragraph_end: Whether the chunk ends a chapter, which selects the longer pause.
+            text: Text of the chunk. Its sentence breaks get exact pauses, and a trailing
+                blank line ends a paragraph.
+
+        Returns:
+            The processed 16-bit PCM and its sample width (always 2). The PCM is a view
+            into an internal buffer that is overwritten by the next call.
+        """
+        dtype, offset, scale = _PCM_DTYPES[sample_width]
+        ints = np.frombuffer(pcm, dtype=dtype)
+        samples = self._buffer('_float_buffer', len(ints))
+        np.subtract(ints, offset, out=samples, casting='unsafe')
+        np.multiply(samples, 1.0 / scale, out=samples)
+        samples = samples.reshape(-1, channels)
+
+        speech = trim_silence(samples, sample_rate, self.silence_threshold_db)
+        if self.target_lufs is not None and len(speech):
+            normalize_loudness(speech, sample_rate, self.target_lufs)
+
+        pauses, lengths = np.empty((0, 2), dtype=np.int64), []
+        if text is not None:
+            pauses, lengths = self.sentence_pauses(speech, sample_rate, text)
+            paragraph_end = paragraph_end or sentence_breaks(text)[1]
+        pause = int(sample_rate * self.pause_ms(paragraph_end) / 1000)
+        size = len(speech) - int((pauses[:, 1] - pauses[:, 0]).sum()) + sum(lengths) + pause
+        output = self._buffer('_output_buffer', size * channels).reshape(-1, channels)
+
+        # Speech is copied around the silences, which become exact pauses
+        position = written = 0
+        for (start, end), length in zip(pauses.tolist(), lengths):
+            np.multiply(speech[position:start], 32767.0, out=output[written:written + start - position], casting='unsafe')
+            written += start - position
+            output[written:written + length] = 0
+            written += length
+            position = end
+        np.multiply(speech[position:], 32767.0, out=output[written:written + len(speech) - position], casting='unsafe')
+        output[written + len(speech) - position:] = 0
+        return memoryview(output.reshape(-1)).cast('B'), 2
@@ -0,0 +1,199 @@
+import os
+import re
+import shutil
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from utils.chunk_store import ChunkStore
+
+'''
+Chapter-aware audiobook output.
+
+Chapters are detected from Markdown headers (PDF headings are turned into
+headers by `pdf_to_markdown(..., detect_headings=True)`). Each chapter is encoded
+on its own as soon as its chunks are rendered, and the encoded chapters are
+joined with a stream copy, so the final file is never re-encoded.
+'''
+
+_HEADING = re.compile(r'^[ \t]*#{1,6}[ \t]+(.+?)[ \t#]*$', re.MULTILINE)
+
+# output format -> (per-chapter extension, per-chapter ffmpeg format, final ffmpeg options)
+OUTPUT_FORMATS: Dict[str, Tuple[str, str, List[str]]] = {
+    'mp3': ('mp3', 'mp3', ['-f', 'mp3']),
+    'm4b': ('aac', 'adts', ['-bsf:a', 'aac_adtstoasc', '-f', 'ipod']),
+}
+
+
+class Chapter(NamedTuple):
+    title: str
+    text: str
+
+
+class ChapterSpan(NamedTuple):
+    title: str
+    start: int  # index of the first chunk of the chapter
+    end: int    # index one past the last chunk of the chapter
+
+
+def split_markdown_into_chapters(markdown_text: str) -> List[Chapter]:
+    """
+    Split Markdown text into chapters at its `#` headers.
+
+    Text before the first header becomes an untitled chapter.
+    """
+    chapters = []
+    title = ''
+    position = 0
+    for match in _HEADING.finditer(markdown_text):
+        body = markdown_text[position:match.start()]
+        if title or body.strip():
+            chapters.append(Chapter(title, body))
+        title = match.group(1).strip()
+        position = match.end()
+    body = markdown_text[position:]
+    if title or body.strip():
+        chapters.append(Chapter(title, body))
+    return chapters
+
+
+def chunk_chapters(chapters: List[Chapter], max_chunk_size: int = 4096) -> Tuple[List[str], List[ChapterSpan]]:
+    """
+    Convert chapters to plain text chunks, keeping track of which chunks belong to each chapter.
+
+    The chapter title is read out as the first chunk of its chapter.
+
+    Returns:
+        The flat list of chunks and one span per chapter.
+    """
+    from utils.pdf_extractor import markdown_to_plain_text, split_text_to_chunks
+
+    chunks: List[str] = []
+    spans: List[ChapterSpan] = []
+    for i, chapter in enumerate(chapters):
+        start = len(chunks)
+        if chapter.title:
+            chunks.append(chapter.title.rstrip('.') + '.')
+        chunks.extend(split_text_to_chunks(markdown_to_plain_text(chapter.text), max_chunk_size))
+        spans.append(ChapterSpan(chapter.title or f"Chapter {i+1}", start, len(chunks)))
+    return chunks, spans
+
+
+def probe_duration(audio_file: str) -> float:
+    """Return the duration of an encoded audio file in seconds, as reported by ffprobe."""
+    output = subprocess.check_output(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', audio_file],
+        text=True)
+    return float(output.strip())
+
+
+def _escape_metadata(value: str) -> str:
+    return re.sub(r'([=;#\\\n])', r'\\\1', value)
+
+
+def write_chapter_metadata(chapters: List[Tuple[str, float]], metadata_file: str, title: Optional[str] = None) -> None:
+    """
+    Write an ffmetadata file with a chapter table.
+
+    Args:
+        chapters: (title, duration in seconds) for each chapter, in order.
+        metadata_file: Path of the metadata file.
+        title: Optional title of the whole book.
+    """
+    lines = [';FFMETADATA1']
+    if title:
+        lines.append(f"title={_escape_metadata(title)}")
+    start = 0
+    for chapter_title, duration in chapters:
+        end = start + int(round(duration * 1000))
+        lines += ['[CHAPTER]', 'TIMEBASE=1/1000', f'START={start}', f'END={end}',
+                  f"title={_escape_metadata(chapter_title)}"]
+        start = end
+    with open(metadata_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+class ChapterEncoder:
+    def __init__(self, store: ChunkStore, chapters: List[ChapterSpan], output_file: str,
+                 output_format: str = 'mp3', workers: Optional[int] = None, bitrate: Optional[str] = None,
+                 texts: Optional[Dict[int, str]] = None):
+        """
+        Encode the chapters of a book in parallel and join them into a single file.
+
+        Every chapter is encoded by its own ffmpeg process, so encoding runs on as
+        many cores as there are workers.
+
+        Args:
+            store: Chunk store holding the rendered chunks.
+            chapters: Chunk span of every chapter, in order.
+            output_file: Path of the final audio file.
+            output_format: 'mp3', or 'm4b' for AAC in an M4B container.
+            workers: Number of chapters encoded at the same time. Defaults to the CPU count.
+            bitrate: Optional target bitrate (e.g. '64k').
+            texts: Text every chunk must have been rendered from, by chunk id. Stale chunk audio is left out.
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        self.store = store
+        self.chapters = chapters
+        self.output_file = output_file
+        self.output_format = output_format
+        self.bitrate = bitrate
+        self.texts = texts
+        self.work_dir = tempfile.mkdtemp(prefix='chapters_', dir=os.path.dirname(os.path.abspath(output_file)))
+        self._executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        self._futures: Dict[int, Future] = {}
+
+    def submit(self, index: int) -> None:
+        """Start encoding a chapter whose chunks are all rendered. Chapters are only encoded once."""
+        if index in self._futures:
+            return
+        span = self.chapters[index]
+        if self.store.audio_format(range(span.start, span.end), self.texts) is None:
+            logging.warning(f"Chapter '{span.title}' has no audio, leaving it out")
+            return
+        extension, chapter_format, _ = OUTPUT_FORMATS[self.output_format]
+        part_file = os.path.join(self.work_dir, f"chapter_{index:04d}.{extension}")
+        logging.info(f"Encoding chapter {index+1}: {span.title}")
+        self._futures[index] = self._executor.submit(
+            self.store.export, part_file, chapter_format, range(span.start, span.end), self.bitrate, self.texts)
+
+    def finish(self, title: Optional[str] = None) -> str:
+        """
+        Encode any remaining chapters, then join all of them with a chapter table.
+
+        Returns:
+            Path to the final audio file.
+        """
+        try:
+            for index in range(len(self.chapters)):
+                self.submit(index)
+            parts = [(self.chapters[index].title, self._futures[index].result()) for index in sorted(self._futures)]
+            if not parts:
+                raise ValueError("No chapter has any audio to export")
+
+            list_file = os.path.join(self.work_dir, 'chapters.txt')
+            with open(list_file, 'w', encoding='utf-8') as f:
+                for _, part_file in parts:
+                    escaped = part_file.replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+
+            metadata_file = os.path.join(self.work_dir, 'metadata.txt')
+            write_chapter_metadata([(chapter_title, probe_duration(part_file)) for chapter_title, part_file in parts],
+                                   metadata_file, title)
+
+            logging.info(f"Joining {len(parts)} chapters into {self.output_file}")
+            command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_file,
+                       '-i', metadata_file, '-map', '0:a', '-map_metadata', '1', '-map_chapters', '1',
+                       '-c', 'copy'] + OUTPUT_FORMATS[self.output_format][2] + [self.output_file]
+            subprocess.run(command, check=True, capture_output=True)
+        finally:
+            self.close()
+        return self.output_file
+
+    def close(self) -> None:
+        """Wait for the chapters being encoded and remove the intermediate files, without joining them."""
+        self._executor.shutdown(wait=True)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
@@ -0,0 +1,366 @@
+import os
+import mmap
+import struct
+import hashlib
+import logging
+import threading
+import subprocess
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+'''
+Append-only store for synthesized chunk audio.
+
+All chunks of a book live in a single binary file of raw PCM segments
+(`<path>.pcm`) next to a compact index (`<path>.idx`). Every index record holds
+the chunk id, the segment offset and length, the PCM format and a hash of the
+text the segment was rendered from. Records are only ever appended; when a
+chunk id appears more than once the latest record wins, which is how chunks are
+corrected without rewriting the rest of the file.
+'''
+
+# chunk_id, offset, length, sample_rate, channels, sample_width, text_hash
+_INDEX_RECORD = struct.Struct('<IQQIHH16s')
+
+# ffmpeg raw input formats for each PCM sample width (in bytes)
+_FFMPEG_PCM_FORMATS = {1: 'u8', 2: 's16le', 4: 's32le'}
+
+
+class ChunkEntry(NamedTuple):
+    chunk_id: int
+    offset: int
+    length: int
+    sample_rate: int
+    channels: int
+    sample_width: int
+    text_hash: bytes
+
+    @property
+    def duration(self) -> float:
+        """Duration of the segment in seconds."""
+        return self.length / (self.sample_rate * self.channels * self.sample_width)
+
+
+def hash_text(text: str) -> bytes:
+    """Return the 16-byte digest used to tie a segment to its source text."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class ChunkStore:
+    def __init__(self, path: str):
+        """
+        Open (or create) the chunk store at `path`.
+
+        Args:
+            path: Path prefix of the store; `.pcm` and `.idx` are appended to it.
+        """
+        self.data_path = path + '.pcm'
+        self.index_path = path + '.idx'
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        # O_APPEND is avoided on the data file: on Linux it makes pwrite ignore the offset
+        self._data_fd = os.open(self.data_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._index_fd = os.open(self.index_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._lock = threading.Lock()
+        self._entries: Dict[int, ChunkEntry] = {}
+        self._index_read = 0
+        self._map: Optional[mmap.mmap] = None
+        self._stale_maps = []
+
+    def __enter__(self) -> 'ChunkStore':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release the mapping and the underlying files."""
+        for mapping in self._stale_maps + [self._map]:
+            if mapping is not None:
+                try:
+                    mapping.close()
+                except BufferError:
+                    # Views handed out by read() are still alive; the mapping goes with them
+                    pass
+        self._map = None
+        self._stale_maps = []
+        os.close(self._data_fd)
+        os.close(self._index_fd)
+
+    # Locking -----------------------------------------------------------------
+
+    def _acquire(self) -> None:
+        self._lock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self._index_fd, fcntl.LOCK_EX)
+
+    def _release(self) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._index_fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    # Index -------------------------------------------------------------------
+
+    def _refresh_index(self) -> None:
+        """Read index records appended since the last refresh (possibly by other processes)."""
+        size = os.fstat(self._index_fd).st_size
+        if size <= self._index_read:
+            return
+        raw = os.pread(self._index_fd, size - self._index_read, self._index_read)
+        usable = len(raw) - len(raw) % _INDEX_RECORD.size
+        for record in _INDEX_RECORD.iter_unpack(raw[:usable]):
+            entry = ChunkEntry(*record)
+            self._entries[entry.chunk_id] = entry
+        self._index_read += usable
+
+    def entries(self) -> Dict[int, ChunkEntry]:
+        """Return the current entry of every chunk id in the store."""
+        with self._lock:
+            self._refresh_index()
+            return dict(self._entries)
+
+    def get_entry(self, chunk_id: int) -> Optional[ChunkEntry]:
+        with self._lock:
+            self._refresh_index()
+            return self._entries.get(chunk_id)
+
+    def has(self, chunk_id: int, text: Optional[str] = None) -> bool:
+        """
+        Check whether a chunk is stored, optionally requiring that it was rendered from `text`.
+        """
+        entry = self.get_entry(chunk_id)
+        if entry is None:
+            return False
+        return text is None or entry.text_hash == hash_text(text)
+
+    # Writing -----------------------------------------------------------------
+
+    def put(self, chunk_id: int, pcm, sample_rate: int, channels: int, sample_width: int, text: str = '') -> ChunkEntry:
+        """
+        Store the PCM of a chunk.
+
+        A new chunk is appended to the end of the data file. When the chunk id is
+        already stored with the same format and the new audio fits in its segment,
+        the segment is overwritten in place so corrections do not grow the file.
+
+        Args:
+            chunk_id: Position of the chunk in the book.
+            pcm: Raw interleaved PCM (any bytes-like object).
+            sample_rate: Sample rate in Hz.
+            channels: Number of interleaved channels.
+            sample_width: Bytes per sample.
+            text: Text the audio was rendered from.
+
+        Returns:
+            The index entry written for the chunk.
+        """
+        pcm = memoryview(pcm).cast('B')
+        self._acquire()
+        try:
+            self._refresh_index()
+            old = self._entries.get(chunk_id)
+            if (old is not None and len(pcm) <= old.length
+                    and (old.sample_rate, old.channels, old.sample_width) == (sample_rate, channels, sample_width)):
+                offset = old.offset
+            else:
+                offset = os.fstat(self._data_fd).st_size
+            os.pwrite(self._data_fd, pcm, offset)
+
+            entry = ChunkEntry(chunk_id, offset, len(pcm), sample_rate, channels, sample_width, hash_text(text))
+            os.write(self._index_fd, _INDEX_RECORD.pack(*entry))
+            self._entries[chunk_id] = entry
+            self._index_read += _INDEX_RECORD.size
+        finally:
+            self._release()
+        return entry
+
+    # Reading -----------------------------------------------------------------
+
+    def _mapping(self, end: int) -> mmap.mmap:
+        """Return a read-only mapping of the data file covering at least `end` bytes."""
+        if self._map is None or len(self._map) < end:
+            if self._map is not None:
+                # Earlier views may still point into the old mapping, so it is kept open
+                self._stale_maps.append(self._map)
+            self._map = mmap.mmap(self._data_fd, 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def read(self, chunk_id: int) -> memoryview:
+        """
+        Return the PCM of a chunk as a zero-copy view into the mapped data file.
+
+        The view is only valid until the store is closed.
+        """
+        with self._lock:
+            self._refresh_index()
+            entry = self._entries.get(chunk_id)
+            if entry is None:
+                raise KeyError(f"Chunk {chunk_id} is not in the store")
+            if entry.length == 0:
+                return memoryview(b'')
+            mapping = self._mapping(entry.offset + entry.length)
+        return memoryview(mapping)[entry.offset:entry.offset + entry.length]
+
+    @staticmethod
+    def _current(entry: Optional[ChunkEntry], chunk_id: int, text: Optional[str], warn: bool = True) -> Optional[ChunkEntry]:
+        """Return `entry` if it holds audio rendered from `text` (any text when None), otherwise None."""
+        if entry is None:
+            if warn:
+                logging.warning(f"Chunk {chunk_id} has no audio in the store, skipping")
+            return None
+        if text is not None and entry.text_hash != hash_text(text):
+            # The chunk was edited and its new audio could not be rendered; the old audio would not match the text
+            if warn:
+                logging.warning(f"Chunk {chunk_id} only has audio of a previous version of its text, skipping")
+            return None
+        return entry
+
+    def iter_segments(self, chunk_ids: Optional[Iterable[int]] = None,
+                      texts: Optional[Dict[int, str]] = None) -> Iterator[memoryview]:
+        """
+        Yield the PCM views of the given chunk ids (all stored chunks by default) in order.
+
+        Chunk ids without audio, or whose audio was not rendered from their entry in
+        `texts`, are skipped with a warning.
+        """
+        entries = self.entries()
+        if chunk_ids is None:
+            chunk_ids = sorted(entries)
+        for chunk_id in chunk_ids:
+            if self._current(entries.get(chunk_id), chunk_id, (texts or {}).get(chunk_id)) is not None:
+                yield self.read(chunk_id)
+
+    def audio_format(self, chunk_ids: Optional[Iterable[int]] = None, texts: Optional[Dict[int, str]] = None) -> Optional[tuple]:
+        """
+        Return the common (sample_rate, channels, sample_width) of the given chunks, or None when none
+        of them has audio (rendered from its entry in `texts`).
+
+        Raises:
+            ValueError: If the chunks were stored with different formats.
+        """
+        entries = self.entries()
+        ids = sorted(entries) if chunk_ids is None else chunk_ids
+        current = [self._current(entries.get(i), i, (texts or {}).get(i), warn=False) for i in ids]
+        formats = {(entry.sample_rate, entry.channels, entry.sample_width) for entry in current if entry is not None}
+        if not formats:
+            return None
+        if len(formats) != 1:
+            raise ValueError(f"Expected a single audio format in the chunk store, found {sorted(formats)}")
+        return formats.pop()
+
+    def export(self, output_file: str, format: str = 'mp3', chunk_ids: Optional[Iterable[int]] = None,
+               bitrate: Optional[str] = None, texts: Optional[Dict[int, str]] = None) -> str:
+        """
+        Encode the stored chunks into a single audio file.
+
+        Segments are streamed straight from the mapped data file into ffmpeg's
+        stdin, so the book is never decoded into memory as a whole.
+
+        Args:
+            output_file: Path of the encoded file.
+            format: Output container/format understood by ffmpeg.
+            chunk_ids: Chunks to include, in order. Defaults to every stored chunk.
+            bitrate: Optional target bitrate (e.g. '64k').
+            texts: Text every chunk must have been rendered from, by chunk id. Chunks holding audio
+                of other text are left out with a warning.
+
+        Returns:
+            Path to the encoded file.
+
+        Raises:
+            ValueError: If none of the chunks has audio, or they do not share one format.
+        """
+        chunk_ids = sorted(self.entries()) if chunk_ids is None else list(chunk_ids)
+        # Fails early, before ffmpeg is started
+        if self.audio_format(chunk_ids, texts) is None:
+            raise ValueError(f"None of the {len(chunk_ids)} chunks to encode to {output_file} has audio in the store")
+        logging.info(f"Encoding {len(chunk_ids)} chunks to {output_file}")
+        with ChunkExporter(self, output_file, format, bitrate) as exporter:
+            for chunk_id in chunk_ids:
+                exporter.write(chunk_id, (texts or {}).get(chunk_id))
+        return output_file
+
+
+class ChunkExporter:
+    def __init__(self, store: ChunkStore, output_file: str, format: str = 'mp3', bitrate: Optional[str] = None):
+        """
+        Encode chunks into a single audio file as they are handed over.
+
+        ffmpeg is started with the format of the first chunk written, so encoding
+        can begin while later chunks are still being synthesized.
+
+        Args:
+            store: Chunk store the chunks are read from.
+            output_file: Path of the encoded file.
+            format: Output container/format understood by ffmpeg.
+            bitrate: Optional target bitrate (e.g. '64k').
+        """
+        self.store = store
+        self.output_file = output_file
+        self.format = format
+        self.bitrate = bitrate
+        self.audio_format: Optional[tuple] = None
+        self._command = None
+        self._process: Optional[subprocess.Popen] = None
+
+    def __enter__(self) -> 'ChunkExporter':
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None:
+            self.close()
+        elif self._process is not None:
+            self._process.kill()
+            self._process.wait()
+
+    def _start(self, sample_rate: int, channels: int, sample_width: int) -> None:
+        self._command = ['ffmpeg', '-y', '-loglevel', 'error',
+                         '-f', _FFMPEG_PCM_FORMATS[sample_width], '-ar', str(sample_rate), '-ac', str(channels),
+                         '-i', 'pipe:0', '-f', self.format]
+        if self.bitrate:
+            self._command += ['-b:a', self.bitrate]
+        self._command.append(self.output_file)
+        self._process = subprocess.Popen(self._command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, chunk_id: int, text: Optional[str] = None) -> Optional[ChunkEntry]:
+        """
+        Append the audio of a chunk to the encoded file.
+
+        Args:
+            chunk_id: The chunk to append.
+            text: Text the chunk's audio must have been rendered from. None accepts any audio.
+
+        Returns:
+            The entry of the chunk, or None (with a warning) when it has no audio in the store
+            or only audio of other text.
+
+        Raises:
+            ValueError: If the chunk's PCM format differs from the chunks written before it.
+        """
+        entry = self.store._current(self.store.get_entry(chunk_id), chunk_id, text)
+        if entry is None:
+            return None
+        audio_format = (entry.sample_rate, entry.channels, entry.sample_width)
+        if self.audio_format is None:
+            self.audio_format = audio_format
+            self._start(*audio_format)
+        elif audio_format != self.audio_format:
+            raise ValueError(f"Chunk {chunk_id} has format {audio_format}, expected {self.audio_format}")
+        self._process.stdin.write(self.store.read(chunk_id))
+        return entry
+
+    def close(self) -> str:
+        """Finish encoding and return the path of the encoded file."""
+        if self._process is None:
+            raise ValueError(f"No audio was written to {self.output_file}")
+        self._process.stdin.close()
+        stderr = self._process.stderr.read()
+        self._process.stderr.close()
+        if self._process.wait() != 0:
+            raise subprocess.CalledProcessError(self._process.returncode, self._command, stderr=stderr)
+        return self.output_file
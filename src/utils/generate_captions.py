@@ -3,6 +3,7 @@ import time
 import re
 import os
 import nltk
+from utils.subtitles import Cue, write_lrc, write_srt
 nltk.download('punkt', quiet=True)
 
 # Set up logging
@@ -46,13 +47,8 @@ def generate_srt(timestamps, output_folder, caption_name):
     Generate SRT file content from timestamps.
     """
     logging.info("Generating SRT file.")
-    srt_content = ""
-    for i, (sentence, start, end) in enumerate(timestamps):
-        start_time = time.strftime('%H:%M:%S', time.gmtime(start)) + f',{int((start % 1) * 1000):03d}'
-        end_time = time.strftime('%H:%M:%S', time.gmtime(end)) + f',{int((end % 1) * 1000):03d}'
-        srt_content += f"{i+1}\n{start_time} --> {end_time}\n{sentence.strip()}\n\n"
-    with open(os.path.join(output_folder, caption_name + '.srt'), 'w') as f:
-        f.write(srt_content)
+    write_srt((Cue(start, end, sentence) for sentence, start, end in timestamps),
+              os.path.join(output_folder, caption_name + '.srt'))
     logging.info("SRT file generated.")
 
 def generate_lrc(timestamps, output_folder, caption_name):
@@ -60,12 +56,8 @@ def generate_lrc(timestamps, output_folder, caption_name):
     Generate LRC file content from timestamps.
     """
     logging.info("Generating LRC file.")
-    lrc_content = ""
-    for sentence, start, _ in timestamps:
-        start_time = time.strftime('[%M:%S', time.gmtime(start)) + f'.{int((start % 1) * 100):02d}]'
-        lrc_content += f"{start_time} {sentence.strip()}\n"
-    with open(os.path.join(output_folder, caption_name + '.lrc'), 'w') as f:
-        f.write(lrc_content)
+    write_lrc((Cue(start, end, sentence) for sentence, start, end in timestamps),
+              os.path.join(output_folder, caption_name + '.lrc'))
     logging.info("LRC file generated.")
 
 def generate_captions(text, audio_duration, output_folder, caption_name):
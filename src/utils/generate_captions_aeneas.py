@@ -4,6 +4,7 @@ from aeneas.executetask import ExecuteTask
 from aeneas.task import Task
 from aeneas.textfile import TextFile
 from aeneas.language import Language
+from utils.subtitles import parse_srt, write_lrc
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -42,17 +43,7 @@ def srt_to_lrc(srt_file, lrc_file):
     Convert SRT file to LRC format.
     """
     logging.info("Converting SRT to LRC.")
-    
-    with open(srt_file, 'r') as srt, open(lrc_file, 'w') as lrc:
-        for line in srt:
-            if '-->' in line:
-                start_time = line.split('-->')[0].strip()
-                h, m, s = start_time.split(':')
-                s, ms = s.split(',')
-                lrc_time = f"[{m}:{s}.{ms[:2]}]"
-            elif line.strip() and not line[0].isdigit():
-                lrc.write(f"{lrc_time} {line}")
-
+    write_lrc(parse_srt(srt_file), lrc_file)
     logging.info("LRC file generated.")
 
 # Example usage:
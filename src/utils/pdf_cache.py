@@ -0,0 +1,183 @@
+# Persistent per-page cache of PDF text extraction
+import os
+import json
+import hashlib
+import logging
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+'''
+pdfplumber's layout analysis is the slowest text stage, and re-spacing every
+page with spaCy comes right after it. Both only depend on the PDF and on how
+they are run, so their per-page results are persisted and reused by every
+later run on the same document, e.g. when only the voice changed.
+
+Each PDF has one cache file, named after the hash of its content and read in a
+single bulk read when the document is opened. Inside it, raw page text is
+keyed by the extraction parameters (x/y tolerance, heading detection), and
+re-spaced Markdown additionally by the version of the re-spacing model, so
+upgrading spaCy re-runs the re-spacing without re-running pdfplumber.
+
+Pre-extract a directory of PDFs in parallel:
+
+    python -m utils.pdf_cache warm path/to/books/ --workers 8
+'''
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'text-to-speech-toolbox', 'pdf_pages')
+
+
+def pdf_content_hash(pdf_path):
+    """Hash the content of a PDF, so a renamed or copied file still hits the cache."""
+    digest = hashlib.sha256()
+    with open(pdf_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extraction_params(x_tolerance, y_tolerance, detect_headings):
+    """Return the cache key of the pdfplumber parameters raw page text depends on."""
+    return f"x{x_tolerance}|y{y_tolerance}|headings{int(bool(detect_headings))}"
+
+
+class CachedPdf:
+    def __init__(self, path, content_hash):
+        """
+        The cached pages of one PDF. Lookups are served from memory; new pages are written by `save`.
+
+        Args:
+            path: Path of the cache file.
+            content_hash: Hash of the PDF content.
+        """
+        self.path = path
+        self.content_hash = content_hash
+        self.data = self._load()
+        self._dirty = False
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable PDF cache file {self.path}: {e}")
+            data = {}
+        data.setdefault('page_count', None)
+        data.setdefault('raw', {})
+        data.setdefault('markdown', {})
+        return data
+
+    @property
+    def page_count(self):
+        return self.data['page_count']
+
+    @page_count.setter
+    def page_count(self, count):
+        if count != self.data['page_count']:
+            self.data['page_count'] = count
+            self._dirty = True
+
+    def raw(self, page_index, params):
+        """Return the cached raw text of a page, or None."""
+        return self.data['raw'].get(params, {}).get(str(page_index))
+
+    def put_raw(self, page_index, params, text):
+        self.data['raw'].setdefault(params, {})[str(page_index)] = text
+        self._dirty = True
+
+    def markdown(self, page_index, params, model_version):
+        """Return the cached Markdown of a page re-spaced by `model_version`, or None."""
+        return self.data['markdown'].get(f"{params}|{model_version}", {}).get(str(page_index))
+
+    def put_markdown(self, page_index, params, model_version, markdown):
+        self.data['markdown'].setdefault(f"{params}|{model_version}", {})[str(page_index)] = markdown
+        self._dirty = True
+
+    def save(self):
+        """Write the pages added since the document was opened, keeping the pages other runs added meanwhile."""
+        if not self._dirty:
+            return
+        on_disk = self._load()
+        for section in ('raw', 'markdown'):
+            for key, pages in self.data[section].items():
+                on_disk[section].setdefault(key, {}).update(pages)
+        on_disk['page_count'] = self.data['page_count'] or on_disk['page_count']
+        self.data = on_disk
+
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first so concurrent runs never read a partial cache file
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+        self._dirty = False
+
+
+class PdfPageCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        # Content hashes by path and file stats, so PDFs are only hashed again when they change
+        self._hashes = {}
+
+    def open(self, pdf_path):
+        """Open the cached pages of a PDF."""
+        stat = os.stat(pdf_path)
+        stats = (os.path.abspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+        if stats not in self._hashes:
+            self._hashes[stats] = pdf_content_hash(pdf_path)
+        content_hash = self._hashes[stats]
+        return CachedPdf(os.path.join(self.cache_dir, f"{content_hash}.json"), content_hash)
+
+
+def _warm_pdf(pdf_path, cache_dir, detect_headings):
+    from utils.pdf_extractor import pdf_to_markdown
+    return len(pdf_to_markdown(pdf_path, detect_headings=detect_headings, cache=PdfPageCache(cache_dir)))
+
+
+def warm_cache(paths, cache_dir=DEFAULT_CACHE_DIR, workers=None, detect_headings=False):
+    """
+    Extract and re-space every page of the given PDFs (or of the PDFs in the given directories) into the cache.
+
+    Documents are processed in parallel, one per process; pdfplumber and spaCy are CPU-bound, so threads would not help.
+
+    Returns:
+        The number of documents cached.
+    """
+    pdfs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                pdfs += sorted(os.path.join(root, name) for name in files if name.lower().endswith('.pdf'))
+        else:
+            pdfs.append(path)
+
+    cached = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_warm_pdf, pdf, cache_dir, detect_headings): pdf for pdf in pdfs}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                cached += 1
+                logging.info(f"Cached {futures[future]}")
+            except Exception as e:
+                logging.error(f"Failed to cache {futures[future]}: {e}")
+    logging.info(f"Cached {cached} of {len(pdfs)} PDFs in {cache_dir}")
+    return cached
+
+
+# Example usage:
+#   python -m utils.pdf_cache warm path/to/books/ --workers 8
+#   python -m utils.pdf_cache warm book.pdf --detect_headings
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='PDF extraction cache')
+    parser.add_argument('command', choices=['warm'], help='warm: pre-extract PDFs into the cache')
+    parser.add_argument('paths', nargs='+', help='PDF files or directories of PDF files')
+    parser.add_argument('--cache_dir', type=str, default=DEFAULT_CACHE_DIR, help='Cache folder')
+    parser.add_argument('--workers', type=int, default=None, help='Documents extracted in parallel (default: CPU count)')
+    parser.add_argument('--detect_headings', action='store_true', help='Cache the heading-detecting extraction used by --chapters')
+    args = parser.parse_args()
+    warm_cache(args.paths, args.cache_dir, args.workers, args.detect_headings)
@@ -4,6 +4,7 @@ import re # Importing the 're' module for regular expression operations
 import os
 from pydub import AudioSegment
 from moviepy.editor import concatenate_audioclips, AudioFileClip
+from utils.pdf_cache import extraction_params
 
 ''' 
 Using spacy to correctly separate words when reading the content of PDFs
@@ -17,23 +18,117 @@ def add_spaces_to_text(text):
     doc = nlp(text)
     return ' '.join([token.text for token in doc])
 
-def pdf_to_markdown(pdf_path, page_numbers=None):
+def respace_model_version():
+    """
+    Identify the re-spacing done by `add_spaces_to_text`, so cached re-spaced text is invalidated when the model changes.
+    """
+    return f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}/spacy-{spacy.__version__}"
+
+def _page_text_with_headings(page, x_tolerance=1, y_tolerance=3, heading_scale=1.2):
+    """
+    Extract the text of a page, prefixing lines set in a larger font than the body with '# '.
+    """
+    lines = page.extract_text_lines(x_tolerance=x_tolerance, y_tolerance=y_tolerance, return_chars=True)
+    sizes = sorted(char['size'] for line in lines for char in line['chars'])
+    if not sizes:
+        return ''
+    body_size = sizes[len(sizes) // 2]
+
+    page_lines = []
+    for line in lines:
+        line_sizes = sorted(char['size'] for char in line['chars'])
+        if line_sizes and line_sizes[len(line_sizes) // 2] >= body_size * heading_scale:
+            page_lines.append('# ' + line['text'])
+        else:
+            page_lines.append(line['text'])
+    return '\n'.join(page_lines)
+
+def extract_page_text(page, detect_headings=False, x_tolerance=1, y_tolerance=3, cache=None):
+    """
+    Extract the raw text of one pdfplumber page ('' when the page has no text).
+
+    With a `CachedPdf` of the page's document (see `utils.pdf_cache`), the text is
+    looked up first and stored after extraction.
+    """
+    if cache is not None:
+        params = extraction_params(x_tolerance, y_tolerance, detect_headings)
+        text = cache.raw(page.page_number - 1, params)
+        if text is not None:
+            return text
+
+    if detect_headings:
+        # Lines in a larger font become Markdown headers, used as chapter boundaries
+        text = _page_text_with_headings(page, x_tolerance=x_tolerance, y_tolerance=y_tolerance) or ''
+    else:
+        text = page.extract_text(x_tolerance=x_tolerance, y_tolerance=y_tolerance) or ''
+
+    if cache is not None:
+        cache.put_raw(page.page_number - 1, params, text)
+    return text
+
+def page_text_to_markdown(text):
+    """
+    Turn the raw text of a page into its Markdown, including the page separator ('' for empty pages).
+    """
+    if not text:
+        return ''
+    # Add spaces where they might be missing using spaCy
+    text = add_spaces_to_text(text)
+    # Format the text with basic Markdown: double newline for new paragraphs
+    markdown_page = text.replace('\n', '\n\n')
+    # Add a separator line between pages
+    return markdown_page + '\n\n---\n\n'
+
+def pdf_page_count(pdf_path):
     with pdfplumber.open(pdf_path) as pdf:
-        markdown_content = ""
+        return len(pdf.pages)
+
+def pdf_to_markdown(pdf_path, page_numbers=None, detect_headings=False, x_tolerance=1, y_tolerance=3, cache=None):
+    """
+    Convert the pages of a PDF to Markdown.
+
+    With a `PdfPageCache`, pages extracted and re-spaced by an earlier run are
+    reused; the PDF is only opened when a page is missing from the cache.
+    """
+    if cache is None:
+        with pdfplumber.open(pdf_path) as pdf:
+            markdown_content = ""
+            if page_numbers is None:
+                page_numbers = range(len(pdf.pages))
+            for page_num in page_numbers:
+                # Extract text from each page
+                text = extract_page_text(pdf.pages[page_num], detect_headings, x_tolerance, y_tolerance)
+                markdown_content += page_text_to_markdown(text)
+            return markdown_content
+
+    cached = cache.open(pdf_path)
+    params = extraction_params(x_tolerance, y_tolerance, detect_headings)
+    model_version = respace_model_version()
+    pdf = None
+    try:
         if page_numbers is None:
-            page_numbers = range(len(pdf.pages))
+            if cached.page_count is None:
+                pdf = pdfplumber.open(pdf_path)
+                cached.page_count = len(pdf.pages)
+            page_numbers = range(cached.page_count)
+        pages = []
         for page_num in page_numbers:
-            page = pdf.pages[page_num]
-            # Extract text from each page
-            text = page.extract_text(x_tolerance=1, y_tolerance=3)
-            if text:
-                # Add spaces where they might be missing using spaCy
-                text = add_spaces_to_text(text)
-                # Format the text with basic Markdown: double newline for new paragraphs
-                markdown_page = text.replace('\n', '\n\n')
-                # Add a separator line between pages
-                markdown_content += markdown_page + '\n\n---\n\n'
-        return markdown_content
+            markdown_page = cached.markdown(page_num, params, model_version)
+            if markdown_page is None:
+                # Raw text outlives a change of the re-spacing model
+                text = cached.raw(page_num, params)
+                if text is None:
+                    if pdf is None:
+                        pdf = pdfplumber.open(pdf_path)
+                    text = extract_page_text(pdf.pages[page_num], detect_headings, x_tolerance, y_tolerance, cached)
+                markdown_page = page_text_to_markdown(text)
+                cached.put_markdown(page_num, params, model_version, markdown_page)
+            pages.append(markdown_page)
+        return ''.join(pages)
+    finally:
+        if pdf is not None:
+            pdf.close()
+        cached.save()
 
 '''
 Converting Markdown to Plain Text
@@ -70,15 +165,22 @@ cleaned_text = plain_text.replace("artifact", "")
 '''
 Splitting Text into Manageable Chunks for Text-to-Speech
 '''
+def _starts_paragraph(sentence):
+    """Whether the raw text of a sentence starts after a blank line."""
+    return sentence[:len(sentence) - len(sentence.lstrip())].count('\n') >= 2
+
 def split_text_to_chunks(text, max_chunk_size=4096):
     chunks = []  # List to hold the chunks of text
     current_chunk = ""  # String to build the current chunk
 
     # Split the text into sentences and iterate through them
     for sentence in text.split('.'):
+        paragraph = _starts_paragraph(sentence)
         sentence = sentence.strip()  # Remove leading/trailing whitespaces
         if not sentence:
             continue  # Skip empty sentences
+        if paragraph and current_chunk:
+            current_chunk += "\n\n"  # Keep the paragraph break, so its pause can be longer
 
         # Check if adding the sentence would exceed the max chunk size
         if len(current_chunk) + len(sentence) + 1 <= max_chunk_size:
@@ -93,6 +195,52 @@ def split_text_to_chunks(text, max_chunk_size=4096):
 
     return chunks
 
+class ChunkSplitter:
+    """
+    Incremental `split_text_to_chunks`: text is fed piece by piece (e.g. page by page)
+    and complete chunks are returned as soon as they are known. Feeding all the
+    pieces and flushing gives exactly the chunks of `split_text_to_chunks` on the
+    joined text.
+    """
+
+    def __init__(self, max_chunk_size=4096):
+        self.max_chunk_size = max_chunk_size
+        self.current_chunk = ""
+        # Text after the last '.', which may still continue in the next piece
+        self.pending = ""
+
+    def _add_sentence(self, sentence, chunks):
+        paragraph = _starts_paragraph(sentence)
+        sentence = sentence.strip()
+        if not sentence:
+            return
+        if paragraph and self.current_chunk:
+            self.current_chunk += "\n\n"
+        if len(self.current_chunk) + len(sentence) + 1 <= self.max_chunk_size:
+            self.current_chunk += sentence + "."
+        else:
+            chunks.append(self.current_chunk)
+            self.current_chunk = sentence + "."
+
+    def feed(self, text):
+        """Add text and return the chunks completed by it."""
+        chunks = []
+        sentences = (self.pending + text).split('.')
+        self.pending = sentences.pop()
+        for sentence in sentences:
+            self._add_sentence(sentence, chunks)
+        return chunks
+
+    def flush(self):
+        """Return the remaining chunks once all the text has been fed."""
+        chunks = []
+        self._add_sentence(self.pending, chunks)
+        self.pending = ""
+        if self.current_chunk:
+            chunks.append(self.current_chunk)
+            self.current_chunk = ""
+        return chunks
+
 '''
 Usage:
 # chunks = split_text(cleaned_text) # use this if you have cleaned the text, else use the next line.
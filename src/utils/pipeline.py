@@ -0,0 +1,272 @@
+import time
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+'''
+Pipelined stage execution with bounded queues.
+
+Each stage runs in its own worker threads and hands its results to the next
+stage through a bounded queue. A full queue blocks the stage feeding it
+(backpressure), so a fast text stage cannot run arbitrarily far ahead of
+synthesis, and the total time approaches that of the slowest stage instead of
+the sum of all stages.
+
+Results leave every stage in input order, whatever the number of workers:
+completed items wait in a small reorder buffer until the items before them are
+done. A fan-out stage turns each input into any number of outputs (e.g. a page
+into chunks); it may keep state between inputs and emit what it still holds
+when its input is exhausted.
+'''
+
+_DONE = object()
+
+
+class PipelineError(Exception):
+    """Raised by `Pipeline.run` when a stage fails; the stage's exception is the cause."""
+
+
+class Stage:
+    def __init__(self, name: str, fn: Callable[[Any], Any], workers: int = 1, queue_size: int = 8,
+                 fan_out: bool = False, flush: Optional[Callable[[], Iterable[Any]]] = None):
+        """
+        Args:
+            name: Name used in logs and the utilization report.
+            fn: Called with every input item. Returns the output item, or an iterable of output items for a fan-out stage.
+            workers: Number of threads running `fn`.
+            queue_size: Capacity of the queue in front of the stage.
+            fan_out: Whether `fn` returns any number of outputs per input.
+            flush: Called once after the last input; returns the remaining outputs. Requires a single worker.
+        """
+        if workers < 1:
+            raise ValueError(f"Stage {name} needs at least one worker")
+        if flush is not None and workers != 1:
+            raise ValueError(f"Stage {name} has a flush function, so it must run with a single worker")
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue_size = queue_size
+        self.fan_out = fan_out
+        self.flush = flush
+
+
+class StageStats(NamedTuple):
+    name: str
+    workers: int
+    items_in: int
+    items_out: int
+    busy: float           # seconds spent in the stage function, summed over workers
+    waiting_input: float  # seconds workers waited for input (the stage was starved)
+    waiting_output: float # seconds workers waited on a full downstream queue (backpressure)
+    utilization: float    # busy time over the workers' wall time
+
+
+class _StageRunner:
+    def __init__(self, stage: Stage, inbox: queue.Queue, outbox: queue.Queue, abort: threading.Event, number_outputs: bool):
+        self.stage = stage
+        self.inbox = inbox
+        self.outbox = outbox
+        self.abort = abort
+        # Outputs going to another stage are numbered for its reorder buffer
+        self.number_outputs = number_outputs
+        self.out_sequence = 0
+        self.lock = threading.Condition()
+        # Completed results waiting for the results before them, by input sequence number
+        self.reorder: Dict[int, Any] = {}
+        self.next_emit = 0
+        self.running = stage.workers
+        self.items_in = 0
+        self.items_out = 0
+        self.busy = 0.0
+        self.waiting_input = 0.0
+        self.waiting_output = 0.0
+        self.started = 0.0
+        self.finished = 0.0
+        self.error: Optional[BaseException] = None
+        self.threads = [threading.Thread(target=self._work, name=f"{stage.name}-{i}", daemon=True)
+                        for i in range(stage.workers)]
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        for thread in self.threads:
+            thread.start()
+
+    def _get(self):
+        start = time.perf_counter()
+        while not self.abort.is_set():
+            try:
+                item = self.inbox.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        else:
+            item = _DONE
+        with self.lock:
+            self.waiting_input += time.perf_counter() - start
+        return item
+
+    def _put(self, item) -> None:
+        # Called with the lock held
+        if self.number_outputs and item is not _DONE:
+            item = (self.out_sequence, item)
+            self.out_sequence += 1
+        start = time.perf_counter()
+        while not self.abort.is_set():
+            try:
+                self.outbox.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.waiting_output += time.perf_counter() - start
+
+    def _emit(self, outputs) -> None:
+        # Called with the lock held, so outputs leave in order
+        for output in (outputs if self.stage.fan_out else [outputs]):
+            self._put(output)
+            self.items_out += 1
+
+    def _work(self) -> None:
+        while True:
+            item = self._get()
+            if item is _DONE:
+                break
+            sequence, value = item
+            with self.lock:
+                self.items_in += 1
+                # Keep the reorder buffer bounded: do not run far ahead of a slow item
+                while sequence - self.next_emit >= 4 * self.stage.workers and not self.abort.is_set():
+                    self.lock.wait(0.1)
+
+            start = time.perf_counter()
+            try:
+                result = self.stage.fn(value)
+                if self.stage.fan_out:
+                    result = list(result)
+            except BaseException as e:
+                self._fail(e)
+                break
+            elapsed = time.perf_counter() - start
+
+            with self.lock:
+                self.busy += elapsed
+                self.reorder[sequence] = result
+                while self.next_emit in self.reorder:
+                    self._emit(self.reorder.pop(self.next_emit))
+                    self.next_emit += 1
+                self.lock.notify_all()
+
+        if item is _DONE and not self.abort.is_set():
+            # Let the sibling workers see the end of the input too
+            self.inbox.put(_DONE)
+        with self.lock:
+            self.running -= 1
+            last = self.running == 0
+        if last:
+            self._finish()
+
+    def _finish(self) -> None:
+        with self.lock:
+            if self.stage.flush is not None and not self.abort.is_set():
+                start = time.perf_counter()
+                try:
+                    outputs = list(self.stage.flush())
+                except BaseException as e:
+                    self._fail(e)
+                    outputs = []
+                self.busy += time.perf_counter() - start
+                for output in outputs:
+                    self._put(output)
+                    self.items_out += 1
+            self.finished = time.perf_counter()
+            self._put(_DONE)
+
+    def _fail(self, error: BaseException) -> None:
+        logging.error(f"Pipeline stage {self.stage.name} failed: {error}")
+        self.error = error
+        self.abort.set()
+
+    def stats(self) -> StageStats:
+        wall = ((self.finished or time.perf_counter()) - self.started) * self.stage.workers
+        return StageStats(self.stage.name, self.stage.workers, self.items_in, self.items_out, self.busy,
+                          self.waiting_input, self.waiting_output, self.busy / wall if wall > 0 else 0.0)
+
+
+class Pipeline:
+    def __init__(self, stages: List[Stage]):
+        """Chain `stages` with bounded queues; each stage's output is the next stage's input."""
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self._runners: List[_StageRunner] = []
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        """
+        Feed `items` through the stages and yield the outputs of the last stage in order.
+
+        Raises:
+            PipelineError: If a stage raised; the remaining stages are stopped.
+        """
+        abort = threading.Event()
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        results = queue.Queue(maxsize=self.stages[-1].queue_size)
+        self._runners = []
+        for index, stage in enumerate(self.stages):
+            last = index + 1 == len(self.stages)
+            self._runners.append(_StageRunner(stage, queues[index], results if last else queues[index + 1], abort, not last))
+
+        feeder_error = []
+
+        def feed():
+            try:
+                for sequence, item in enumerate(items):
+                    while not abort.is_set():
+                        try:
+                            queues[0].put((sequence, item), timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if abort.is_set():
+                        return
+            except BaseException as e:
+                logging.error(f"Pipeline input failed: {e}")
+                feeder_error.append(e)
+                abort.set()
+                return
+            queues[0].put(_DONE)
+
+        for runner in self._runners:
+            runner.start()
+        feeder = threading.Thread(target=feed, name='pipeline-feed', daemon=True)
+        feeder.start()
+
+        try:
+            while True:
+                try:
+                    item = results.get(timeout=0.1)
+                except queue.Empty:
+                    if abort.is_set():
+                        break
+                    continue
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            # Stops the stages when the consumer gives up early; a no-op after a complete run
+            abort.set()
+            for runner in self._runners:
+                if runner.error is not None:
+                    raise PipelineError(f"Stage {runner.stage.name} failed: {runner.error}") from runner.error
+            if feeder_error:
+                raise PipelineError(f"Pipeline input failed: {feeder_error[0]}") from feeder_error[0]
+
+    def stats(self) -> List[StageStats]:
+        """Return the statistics of every stage of the last run."""
+        return [runner.stats() for runner in self._runners]
+
+    def log_stats(self) -> None:
+        """Log the per-stage utilization of the last run; the busiest stage is the bottleneck."""
+        for stats in self.stats():
+            logging.info(f"Stage {stats.name:12s} workers={stats.workers} in={stats.items_in} out={stats.items_out} "
+                         f"busy={stats.busy:.2f}s starved={stats.waiting_input:.2f}s blocked={stats.waiting_output:.2f}s "
+                         f"utilization={stats.utilization:.0%}")
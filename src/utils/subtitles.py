@@ -0,0 +1,432 @@
+import os
+import re
+import logging
+from itertools import islice
+from typing import IO, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+'''
+Streaming SRT, WebVTT and LRC writers and parsers, plus cue operations.
+
+Writers consume any iterable of cues in batches and format all the timestamps
+of a batch at once with NumPy, so millions of cues can be written without
+building the whole file in memory. Parsers are generators that read one cue
+at a time.
+'''
+
+BATCH_SIZE = 10000
+
+
+class Cue(NamedTuple):
+    start: float  # seconds
+    end: float    # seconds
+    text: str
+
+
+PathOrFile = Union[str, IO[str]]
+
+
+def _digits(values: np.ndarray, width: int) -> np.ndarray:
+    """Return the zero-padded ASCII digits of non-negative integers as an (n, width) uint8 array."""
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    return (values[:, None] // powers % 10 + 48).astype(np.uint8)
+
+
+def format_timestamps(seconds: Sequence[float], style: str = 'srt') -> List[str]:
+    """
+    Format timestamps in seconds for a subtitle format, vectorized over the whole sequence.
+
+    Args:
+        seconds: Timestamps in seconds (negative values are clamped to 0).
+        style: 'srt' (HH:MM:SS,mmm), 'vtt' (HH:MM:SS.mmm) or 'lrc' ([MM:SS.xx], minutes not wrapped at the hour).
+
+    Returns:
+        The formatted timestamps.
+    """
+    seconds = np.maximum(np.asarray(seconds, dtype=np.float64), 0.0)
+    if not len(seconds):
+        return []
+    # Round to whole milliseconds first, so float noise (62.345 * 100 = 6234.4999...) does not leak into coarser units
+    milliseconds = np.rint(seconds * 1000).astype(np.int64)
+    if style == 'lrc':
+        centiseconds = (milliseconds + 5) // 10
+        minutes = centiseconds // 6000
+        width = max(2, len(str(int(minutes.max()))))
+        columns = [np.full((len(seconds), 1), ord('['), np.uint8), _digits(minutes, width), np.full((len(seconds), 1), ord(':'), np.uint8),
+                   _digits(centiseconds // 100 % 60, 2), np.full((len(seconds), 1), ord('.'), np.uint8),
+                   _digits(centiseconds % 100, 2), np.full((len(seconds), 1), ord(']'), np.uint8)]
+    elif style in ('srt', 'vtt'):
+        hours = milliseconds // 3600000
+        width = max(2, len(str(int(hours.max()))))
+        colon = np.full((len(seconds), 1), ord(':'), np.uint8)
+        separator = np.full((len(seconds), 1), ord(',' if style == 'srt' else '.'), np.uint8)
+        columns = [_digits(hours, width), colon, _digits(milliseconds // 60000 % 60, 2), colon,
+                   _digits(milliseconds // 1000 % 60, 2), separator, _digits(milliseconds % 1000, 3)]
+    else:
+        raise ValueError(f"Unknown subtitle style: {style}")
+    table = np.ascontiguousarray(np.concatenate(columns, axis=1))
+    return table.view(f'S{table.shape[1]}').ravel().astype(str).tolist()
+
+
+def _batches(cues: Iterable[Cue], size: int) -> Iterator[List[Cue]]:
+    iterator = iter(cues)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+_INNER_BLANK_LINES = re.compile(r'\n\s*\n')
+
+
+def _clean_text(text: str) -> str:
+    text = text.strip()
+    # A blank line would end the cue early in SRT and WebVTT
+    return _INNER_BLANK_LINES.sub('\n', text) if '\n' in text else text
+
+
+class _Output:
+    """Open a path for writing, or use an already open file as is."""
+
+    def __init__(self, destination: PathOrFile):
+        self.destination = destination
+        self.file = None
+
+    def __enter__(self) -> IO[str]:
+        if isinstance(self.destination, (str, os.PathLike)):
+            self.file = open(self.destination, 'w', encoding='utf-8')
+            return self.file
+        return self.destination
+
+    def __exit__(self, *exc) -> None:
+        if self.file is not None:
+            self.file.close()
+
+
+def write_srt(cues: Iterable[Cue], destination: PathOrFile, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Write cues as SRT.
+
+    Returns:
+        The number of cues written.
+    """
+    count = 0
+    with _Output(destination) as f:
+        for batch in _batches(cues, batch_size):
+            starts = format_timestamps([cue[0] for cue in batch], 'srt')
+            ends = format_timestamps([cue[1] for cue in batch], 'srt')
+            f.write(''.join([f"{count + i + 1}\n{start} --> {end}\n{_clean_text(cue[2])}\n\n"
+                             for i, (start, end, cue) in enumerate(zip(starts, ends, batch))]))
+            count += len(batch)
+    return count
+
+
+def write_vtt(cues: Iterable[Cue], destination: PathOrFile, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Write cues as WebVTT.
+
+    Returns:
+        The number of cues written.
+    """
+    count = 0
+    with _Output(destination) as f:
+        f.write("WEBVTT\n\n")
+        for batch in _batches(cues, batch_size):
+            starts = format_timestamps([cue[0] for cue in batch], 'vtt')
+            ends = format_timestamps([cue[1] for cue in batch], 'vtt')
+            f.write(''.join([f"{start} --> {end}\n{_clean_text(cue[2])}\n\n"
+                             for start, end, cue in zip(starts, ends, batch)]))
+            count += len(batch)
+    return count
+
+
+def write_lrc(cues: Iterable[Cue], destination: PathOrFile, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Write cues as LRC. LRC only has start times; line breaks inside a cue become spaces.
+
+    Returns:
+        The number of cues written.
+    """
+    count = 0
+    with _Output(destination) as f:
+        for batch in _batches(cues, batch_size):
+            starts = format_timestamps([cue[0] for cue in batch], 'lrc')
+            f.write(''.join([f"{start} {' '.join(cue[2].split())}\n" for start, cue in zip(starts, batch)]))
+            count += len(batch)
+    return count
+
+
+def parse_timestamp(timestamp: str) -> float:
+    """Parse an SRT/WebVTT timestamp ([HH:]MM:SS,mmm or [HH:]MM:SS.mmm) into seconds."""
+    parts = timestamp.strip().replace(',', '.').split(':')
+    seconds = float(parts[-1])
+    minutes = int(parts[-2]) if len(parts) > 1 else 0
+    hours = int(parts[-3]) if len(parts) > 2 else 0
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def parse_timestamps(timestamps: Sequence[str]) -> np.ndarray:
+    """
+    Parse SRT/WebVTT timestamps into seconds, vectorized for the common H...H:MM:SS,mmm shape.
+
+    Timestamps of any other shape (e.g. WebVTT's MM:SS.mmm) fall back to `parse_timestamp`.
+    """
+    if not len(timestamps):
+        return np.zeros(0)
+    table = np.array(timestamps)
+    width = table.dtype.itemsize // 4
+    if width < 12:
+        return np.array([parse_timestamp(timestamp) for timestamp in timestamps])
+    codes = table.view(np.uint32).reshape(len(table), width)
+    lengths = np.char.str_len(table)
+    rows = np.arange(len(table))[:, None]
+    # Everything is aligned on the end of the string: H...H:MM:SS,mmm
+    tail = codes[rows, lengths[:, None] + np.arange(-12, 0)].astype(np.int64) - 48
+    separators = tail[:, [2, 5, 8]] + 48
+    digit_columns = tail[:, [0, 1, 3, 4, 6, 7, 9, 10, 11]]
+    regular = ((lengths >= 12) & (separators[:, 0] == ord(':')) & (separators[:, 1] == ord(':'))
+               & ((separators[:, 2] == ord(',')) | (separators[:, 2] == ord('.')))
+               & np.all((digit_columns >= 0) & (digit_columns <= 9), axis=1))
+    hours = tail[:, 0] * 10 + tail[:, 1]
+    # Hours with more than two digits
+    for extra in range(1, width - 11):
+        present = lengths - 12 - extra >= 0
+        digit = codes[rows[:, 0], np.maximum(lengths - 12 - extra, 0)].astype(np.int64) - 48
+        regular &= ~present | ((digit >= 0) & (digit <= 9))
+        hours += np.where(present, digit, 0) * 10 ** (extra + 1)
+    milliseconds = (hours * 3600000 + (tail[:, 3] * 10 + tail[:, 4]) * 60000
+                    + (tail[:, 6] * 10 + tail[:, 7]) * 1000 + tail[:, 9] * 100 + tail[:, 10] * 10 + tail[:, 11])
+    seconds = milliseconds / 1000.0
+    for index in np.flatnonzero(~regular):
+        seconds[index] = parse_timestamp(timestamps[index])
+    return seconds
+
+
+_BLANK_LINES = re.compile(r'(\n(?:[ \t]*\n)+)')
+READ_SIZE = 1 << 20
+
+
+def _pieces(source) -> Iterator[str]:
+    """Yield the text of an open file in large pieces, or the lines of any other iterable."""
+    first = True
+    if hasattr(source, 'read'):
+        pieces = iter(lambda: source.read(READ_SIZE), '')
+    else:
+        pieces = (line.replace('\r\n', '\n') for line in source)
+    for piece in pieces:
+        if first:
+            piece, first = piece.lstrip('\ufeff'), False
+        yield piece
+
+
+def _blocks(source) -> Iterator[Tuple[int, str]]:
+    """Yield the blocks of text separated by blank lines, with the line number each block starts on."""
+    pending = ''
+    # Line number of the start of `pending`
+    line = 1
+    for piece in _pieces(source):
+        parts = _BLANK_LINES.split(pending + piece)
+        pending = parts.pop()
+        # The separators are captured, so parts alternate between blocks and blank lines
+        for part, separator in zip(parts[0::2], parts[1::2]):
+            if part.strip():
+                yield line + part[:len(part) - len(part.lstrip())].count('\n'), part
+            line += part.count('\n') + separator.count('\n')
+    if pending.strip():
+        yield line + pending[:len(pending) - len(pending.lstrip())].count('\n'), pending
+
+
+def _timed_blocks(source) -> Iterator[Tuple[str, str, str]]:
+    # The timing line identifies a cue, so the index line is optional and text may start with anything (digits included)
+    for line, block in _blocks(source):
+        head, found, rest = block.partition('-->')
+        if not found:
+            # WebVTT header, NOTE, STYLE and REGION blocks
+            continue
+        end_line, _, text = rest.partition('\n')
+        start_line = head[head.rfind('\n') + 1:]
+        # WebVTT cue settings follow the end timestamp
+        end = end_line.split()
+        if not start_line.strip() or not end:
+            # One broken cue should not end the parse of the whole file
+            timing_line = line + head.count('\n')
+            logging.warning(f"Skipping the cue at line {timing_line}: malformed timing line '{start_line}-->{end_line}'")
+            continue
+        yield start_line.strip(), end[0], text.rstrip('\n')
+
+
+def _parse_timed_blocks(source, batch_size: int) -> Iterator[Cue]:
+    for batch in _batches(_timed_blocks(source), batch_size):
+        starts = parse_timestamps([block[0] for block in batch]).tolist()
+        ends = parse_timestamps([block[1] for block in batch]).tolist()
+        yield from map(Cue, starts, ends, [block[2] for block in batch])
+
+
+class _Input:
+    """Open a path for reading, or use an already open file (or any iterable of lines) as is."""
+
+    def __init__(self, source):
+        self.source = source
+        self.file = None
+
+    def __enter__(self):
+        if isinstance(self.source, (str, os.PathLike)):
+            self.file = open(self.source, 'r', encoding='utf-8-sig')
+            return self.file
+        return self.source
+
+    def __exit__(self, *exc) -> None:
+        if self.file is not None:
+            self.file.close()
+
+
+def parse_srt(source, batch_size: int = BATCH_SIZE) -> Iterator[Cue]:
+    """Yield the cues of an SRT file (path, open file or iterable of lines) one at a time."""
+    with _Input(source) as lines:
+        yield from _parse_timed_blocks(lines, batch_size)
+
+
+def parse_vtt(source, batch_size: int = BATCH_SIZE) -> Iterator[Cue]:
+    """Yield the cues of a WebVTT file one at a time. NOTE, STYLE and REGION blocks are skipped."""
+    with _Input(source) as lines:
+        yield from _parse_timed_blocks(lines, batch_size)
+
+
+_LRC_TAG = re.compile(r'\[(\d+):(\d+(?:\.\d+)?)\]')
+
+
+def _lrc_tags(lines: Iterable[str]) -> Iterator[Tuple[str, str, str]]:
+    for line in lines:
+        match = _LRC_TAG.match(line.lstrip('\ufeff \t'))
+        if match is None:
+            # Metadata ([ar:...], [ti:...]) or noise
+            continue
+        line = line.lstrip('\ufeff \t')
+        tags = [match.groups()]
+        position = match.end()
+        while line.startswith('[', position):
+            match = _LRC_TAG.match(line, position)
+            if match is None:
+                break
+            tags.append(match.groups())
+            position = match.end()
+        text = line[position:].strip()
+        for minutes, seconds in tags:
+            yield minutes, seconds, text
+
+
+def parse_lrc(source, last_duration: float = 3.0, batch_size: int = BATCH_SIZE) -> Iterator[Cue]:
+    """
+    Yield the cues of an LRC file one at a time, in order of their start.
+
+    LRC has no end times: a cue ends where the next one starts, and the last cue
+    lasts `last_duration` seconds. Lines with several time tags (e.g. a repeated
+    chorus) yield one cue per tag. Such tags point anywhere in the song, so the
+    start times of the whole file are read and sorted before the first cue is yielded.
+    """
+    starts: List[float] = []
+    texts: List[str] = []
+    with _Input(source) as lines:
+        for batch in _batches(_lrc_tags(lines), batch_size):
+            starts += (np.array([tag[0] for tag in batch], dtype=np.float64) * 60
+                       + np.array([tag[1] for tag in batch], dtype=np.float64)).tolist()
+            texts += [tag[2] for tag in batch]
+    if not starts:
+        return
+    # Stable, so cues starting at the same time keep the order of the file
+    order = np.argsort(np.array(starts), kind='stable').tolist()
+    starts = [starts[i] for i in order]
+    ends = starts[1:] + [starts[-1] + last_duration]
+    yield from map(Cue, starts, ends, (texts[i] for i in order))
+
+
+PARSERS = {'.srt': parse_srt, '.vtt': parse_vtt, '.lrc': parse_lrc}
+WRITERS = {'.srt': write_srt, '.vtt': write_vtt, '.lrc': write_lrc}
+
+
+def convert(source: str, destination: str) -> int:
+    """
+    Convert a subtitle file to another format, picked by file extension, streaming cue by cue.
+
+    Returns:
+        The number of cues written.
+    """
+    parser = PARSERS.get(os.path.splitext(source)[1].lower())
+    writer = WRITERS.get(os.path.splitext(destination)[1].lower())
+    if parser is None or writer is None:
+        raise ValueError(f"Cannot convert {source} to {destination}; supported formats are {sorted(PARSERS)}")
+    return writer(parser(source), destination)
+
+
+def shift_cues(cues: Iterable[Cue], offset: float) -> Iterator[Cue]:
+    """
+    Shift cues by `offset` seconds (negative moves them earlier).
+
+    Cues that end up entirely before 0 are dropped and cues crossing 0 are clipped to start at 0.
+    """
+    for start, end, text in cues:
+        start, end = start + offset, end + offset
+        if end <= 0:
+            continue
+        yield Cue(max(0.0, start), end, text)
+
+
+def concat_tracks(tracks: Iterable[Tuple[Iterable[Cue], float]]) -> Iterator[Cue]:
+    """
+    Join subtitle tracks of consecutive audio parts (e.g. chapters) into one.
+
+    Args:
+        tracks: (cues, offset) pairs, where offset is the start of the part in the joined audio.
+    """
+    for cues, offset in tracks:
+        for start, end, text in cues:
+            yield Cue(start + offset, end + offset, text)
+
+
+def merge_cues(cues: Iterable[Cue], max_gap: float = 0.0, max_chars: int = 84) -> Iterator[Cue]:
+    """
+    Merge consecutive cues that are at most `max_gap` seconds apart while the merged text fits in `max_chars`.
+    """
+    current: Optional[Cue] = None
+    for cue in cues:
+        cue = Cue(*cue)
+        if (current is not None and cue.start - current.end <= max_gap
+                and len(current.text) + 1 + len(cue.text) <= max_chars):
+            current = Cue(current.start, max(current.end, cue.end), f"{current.text} {cue.text}")
+            continue
+        if current is not None:
+            yield current
+        current = cue
+    if current is not None:
+        yield current
+
+
+def split_cue(cue: Cue, max_chars: int = 42) -> List[Cue]:
+    """
+    Split a cue whose text is longer than `max_chars` at word boundaries.
+
+    The cue's time is shared between the pieces in proportion to their length,
+    so the pieces exactly cover the original cue.
+    """
+    words = cue.text.split()
+    pieces: List[str] = []
+    for word in words:
+        if pieces and len(pieces[-1]) + 1 + len(word) <= max_chars:
+            pieces[-1] += ' ' + word
+        else:
+            pieces.append(word)
+    if len(pieces) <= 1:
+        return [Cue(*cue)]
+
+    lengths = np.array([len(piece) for piece in pieces], dtype=np.float64)
+    bounds = cue.start + (cue.end - cue.start) * np.concatenate(([0.0], np.cumsum(lengths))) / lengths.sum()
+    bounds[-1] = cue.end
+    return [Cue(float(bounds[i]), float(bounds[i + 1]), piece) for i, piece in enumerate(pieces)]
+
+
+def split_cues(cues: Iterable[Cue], max_chars: int = 42) -> Iterator[Cue]:
+    """Split every cue longer than `max_chars`; see `split_cue`."""
+    for cue in cues:
+        yield from split_cue(cue, max_chars)
@@ -0,0 +1,570 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from urllib.parse import parse_qs
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+'''
+Shared work queue for distributed synthesis.
+
+A coordinator publishes the chunks of a book as jobs; worker processes on any
+number of nodes claim them, synthesize them and write the audio back. A claim
+is a lease: the worker extends it with heartbeats while it works, and a job
+whose lease expires (the worker died or hung) is put back in the queue by the
+coordinator. Results are accepted only from the worker currently holding the
+lease, so a job that was re-queued and finished twice is stored once.
+
+Two backends implement the same interface:
+
+* SQLiteWorkQueue: a single SQLite file, e.g. on storage shared by the nodes.
+* RedisWorkQueue: any Redis-compatible server, through a client passed in.
+
+Lease expiry uses each node's wall clock, so node clocks should be kept in sync
+(NTP) to well within the lease duration.
+'''
+
+DEFAULT_LEASE_SECONDS = 60.0
+
+
+def _text(value) -> str:
+    # Redis clients return bytes
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class Job(NamedTuple):
+    batch: str
+    index: int
+    payload: Dict[str, Any]
+    attempts: int
+
+
+class JobResult(NamedTuple):
+    index: int
+    data: bytes
+    meta: Dict[str, Any]
+
+
+class WorkQueue(ABC):
+    """Interface of the shared work queue. Jobs are identified by their batch (e.g. a book) and index in it."""
+
+    @abstractmethod
+    def publish(self, batch: str, jobs: Iterable[Tuple[int, Dict[str, Any]]], max_attempts: Optional[int] = None) -> int:
+        """
+        Publish (index, payload) jobs. A job that is already queued, leased or done with the same payload is left alone;
+        otherwise it is (re-)queued.
+
+        `max_attempts` (default: the queue's) is stored with every job, so failures reported by workers,
+        whatever their own queue settings, are retried as often as the publisher asked.
+
+        Returns:
+            The number of jobs queued.
+        """
+
+    @abstractmethod
+    def claim(self, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> Optional[Job]:
+        """Lease the oldest queued job to `worker`, or return None when nothing is queued."""
+
+    @abstractmethod
+    def heartbeat(self, job: Job, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        """Extend the lease of a job. Returns False when `worker` no longer holds it."""
+
+    @abstractmethod
+    def complete(self, job: Job, worker: str, data: bytes, meta: Dict[str, Any]) -> bool:
+        """Store the result of a job. Returns False (and drops the result) when `worker` no longer holds the lease."""
+
+    @abstractmethod
+    def fail(self, job: Job, worker: str, error: str) -> None:
+        """Give a job back after an error; it is re-queued until it has used up its attempts."""
+
+    @abstractmethod
+    def requeue_expired(self) -> int:
+        """Re-queue the jobs whose lease has expired. Returns the number of jobs re-queued."""
+
+    @abstractmethod
+    def take_results(self, batch: str) -> List[JobResult]:
+        """Return the results of a batch that are done and remove them from the queue."""
+
+    @abstractmethod
+    def take_failures(self, batch: str) -> Dict[int, str]:
+        """Return the jobs of a batch that used up their attempts, with their last error, and remove them."""
+
+    @abstractmethod
+    def purge(self, batch: str) -> None:
+        """Remove every job of a batch."""
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteWorkQueue(WorkQueue):
+    def __init__(self, path: str, max_attempts: int = 3, wal: bool = False, busy_timeout: float = 30.0):
+        """
+        Work queue in a SQLite file.
+
+        Args:
+            path: Path of the database file.
+            max_attempts: Claims a job published without `max_attempts` gets before it is reported as failed.
+            wal: Use write-ahead logging, so readers never block the writer. WAL needs shared memory
+                between the processes, which network file systems such as NFS do not provide, so it is
+                only safe when every worker runs on the same host. Off by default (rollback journal).
+            busy_timeout: Seconds a write waits for the database lock.
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Transactions are opened explicitly; one connection is shared by the threads of a process
+        self._db = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            # Set either way, since the journal mode of a database file persists across connections
+            self._db.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+            # NORMAL is only crash-safe with WAL
+            self._db.execute(f"PRAGMA synchronous={'NORMAL' if wal else 'FULL'}")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    batch TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,  -- pending, leased, done, failed or collected
+                    worker TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    error TEXT,
+                    meta TEXT,
+                    result BLOB,
+                    PRIMARY KEY (batch, idx))""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, batch)")
+
+    def _transaction(self, statements: Callable[[sqlite3.Connection], Any]) -> Any:
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can never claim the same job
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self._db)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return result
+
+    def publish(self, batch: str, jobs: Iterable[Tuple[int, Dict[str, Any]]], max_attempts: Optional[int] = None) -> int:
+        rows = [(batch, index, json.dumps(payload, sort_keys=True)) for index, payload in jobs]
+        max_attempts = max_attempts or self.max_attempts
+
+        def statements(db):
+            queued = 0
+            for batch_, index, payload in rows:
+                current = db.execute("SELECT payload, state FROM jobs WHERE batch = ? AND idx = ?", (batch_, index)).fetchone()
+                if current is not None and current[0] == payload and current[1] in ('pending', 'leased', 'done'):
+                    continue
+                db.execute("INSERT OR REPLACE INTO jobs (batch, idx, payload, state, attempts, max_attempts) "
+                           "VALUES (?, ?, ?, 'pending', 0, ?)", (batch_, index, payload, max_attempts))
+                queued += 1
+            return queued
+        return self._transaction(statements)
+
+    def claim(self, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> Optional[Job]:
+        def statements(db):
+            row = db.execute("SELECT rowid, batch, idx, payload, attempts FROM jobs WHERE state = 'pending' "
+                             "ORDER BY rowid LIMIT 1").fetchone()
+            if row is None:
+                return None
+            rowid, batch, index, payload, attempts = row
+            db.execute("UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE rowid = ?",
+                       (worker, time.time() + lease_seconds, rowid))
+            return Job(batch, index, json.loads(payload), attempts + 1)
+        return self._transaction(statements)
+
+    def heartbeat(self, job: Job, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        return self._transaction(lambda db: db.execute(
+            "UPDATE jobs SET lease_until = ? WHERE batch = ? AND idx = ? AND state = 'leased' AND worker = ?",
+            (time.time() + lease_seconds, job.batch, job.index, worker)).rowcount == 1)
+
+    def complete(self, job: Job, worker: str, data: bytes, meta: Dict[str, Any]) -> bool:
+        return self._transaction(lambda db: db.execute(
+            "UPDATE jobs SET state = 'done', result = ?, meta = ?, worker = NULL, lease_until = NULL "
+            "WHERE batch = ? AND idx = ? AND state = 'leased' AND worker = ?",
+            (sqlite3.Binary(data), json.dumps(meta), job.batch, job.index, worker)).rowcount == 1)
+
+    def fail(self, job: Job, worker: str, error: str) -> None:
+        self._transaction(lambda db: db.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, error = ?, "
+            "worker = NULL, lease_until = NULL WHERE batch = ? AND idx = ? AND state = 'leased' AND worker = ?",
+            (error, job.batch, job.index, worker)))
+
+    def requeue_expired(self) -> int:
+        return self._transaction(lambda db: db.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+            "error = COALESCE(error, 'lease expired'), worker = NULL, lease_until = NULL "
+            "WHERE state = 'leased' AND lease_until < ?", (time.time(),)).rowcount)
+
+    def take_results(self, batch: str) -> List[JobResult]:
+        def statements(db):
+            rows = db.execute("SELECT idx, result, meta FROM jobs WHERE batch = ? AND state = 'done' ORDER BY idx", (batch,)).fetchall()
+            # Collected jobs are queued again when published again, e.g. by a coordinator restarted before storing them
+            db.execute("UPDATE jobs SET state = 'collected', result = NULL WHERE batch = ? AND state = 'done'", (batch,))
+            return [JobResult(index, bytes(result), json.loads(meta)) for index, result, meta in rows]
+        return self._transaction(statements)
+
+    def take_failures(self, batch: str) -> Dict[int, str]:
+        def statements(db):
+            rows = db.execute("SELECT idx, error FROM jobs WHERE batch = ? AND state = 'failed'", (batch,)).fetchall()
+            db.execute("DELETE FROM jobs WHERE batch = ? AND state = 'failed'", (batch,))
+            return dict(rows)
+        return self._transaction(statements)
+
+    def purge(self, batch: str) -> None:
+        self._transaction(lambda db: db.execute("DELETE FROM jobs WHERE batch = ?", (batch,)))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class RedisWorkQueue(WorkQueue):
+    def __init__(self, client, name: str = 'tts', max_attempts: int = 3):
+        """
+        Work queue on a Redis-compatible server.
+
+        Args:
+            client: A redis-py compatible client (e.g. `redis.Redis.from_url(...)`); audio is stored as binary,
+                so the client must not decode responses.
+            name: Prefix of every key the queue uses.
+            max_attempts: Claims a job published without `max_attempts` gets before it is reported as failed.
+        """
+        self.client = client
+        self.name = name
+        self.max_attempts = max_attempts
+        self._orphans = set()
+
+    def _key(self, *parts: str) -> str:
+        return ':'.join((self.name,) + parts)
+
+    @staticmethod
+    def _job_id(batch: str, index: int) -> str:
+        return json.dumps([batch, index])
+
+    def publish(self, batch: str, jobs: Iterable[Tuple[int, Dict[str, Any]]], max_attempts: Optional[int] = None) -> int:
+        max_attempts = max_attempts or self.max_attempts
+        queued = 0
+        for index, payload in jobs:
+            job_id = self._job_id(batch, index)
+            payload = json.dumps(payload, sort_keys=True)
+            current = self.client.hget(self._key('payloads'), job_id)
+            if current is not None and _text(current) == payload and (
+                    self.client.zscore(self._key('pending'), job_id) is not None
+                    or self.client.zscore(self._key('leases'), job_id) is not None
+                    or self.client.hexists(self._key('results', batch), index)):
+                continue
+            sequence = self.client.incr(self._key('sequence'))
+            pipe = self.client.pipeline()
+            pipe.hset(self._key('payloads'), job_id, payload)
+            pipe.hset(self._key('attempts'), job_id, 0)
+            pipe.hset(self._key('sequences'), job_id, sequence)
+            pipe.hset(self._key('max_attempts'), job_id, max_attempts)
+            pipe.hdel(self._key('failed', batch), index)
+            pipe.zadd(self._key('pending'), {job_id: sequence})
+            pipe.execute()
+            queued += 1
+        return queued
+
+    def claim(self, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> Optional[Job]:
+        popped = self.client.zpopmin(self._key('pending'))
+        if not popped:
+            return None
+        job_id = _text(popped[0][0])
+        pipe = self.client.pipeline()
+        pipe.zadd(self._key('leases'), {job_id: time.time() + lease_seconds})
+        pipe.hset(self._key('owners'), job_id, worker)
+        pipe.hincrby(self._key('attempts'), job_id, 1)
+        pipe.hget(self._key('payloads'), job_id)
+        _, _, attempts, payload = pipe.execute()
+        batch, index = json.loads(job_id)
+        return Job(batch, index, json.loads(payload), attempts)
+
+    def _if_owner(self, job: Job, worker: str, commands: Callable[[Any], None]) -> bool:
+        """Queue `commands` on a transaction that only commits while `worker` holds the lease of `job`."""
+        from redis.exceptions import WatchError
+
+        job_id = self._job_id(job.batch, job.index)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    # The transaction is dropped if an expiry sweep or another claim touches the lease meanwhile
+                    pipe.watch(self._key('owners'), self._key('leases'))
+                    owner = pipe.hget(self._key('owners'), job_id)
+                    if owner is None or _text(owner) != worker or pipe.zscore(self._key('leases'), job_id) is None:
+                        return False
+                    pipe.multi()
+                    commands(pipe)
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+
+    def _release(self, pipe, job_id: str) -> None:
+        pipe.zrem(self._key('leases'), job_id)
+        pipe.hdel(self._key('owners'), job_id)
+
+    def heartbeat(self, job: Job, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        job_id = self._job_id(job.batch, job.index)
+        return self._if_owner(job, worker, lambda pipe: pipe.zadd(self._key('leases'), {job_id: time.time() + lease_seconds}))
+
+    def complete(self, job: Job, worker: str, data: bytes, meta: Dict[str, Any]) -> bool:
+        def commands(pipe):
+            self._release(pipe, self._job_id(job.batch, job.index))
+            pipe.hset(self._key('results', job.batch), job.index, data)
+            pipe.hset(self._key('meta', job.batch), job.index, json.dumps(meta))
+        return self._if_owner(job, worker, commands)
+
+    def _requeue(self, pipe, job_id: str, error: str) -> None:
+        # Reads go to the client: attempts and limits do not change while a job is leased
+        batch, index = json.loads(job_id)
+        attempts = int(self.client.hget(self._key('attempts'), job_id) or 0)
+        if attempts >= int(self.client.hget(self._key('max_attempts'), job_id) or self.max_attempts):
+            pipe.hset(self._key('failed', batch), index, error)
+        else:
+            # Back in its original place, ahead of the jobs published after it
+            pipe.zadd(self._key('pending'), {job_id: float(self.client.hget(self._key('sequences'), job_id))})
+
+    def fail(self, job: Job, worker: str, error: str) -> None:
+        job_id = self._job_id(job.batch, job.index)
+
+        def commands(pipe):
+            self._release(pipe, job_id)
+            self._requeue(pipe, job_id, error)
+        self._if_owner(job, worker, commands)
+
+    def requeue_expired(self) -> int:
+        requeued = 0
+        for job_id in self.client.zrangebyscore(self._key('leases'), '-inf', time.time()):
+            job_id = _text(job_id)
+            # Removing the lease is atomic: only one of the owner and the sweeps can win it
+            if not self.client.zrem(self._key('leases'), job_id):
+                continue  # completed or swept by someone else in the meantime
+            self.client.hdel(self._key('owners'), job_id)
+            self._requeue(self.client, job_id, 'lease expired')
+            requeued += 1
+        return requeued + self._requeue_orphans()
+
+    def _requeue_orphans(self) -> int:
+        # Popping a job and leasing it are two commands, so a worker dying in between leaves a job that is
+        # neither queued nor leased. Jobs seen in that state by two consecutive sweeps are queued again.
+        job_ids = [_text(job_id) for job_id in self.client.hkeys(self._key('payloads'))]
+        pipe = self.client.pipeline()
+        for job_id in job_ids:
+            batch, index = json.loads(job_id)
+            pipe.zscore(self._key('pending'), job_id)
+            pipe.zscore(self._key('leases'), job_id)
+            pipe.hexists(self._key('results', batch), index)
+            pipe.hexists(self._key('failed', batch), index)
+        states = pipe.execute()
+        orphans = {job_id for n, job_id in enumerate(job_ids)
+                   if states[4 * n] is None and states[4 * n + 1] is None and not states[4 * n + 2] and not states[4 * n + 3]}
+        requeued = 0
+        for job_id in orphans & self._orphans:
+            self._requeue(self.client, job_id, 'worker died while claiming')
+            requeued += 1
+        self._orphans = orphans - self._orphans
+        return requeued
+
+    def _forget(self, pipe, batch: str, indices: Iterable) -> None:
+        job_ids = [self._job_id(batch, int(index)) for index in indices]
+        for key in ('payloads', 'attempts', 'sequences', 'max_attempts'):
+            pipe.hdel(self._key(key), *job_ids)
+
+    def take_results(self, batch: str) -> List[JobResult]:
+        results = self.client.hgetall(self._key('results', batch))
+        if not results:
+            return []
+        meta = self.client.hgetall(self._key('meta', batch))
+        pipe = self.client.pipeline()
+        pipe.hdel(self._key('results', batch), *results)
+        pipe.hdel(self._key('meta', batch), *results)
+        self._forget(pipe, batch, results)
+        pipe.execute()
+        return sorted((JobResult(int(index), bytes(data), json.loads(meta[index])) for index, data in results.items()),
+                      key=lambda result: result.index)
+
+    def take_failures(self, batch: str) -> Dict[int, str]:
+        failures = self.client.hgetall(self._key('failed', batch))
+        if failures:
+            pipe = self.client.pipeline()
+            pipe.hdel(self._key('failed', batch), *failures)
+            self._forget(pipe, batch, failures)
+            pipe.execute()
+        return {int(index): _text(error) for index, error in failures.items()}
+
+    def purge(self, batch: str) -> None:
+        for job_id in self.client.hkeys(self._key('payloads')):
+            if json.loads(job_id)[0] == batch:
+                for key in ('pending', 'leases'):
+                    self.client.zrem(self._key(key), job_id)
+                for key in ('payloads', 'attempts', 'sequences', 'max_attempts', 'owners'):
+                    self.client.hdel(self._key(key), job_id)
+        self.client.delete(self._key('results', batch), self._key('meta', batch), self._key('failed', batch))
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def open_work_queue(url: str, max_attempts: int = 3) -> WorkQueue:
+    """
+    Open a work queue from a URL: `redis://host:port/db` for Redis, anything else
+    (optionally prefixed with `sqlite://`) is the path of a SQLite file.
+
+    SQLite files use a rollback journal, which works on shared network storage. When the
+    coordinator and every worker run on one host, `?wal=1` (e.g. `sqlite:///tmp/queue.db?wal=1`)
+    switches to write-ahead logging.
+    """
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        import redis
+        return RedisWorkQueue(redis.Redis.from_url(url), max_attempts=max_attempts)
+    if url.startswith('sqlite://'):
+        url = url[len('sqlite://'):]
+    path, _, query = url.partition('?')
+    options = parse_qs(query)
+    wal = options.get('wal', ['0'])[-1].lower() in ('1', 'true', 'yes', 'on')
+    return SQLiteWorkQueue(path, max_attempts=max_attempts, wal=wal)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class _Heartbeat:
+    """Keeps the lease of a job alive from a background thread while the job runs."""
+
+    def __init__(self, queue: WorkQueue, job: Job, worker: str, lease_seconds: float):
+        self.queue = queue
+        self.job = job
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                if not self.queue.heartbeat(self.job, self.worker, self.lease_seconds):
+                    logging.warning(f"Lost the lease of job {self.job.batch}/{self.job.index}")
+                    self.lost = True
+                    return
+            except Exception as e:
+                # A missed heartbeat is not fatal; the lease has two more intervals to go
+                logging.warning(f"Heartbeat for job {self.job.batch}/{self.job.index} failed: {e}")
+
+    def __enter__(self) -> '_Heartbeat':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(queue: WorkQueue, synthesize: Callable[[Dict[str, Any]], Tuple[bytes, Dict[str, Any]]],
+               worker: Optional[str] = None, lease_seconds: float = DEFAULT_LEASE_SECONDS, poll_interval: float = 1.0,
+               idle_timeout: Optional[float] = None, max_jobs: Optional[int] = None,
+               stop: Optional[threading.Event] = None) -> int:
+    """
+    Claim and run jobs until stopped.
+
+    Args:
+        queue: The shared work queue.
+        synthesize: Turns a job payload into (audio bytes, metadata). Models it loads stay warm between jobs.
+        worker: Name of this worker in leases. Defaults to host name and process id.
+        lease_seconds: Lease duration; it is renewed every third of it while a job runs.
+        poll_interval: Seconds to wait before polling again when the queue is empty.
+        idle_timeout: Stop after the queue has been empty this long. None waits forever.
+        max_jobs: Stop after this many jobs.
+        stop: Event that stops the worker after its current job.
+
+    Returns:
+        The number of jobs completed.
+    """
+    worker = worker or default_worker_id()
+    completed = 0
+    idle_since = time.monotonic()
+    logging.info(f"Worker {worker} started")
+    while not (stop is not None and stop.is_set()) and (max_jobs is None or completed < max_jobs):
+        job = queue.claim(worker, lease_seconds)
+        if job is None:
+            if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        logging.info(f"Worker {worker} claimed job {job.batch}/{job.index} (attempt {job.attempts})")
+        try:
+            with _Heartbeat(queue, job, worker, lease_seconds):
+                data, meta = synthesize(job.payload)
+        except Exception as e:
+            logging.error(f"Job {job.batch}/{job.index} failed: {e}")
+            queue.fail(job, worker, str(e))
+        else:
+            if queue.complete(job, worker, data, dict(meta, worker=worker)):
+                completed += 1
+            else:
+                logging.warning(f"Result of job {job.batch}/{job.index} dropped: the lease had expired")
+        idle_since = time.monotonic()
+    logging.info(f"Worker {worker} stopped after {completed} jobs")
+    return completed
+
+
+def collect_batch(queue: WorkQueue, batch: str, indices: Iterable[int], on_result: Callable[[JobResult], None],
+                  poll_interval: float = 1.0, stall_timeout: Optional[float] = None) -> Dict[int, str]:
+    """
+    Coordinator loop: wait until every job of a batch is done or failed, re-queuing expired leases meanwhile.
+
+    Args:
+        queue: The shared work queue.
+        batch: The batch the jobs were published in.
+        indices: The jobs to wait for.
+        on_result: Called with every result as it arrives, in index order within each poll.
+        poll_interval: Seconds between polls.
+        stall_timeout: Give up when no job has finished for this many seconds, e.g. because no worker
+            is running. None waits forever.
+
+    Returns:
+        The jobs that failed, with their last error.
+
+    Raises:
+        TimeoutError: If no job finished within `stall_timeout`.
+    """
+    outstanding = set(indices)
+    failures: Dict[int, str] = {}
+    total = len(outstanding)
+    last_progress = time.monotonic()
+    while outstanding:
+        requeued = queue.requeue_expired()
+        if requeued:
+            logging.warning(f"Re-queued {requeued} jobs with expired leases")
+        finished = len(outstanding)
+        for result in queue.take_results(batch):
+            if result.index in outstanding:
+                on_result(result)
+                outstanding.discard(result.index)
+        for index, error in queue.take_failures(batch).items():
+            if index in outstanding:
+                logging.error(f"Job {batch}/{index} failed: {error}")
+                failures[index] = error
+                outstanding.discard(index)
+        if len(outstanding) < finished:
+            last_progress = time.monotonic()
+        if outstanding:
+            stalled = time.monotonic() - last_progress
+            if stall_timeout is not None and stalled >= stall_timeout:
+                raise TimeoutError(f"No job of {batch} finished in {stalled:.0f} s with {len(outstanding)} of {total} "
+                                   f"outstanding; check that workers are running against this queue")
+            logging.info(f"{total - len(outstanding)}/{total} jobs of {batch} done")
+            time.sleep(poll_interval)
+    return failures
@@ -0,0 +1,87 @@
+import os
+import json
+import argparse
+import logging
+import tempfile
+from typing import Any, Dict, Tuple
+
+from main import setup_logging, synthesize_chunk, create_failover_backend
+from utils.audio_postprocess import AudioPostProcessor
+from utils.work_queue import DEFAULT_LEASE_SECONDS, default_worker_id, open_work_queue, run_worker
+from tts.resilience import ResilientSynthesizer
+
+'''
+Synthesis worker for distributed conversion.
+
+Start any number of workers, on any number of machines, against the work queue
+given to `main.py --queue`; they render the chunks the coordinator publishes.
+Models, post-processors and failover chains are created on the first job that
+needs them and kept warm for every following job.
+
+    python worker.py /shared/queue.db --idle_timeout 300
+    python worker.py redis://queue-host:6379/0
+'''
+
+_POSTPROCESSORS: Dict[str, AudioPostProcessor] = {}
+_SYNTHESIZERS: Dict[str, ResilientSynthesizer] = {}
+
+
+def _postprocessor(params: Dict[str, Any]) -> AudioPostProcessor:
+    key = json.dumps(params, sort_keys=True)
+    if key not in _POSTPROCESSORS:
+        _POSTPROCESSORS[key] = AudioPostProcessor(**params)
+    return _POSTPROCESSORS[key]
+
+
+def _synthesizer(failover: Dict[str, Any], model_options: Dict) -> ResilientSynthesizer:
+    key = json.dumps([failover, model_options], sort_keys=True)
+    if key not in _SYNTHESIZERS:
+        backends = [create_failover_backend(tool, True, model_options, failover['timeout']) for tool in failover['chain']]
+        _SYNTHESIZERS[key] = ResilientSynthesizer(backends, timeout=failover['timeout'], language=failover['language'])
+    return _SYNTHESIZERS[key]
+
+
+def synthesize_job(payload: Dict[str, Any], temp_folder: str) -> Tuple[bytes, Dict[str, Any]]:
+    """Render the chunk described by a job payload (see `main.chunk_job`) to PCM. Models never prompt for parameters."""
+    postprocessor = _postprocessor(payload['postprocess']) if payload['postprocess'] else None
+    synthesizer = None
+    if payload['failover']:
+        synthesizer = _synthesizer(payload['failover'], payload['model_options'])
+    temp_output_file = os.path.join(temp_folder, f"chunk.{os.getpid()}.tmp.mp3")
+    chunk_audio, backend = synthesize_chunk(payload['index'], payload['text'], temp_output_file, payload['tts_tool'],
+                                            True, postprocessor, payload['paragraph_end'],
+                                            payload['model_options'], synthesizer)
+    if chunk_audio is None:
+        raise RuntimeError(f"No audio was produced for chunk {payload['index']+1}")
+    meta = {'sample_rate': chunk_audio.sample_rate, 'channels': chunk_audio.channels,
+            'sample_width': chunk_audio.sample_width, 'backend': backend}
+    return bytes(chunk_audio.pcm), meta
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Synthesis worker for main.py --queue')
+    parser.add_argument('queue', type=str, help='Work queue: SQLite file on shared storage (sqlite://path?wal=1 when all processes share one host) or redis:// URL')
+    parser.add_argument('--worker_id', type=str, default=None, help='Name of this worker (default: host name and process id)')
+    parser.add_argument('--lease_seconds', type=float, default=DEFAULT_LEASE_SECONDS, help='Lease of a claimed chunk, renewed while it is synthesized')
+    parser.add_argument('--poll_interval', type=float, default=1.0, help='Seconds between polls of an empty queue')
+    parser.add_argument('--idle_timeout', type=float, default=None, help='Exit after the queue has been empty this many seconds')
+    parser.add_argument('--max_jobs', type=int, default=None, help='Exit after this many chunks')
+    parser.add_argument('--temp_folder', type=str, default=tempfile.gettempdir(), help='Folder for scratch audio files')
+    parser.add_argument('--log_level', type=str, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], default='INFO', help='Logging level')
+    args = parser.parse_args()
+
+    setup_logging(args.log_level)
+    work_queue = open_work_queue(args.queue)
+    try:
+        run_worker(work_queue, lambda payload: synthesize_job(payload, args.temp_folder), args.worker_id or default_worker_id(),
+                   args.lease_seconds, args.poll_interval, args.idle_timeout, args.max_jobs)
+    except KeyboardInterrupt:
+        logging.info("Worker interrupted; its current chunk is re-queued when the lease expires")
+    finally:
+        work_queue.close()
+        for synthesizer in _SYNTHESIZERS.values():
+            synthesizer.close()
+
+
+if __name__ == "__main__":
+    main()